@@ -202,7 +202,9 @@ export default function CartPage() {
                           <div className="relative w-20 h-20 rounded-md overflow-hidden flex-shrink-0">
                             <Image
                               src={
-                                item.product_detail?.image || "/placeholder.svg"
+                                item.product_detail?.image_renditions?.thumbnail_webp ||
+                                item.product_detail?.image ||
+                                "/placeholder.svg"
                               }
                               alt={item.product_detail?.name || "Product"}
                               fill
@@ -2,7 +2,7 @@ from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
 from .models import (
     User, Category, Retailer, Product, CartItem, 
-    Wishlist, Order, OrderItem, PromoCode, Review, BinaryFile
+    Wishlist, Order, OrderItem, PromoCode, Review, BinaryFile, ExpiringToken
 )
 
 @admin.register(User)
@@ -62,6 +62,10 @@ class OrderAdmin(admin.ModelAdmin):
     readonly_fields = ('order_number', 'created_at', 'updated_at')
     date_hierarchy = 'created_at'
     inlines = [OrderItemInline]
+    
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        form.instance.sync_retailer_links()
 
 @admin.register(PromoCode)
 class PromoCodeAdmin(admin.ModelAdmin):
@@ -80,3 +84,10 @@ class BinaryFileAdmin(admin.ModelAdmin):
     list_display = ('name', 'file_type', 'size', 'uploaded_at')
     list_filter = ('file_type', 'uploaded_at')
     search_fields = ('name', 'description')
+
+@admin.register(ExpiringToken)
+class ExpiringTokenAdmin(admin.ModelAdmin):
+    list_display = ('user', 'created', 'expires_at')
+    search_fields = ('user__username',)
+    raw_id_fields = ('user',)
+    date_hierarchy = 'expires_at'
@@ -0,0 +1,212 @@
+"""
+Native async views for the hottest catalog reads.
+
+When ASYNC_CATALOG_VIEWS is on (backend/asgi.py turns it on), GET and HEAD
+requests for the product list and detail, the category list and the cart
+summary are served here instead of by the DRF viewsets; every other method is
+handed to the viewset. The views reuse the viewsets' querysets, serializers,
+pagination and catalog cache entries, but query through the async ORM and
+read caches through the async cache API, so while one request waits the
+worker's event loop serves others instead of parking a thread per request.
+
+Responses are always JSON; the browsable API is only on the DRF views.
+Conditional requests are answered like the viewsets' (api/conditional.py),
+with the same validators.
+"""
+import functools
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.http import HttpResponse
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework import exceptions
+from rest_framework.authentication import get_authorization_header
+from rest_framework.views import APIView
+
+from .authentication import CachedTokenAuthentication
+from .cart import aget_cart_summary
+from .catalog_cache import aresponse_key, get_cache, record
+from .conditional import ConditionalGetMixin, not_modified, with_validators
+from .db import replica_reads
+from .metrics import serialization
+from .pagination import apaginate_page_numbers
+from .renderers import FastJSONRenderer
+from .views import CartItemViewSet, CategoryViewSet, ProductViewSet, ValuesListMixin
+
+_token_auth = CachedTokenAuthentication()
+_renderer = FastJSONRenderer()
+
+
+def _json(data, status=200):
+    return HttpResponse(_renderer.render(data), status=status, content_type=_renderer.media_type)
+
+
+def _error(exc):
+    if isinstance(exc, (exceptions.NotAuthenticated, exceptions.AuthenticationFailed)):
+        # As DRF does when the first authenticator has a WWW-Authenticate challenge
+        exc.status_code = 401
+    data = exc.detail if isinstance(exc.detail, (list, dict)) else {'detail': exc.detail}
+    response = _json(data, exc.status_code)
+    if exc.status_code == 401:
+        response['WWW-Authenticate'] = _token_auth.authenticate_header(None)
+    return response
+
+
+def async_safe_methods(sync_view):
+    """Serve GET and HEAD with the decorated coroutine and anything else with ``sync_view``."""
+    def decorator(handler):
+        @functools.wraps(handler)
+        async def view(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return await sync_to_async(sync_view)(request, *args, **kwargs)
+            try:
+                return await handler(request, *args, **kwargs)
+            except exceptions.APIException as exc:
+                return _error(exc)
+        # Name requests after the viewset action in api/metrics.py
+        view.actions = sync_view.actions
+        view.initkwargs = sync_view.initkwargs
+        # DRF enforces CSRF itself, for session authenticated writes only
+        return csrf_exempt(view)
+    return decorator
+
+
+def _viewset(viewset_class, action, request, **kwargs):
+    view = viewset_class(action=action, args=(), kwargs=kwargs, format_kwarg=None, headers={})
+    view.request = APIView.initialize_request(view, request)
+    return view
+
+
+async def authenticate(view):
+    """Authenticate ``view.request`` like the DRF authenticator chain would."""
+    request = view.request
+    header = get_authorization_header(request).split()
+    if len(header) == 2 and header[0].lower() == _token_auth.keyword.lower().encode():
+        try:
+            key = header[1].decode()
+        except UnicodeError:
+            raise exceptions.AuthenticationFailed(
+                'Invalid token header. Token string should not contain invalid characters.'
+            )
+        request.user, request.auth = await _token_auth.aauthenticate_credentials(key)
+        request._authenticator = _token_auth
+    elif header or settings.SESSION_COOKIE_NAME in request.COOKIES:
+        # Malformed token headers, basic and session auth take the sync path
+        await sync_to_async(lambda: request.user)()
+    else:
+        request._not_authenticated()
+    return request.user
+
+
+async def _cached(view, pk, build):
+    """Return ``view``'s response data from the catalog cache, or ``build()`` and store it."""
+    if not getattr(settings, 'CATALOG_CACHE_ENABLED', True):
+        return await build()
+
+    resource = f'{view.cache_resource}-{view.action}'
+    cache = get_cache()
+    key = await aresponse_key(view.cache_resource, view.action, pk, view.request)
+    data = await cache.aget(key)
+    if data is not None:
+        record(resource, 'hits')
+        return data
+
+    record(resource, 'misses')
+    data = await build()
+    await cache.aset(key, data)
+    return data
+
+
+async def _conditional(view, pk, respond):
+    """Answer 304 if the request's validators match, else ``await respond()`` with validators."""
+    if not isinstance(view, ConditionalGetMixin):
+        return await respond()
+    try:
+        with replica_reads():
+            aggregates = await view.aget_aggregates(view.request, pk)
+    except (DjangoValidationError, TypeError, ValueError):
+        return await respond()
+    validators = view.validators(view.request, pk, aggregates, _renderer.format)
+    if validators is None:
+        return await respond()
+    response = not_modified(view.request, *validators) or await respond()
+    return with_validators(response, *validators, private=view.conditional_per_user)
+
+
+async def _list(viewset_class, request):
+    view = _viewset(viewset_class, 'list', request)
+    await authenticate(view)
+    view.check_permissions(view.request)
+
+    async def build():
+        with replica_reads():
+            if isinstance(view, ValuesListMixin):
+                queryset, serializer = view.list_values()
+                represent = serializer.represent
+            else:
+                queryset = view.filter_queryset(view.get_queryset())
+                def represent(rows):
+                    with serialization():
+                        return view.get_serializer(rows, many=True).data
+            paginator = view.paginator
+            if paginator is None:
+                return represent([row async for row in queryset])
+            if hasattr(paginator, 'apaginate_queryset'):
+                page = await paginator.apaginate_queryset(queryset, view.request, view=view)
+            else:
+                page = await apaginate_page_numbers(paginator, queryset, view.request)
+            return paginator.get_paginated_response(represent(page)).data
+
+    async def respond():
+        return _json(await _cached(view, None, build))
+
+    return await _conditional(view, None, respond)
+
+
+async def _retrieve(viewset_class, request, pk):
+    view = _viewset(viewset_class, 'retrieve', request, pk=pk)
+    await authenticate(view)
+    view.check_permissions(view.request)
+
+    async def build():
+        with replica_reads():
+            queryset = view.filter_queryset(view.get_queryset())
+            try:
+                instance = await queryset.aget(pk=pk)
+            except (queryset.model.DoesNotExist, DjangoValidationError, TypeError, ValueError):
+                raise exceptions.NotFound()
+        view.check_object_permissions(view.request, instance)
+        with serialization():
+            return view.get_serializer(instance).data
+
+    async def respond():
+        return _json(await _cached(view, pk, build))
+
+    return await _conditional(view, pk, respond)
+
+
+@async_safe_methods(ProductViewSet.as_view({'get': 'list', 'post': 'create'}, basename='product'))
+async def product_list(request):
+    return await _list(ProductViewSet, request)
+
+
+@async_safe_methods(ProductViewSet.as_view({
+    'get': 'retrieve', 'put': 'update', 'patch': 'partial_update', 'delete': 'destroy',
+}, basename='product'))
+async def product_detail(request, pk):
+    return await _retrieve(ProductViewSet, request, pk)
+
+
+@async_safe_methods(CategoryViewSet.as_view({'get': 'list', 'post': 'create'}, basename='category'))
+async def category_list(request):
+    return await _list(CategoryViewSet, request)
+
+
+@async_safe_methods(CartItemViewSet.as_view({'get': 'cart_total'}, basename='cart-item'))
+async def cart_total(request):
+    view = _viewset(CartItemViewSet, 'cart_total', request)
+    user = await authenticate(view)
+    view.check_permissions(view.request)
+    summary = await aget_cart_summary(user.pk)
+    return _json({'total': summary['subtotal'], **summary})
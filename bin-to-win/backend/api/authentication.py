@@ -0,0 +1,127 @@
+"""
+Expiring token authentication backed by a cache.
+
+DRF's TokenAuthentication joins token and user on every request.
+CachedTokenAuthentication keeps a snapshot of the token and a few user
+fields in the ``tokens`` cache alias, keyed by a hash of the token, and
+rebuilds the user from it with every other field deferred, so a cache hit
+runs no query. Entries expire after the alias' TIMEOUT and are revoked when
+the token is deleted or its user is saved; see ``signals.py``. A per-process
+LocMemCache only revokes in the worker that handled the change; other
+workers keep accepting the token for up to ``revocation_window()`` seconds.
+
+Tokens slide: a request made more than AUTH_TOKEN_REFRESH_INTERVAL after the
+last extension pushes ``expires_at`` out to a full AUTH_TOKEN_LIFETIME again,
+so an active session costs at most one UPDATE per interval.
+"""
+import hashlib
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import router
+from django.db.models.fields.files import FieldFile
+from django.utils import timezone
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+
+from .models import ExpiringToken
+
+CACHE_ALIAS = 'tokens'
+
+# Enough for permission checks and /api/users/me/; anything else is loaded
+# from the database on first access.
+USER_FIELDS = (
+    'id', 'username', 'email', 'first_name', 'last_name', 'user_type',
+    'phone', 'address', 'profile_image', 'is_active', 'is_staff', 'is_superuser',
+)
+TOKEN_FIELDS = ('key', 'user_id', 'created', 'expires_at')
+
+
+def _snapshot(instance, fields):
+    values = {}
+    for field in fields:
+        value = instance.__dict__[field]
+        values[field] = value.name if isinstance(value, FieldFile) else value
+    return values
+
+
+def _restore(model, values):
+    # from_db() expects values in concrete field order
+    names = [field.attname for field in model._meta.concrete_fields if field.attname in values]
+    return model.from_db(router.db_for_read(model), names, [values[name] for name in names])
+
+
+def token_cache_key(key):
+    return 'auth-token:' + hashlib.sha256(key.encode()).hexdigest()
+
+
+def revoke_token(key):
+    caches[CACHE_ALIAS].delete(token_cache_key(key))
+
+
+def revocation_window():
+    """
+    Seconds other processes may still accept a revoked token: the cache
+    TIMEOUT for a per-process cache, 0 for a shared one.
+    """
+    cache = caches[CACHE_ALIAS]
+    if isinstance(cache, LocMemCache):
+        return cache.default_timeout
+    return 0
+
+
+def revoke_user_tokens(user_id):
+    keys = ExpiringToken.objects.filter(user_id=user_id).values_list('key', flat=True)
+    caches[CACHE_ALIAS].delete_many([token_cache_key(key) for key in keys])
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    model = ExpiringToken
+
+    def restore(self, snapshot):
+        token_values, user_values = snapshot
+        user = _restore(get_user_model(), user_values)
+        if not user.is_active:
+            raise exceptions.AuthenticationFailed('User inactive or deleted.')
+        token = _restore(ExpiringToken, token_values)
+        token.user = user
+        return user, token
+
+    def needs_refresh(self, token, now):
+        if token.expires_at <= now:
+            raise exceptions.AuthenticationFailed('Token has expired.')
+        return token.expires_at - now < settings.AUTH_TOKEN_LIFETIME - settings.AUTH_TOKEN_REFRESH_INTERVAL
+
+    def authenticate_credentials(self, key):
+        cache = caches[CACHE_ALIAS]
+        cache_key = token_cache_key(key)
+        snapshot = cache.get(cache_key)
+        if snapshot is None:
+            user, token = super().authenticate_credentials(key)
+        else:
+            user, token = self.restore(snapshot)
+
+        now = timezone.now()
+        if self.needs_refresh(token, now):
+            token.expires_at = now + settings.AUTH_TOKEN_LIFETIME
+            ExpiringToken.objects.filter(pk=token.pk).update(expires_at=token.expires_at)
+            snapshot = None
+        if snapshot is None:
+            cache.set(cache_key, (_snapshot(token, TOKEN_FIELDS), _snapshot(user, USER_FIELDS)))
+        return user, token
+
+    async def aauthenticate_credentials(self, key):
+        """
+        For async views: a cache hit is checked without leaving the event
+        loop; a miss or a due refresh runs ``authenticate_credentials`` in a
+        thread.
+        """
+        snapshot = await caches[CACHE_ALIAS].aget(token_cache_key(key))
+        if snapshot is not None:
+            user, token = self.restore(snapshot)
+            if not self.needs_refresh(token, timezone.now()):
+                return user, token
+        return await sync_to_async(self.authenticate_credentials)(key)
@@ -0,0 +1,142 @@
+"""
+Helpers shared by the ``bench_*`` management commands.
+
+Benchmarks always run against a throwaway test database so they never touch
+the development data in db.sqlite3.
+"""
+import datetime
+import os
+import statistics
+import tempfile
+import time
+from contextlib import contextmanager
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+from django.utils import timezone
+
+from .models import Category, Product, Retailer, User
+
+FOODS = [
+    'tomatoes', 'bananas', 'sourdough', 'yogurt', 'cheddar', 'spinach', 'apples',
+    'croissants', 'salmon', 'chicken', 'lentils', 'oat milk', 'strawberries',
+    'granola', 'hummus', 'avocados', 'bagels', 'mushrooms', 'orange juice', 'tofu',
+]
+ADJECTIVES = [
+    'organic', 'fresh', 'ripe', 'wholegrain', 'free range', 'seasonal',
+    'local', 'smoked', 'frozen', 'artisan', 'vegan', 'family size',
+]
+
+
+@contextmanager
+def benchmark_database(verbosity=0, on_disk=False, catalog_cache=False):
+    """
+    Create an empty, migrated test database for the duration of the block.
+
+    ``on_disk`` puts a SQLite test database in a temporary file instead of
+    shared memory, so that several threads can write to it concurrently.
+    The catalog response cache is off unless ``catalog_cache`` is set, so
+    repeated requests measure the database rather than cache hits.
+    """
+    test_settings = connection.settings_dict['TEST']
+    old_test_name = test_settings.get('NAME')
+    if on_disk and connection.vendor == 'sqlite':
+        test_settings['NAME'] = os.path.join(tempfile.gettempdir(), 'bin_to_win_bench.sqlite3')
+
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=verbosity, autoclobber=True)
+    # In-memory SQLite test databases survive destroy_test_db() within one
+    # process, so start every block from an empty database.
+    call_command('flush', interactive=False, verbosity=0)
+    for alias in settings.CACHES:
+        caches[alias].clear()
+    overrides = override_settings(CATALOG_CACHE_ENABLED=catalog_cache)
+    overrides.enable()
+    try:
+        yield
+    finally:
+        overrides.disable()
+        connection.creation.destroy_test_db(old_name, verbosity=verbosity)
+        teardown_test_environment()
+        test_settings['NAME'] = old_test_name
+
+
+def seed_catalog(total_products, categories=10, retailers=5, batch_size=5000):
+    """
+    Top the catalog up to ``total_products`` active products using bulk inserts.
+
+    Prices, discounts and expiry dates are spread deterministically so repeated
+    runs produce the same data.
+    """
+    category_list = list(Category.objects.all()[:categories])
+    for i in range(len(category_list), categories):
+        category_list.append(Category.objects.create(name=f'Category {i}', slug=f'category-{i}'))
+
+    retailer_list = list(Retailer.objects.all()[:retailers])
+    for i in range(len(retailer_list), retailers):
+        user = User.objects.create(username=f'bench-retailer-{i}', user_type='retailer')
+        retailer_list.append(Retailer.objects.create(
+            user=user,
+            company_name=f'Retailer {i}',
+            company_address=f'{i} Bench St',
+            business_license=f'LIC-{i}',
+            approved=True
+        ))
+
+    today = timezone.now().date()
+    start = Product.objects.count()
+    batch = []
+    for i in range(start, total_products):
+        original_price = Decimal(100 + (i * 37) % 9900) / 100
+        price = (original_price * Decimal(30 + (i * 13) % 70) / 100).quantize(Decimal('0.01'))
+        food = FOODS[i % len(FOODS)]
+        adjective = ADJECTIVES[(i // len(FOODS)) % len(ADJECTIVES)]
+        batch.append(Product(
+            name=f'{adjective.title()} {food} #{i}',
+            slug=f'product-{i}',
+            description=(
+                f'Surplus {adjective} {food} from {retailer_list[i % len(retailer_list)].company_name}, '
+                f'best before its expiry date. Lot {i}.'
+            ),
+            price=price,
+            original_price=original_price,
+            expiry_date=today + datetime.timedelta(days=(i * 7) % 60 - 5),
+            category=category_list[i % len(category_list)],
+            retailer=retailer_list[i % len(retailer_list)],
+            stock=(i * 11) % 200,
+            is_featured=i % 20 == 0,
+        ))
+        if len(batch) >= batch_size:
+            Product.objects.bulk_create(batch)
+            batch = []
+    if batch:
+        Product.objects.bulk_create(batch)
+
+
+def measure(func, runs=20, warmup=2):
+    """Call ``func`` repeatedly and return latency statistics in milliseconds."""
+    for _ in range(warmup):
+        func()
+    samples = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - started) * 1000)
+    samples.sort()
+    return {
+        'runs': runs,
+        'mean_ms': statistics.fmean(samples),
+        'p50_ms': percentile(samples, 50),
+        'p99_ms': percentile(samples, 99),
+    }
+
+
+def percentile(sorted_samples, pct):
+    if not sorted_samples:
+        return 0.0
+    index = min(len(sorted_samples) - 1, int(round(pct / 100 * (len(sorted_samples) - 1))))
+    return sorted_samples[index]
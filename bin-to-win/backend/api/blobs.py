@@ -0,0 +1,160 @@
+"""
+Content-addressed on-disk storage for BinaryFile uploads.
+
+Blobs live under ``settings.BINARY_FILE_ROOT`` at ``ab/cd/<sha256>`` and are
+shared by every BinaryFile row with the same content. Uploads are hashed
+while they stream to a temporary file, so nothing holds a whole file in
+memory. ``blob_response`` serves a blob with ETag and single-range support,
+or hands it to the front-end web server when ``BINARY_FILE_SENDFILE`` is set.
+"""
+import hashlib
+import os
+import re
+import tempfile
+
+from django.conf import settings
+from django.http import FileResponse, HttpResponse, HttpResponseNotModified, StreamingHttpResponse
+from django.utils.http import content_disposition_header
+
+CHUNK_SIZE = 64 * 1024
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class BlobStore:
+    def __init__(self, root):
+        self.root = os.fspath(root)
+
+    def relative_path(self, digest):
+        return os.path.join(digest[:2], digest[2:4], digest)
+
+    def path(self, digest):
+        return os.path.join(self.root, self.relative_path(digest))
+
+    def exists(self, digest):
+        return os.path.exists(self.path(digest))
+
+    def save(self, chunks):
+        """Write an iterable of byte chunks and return ``(sha256, size)``."""
+        os.makedirs(self.root, exist_ok=True)
+        sha256 = hashlib.sha256()
+        size = 0
+        with tempfile.NamedTemporaryFile(dir=self.root, prefix='.upload-', delete=False) as tmp:
+            try:
+                for chunk in chunks:
+                    sha256.update(chunk)
+                    size += len(chunk)
+                    tmp.write(chunk)
+            except BaseException:
+                tmp.close()
+                os.unlink(tmp.name)
+                raise
+
+        digest = sha256.hexdigest()
+        final_path = self.path(digest)
+        if os.path.exists(final_path):
+            os.unlink(tmp.name)
+        else:
+            os.makedirs(os.path.dirname(final_path), exist_ok=True)
+            os.replace(tmp.name, final_path)
+        return digest, size
+
+    def open(self, digest):
+        return open(self.path(digest), 'rb')
+
+    def delete(self, digest):
+        try:
+            os.unlink(self.path(digest))
+        except FileNotFoundError:
+            pass
+
+
+def get_blob_store():
+    return BlobStore(settings.BINARY_FILE_ROOT)
+
+
+def parse_range(header, size):
+    """
+    Return ``(start, end)`` (inclusive) for a single ``bytes=`` range, ``None``
+    when the header should be ignored, or ``False`` when it is unsatisfiable.
+    """
+    match = RANGE_RE.match(header.strip())
+    if not match or match.group(1) == match.group(2) == '':
+        return None
+    first, last = match.groups()
+    if first == '':
+        # Suffix range: the last N bytes
+        length = int(last)
+        if length == 0:
+            return False
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        return False
+    return start, end
+
+
+def _read_range(handle, start, length):
+    try:
+        handle.seek(start)
+        while length > 0:
+            chunk = handle.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+    finally:
+        handle.close()
+
+
+def blob_response(request, store, digest, size, content_type, filename):
+    etag = f'"{digest}"'
+    headers = {
+        'ETag': etag,
+        'Accept-Ranges': 'bytes',
+        'Cache-Control': 'private, max-age=0, must-revalidate',
+    }
+    if_none_match = request.headers.get('If-None-Match', '')
+    if etag in [tag.strip() for tag in if_none_match.split(',')] or if_none_match.strip() == '*':
+        response = HttpResponseNotModified()
+        for header, value in headers.items():
+            response[header] = value
+        return response
+
+    offload = getattr(settings, 'BINARY_FILE_SENDFILE', None)
+    if offload:
+        # The web server streams the file and handles Range itself
+        response = HttpResponse(content_type=content_type, headers=headers)
+        response['Content-Disposition'] = content_disposition_header(True, filename)
+        if offload == 'x-accel-redirect':
+            response['X-Accel-Redirect'] = settings.BINARY_FILE_ACCEL_PREFIX + store.relative_path(digest)
+        else:
+            response['X-Sendfile'] = store.path(digest)
+        return response
+
+    byte_range = None
+    range_header = request.headers.get('Range')
+    if range_header and request.headers.get('If-Range', etag) == etag:
+        byte_range = parse_range(range_header, size)
+    if byte_range is False:
+        return HttpResponse(status=416, headers={**headers, 'Content-Range': f'bytes */{size}'})
+
+    if byte_range is None:
+        response = FileResponse(
+            store.open(digest), as_attachment=True, filename=filename, content_type=content_type
+        )
+        for header, value in headers.items():
+            response[header] = value
+        return response
+
+    start, end = byte_range
+    response = StreamingHttpResponse(
+        _read_range(store.open(digest), start, end - start + 1),
+        status=206,
+        content_type=content_type,
+        headers=headers,
+    )
+    response['Content-Range'] = f'bytes {start}-{end}/{size}'
+    response['Content-Length'] = str(end - start + 1)
+    response['Content-Disposition'] = content_disposition_header(True, filename)
+    return response
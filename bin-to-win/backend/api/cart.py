@@ -0,0 +1,148 @@
+"""
+Per-user cart summaries (item count, subtotal and savings), and batched
+cart changes.
+
+Summaries are computed with a single aggregate query and cached until the
+user's cart or the price of a product in it changes; see ``signals.py``.
+
+``apply_cart_operations`` applies a list of add/update/remove operations,
+e.g. a cart edited offline, in one transaction: one query reads the
+affected items, one checks every product's availability and stock, and
+the changes are written with one DELETE and one upsert on the unique
+(user, product) constraint.
+"""
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import DecimalField, F, Sum
+from django.db.models.functions import Coalesce
+
+from .models import CartItem, Product
+
+CART_SUMMARY_TIMEOUT = getattr(settings, 'CART_SUMMARY_TIMEOUT', 60 * 60)
+MAX_CART_OPERATIONS = 200
+CENT = Decimal('0.01')
+
+
+def cart_summary_key(user_id):
+    return f'cart-summary:{user_id}'
+
+
+def _cart_totals(user_id):
+    money = DecimalField(max_digits=12, decimal_places=2)
+    return CartItem.objects.filter(user_id=user_id), {
+        'item_count': Coalesce(Sum('quantity'), 0),
+        'subtotal': Coalesce(Sum(F('product__price') * F('quantity'), output_field=money), Decimal('0'), output_field=money),
+        'original_total': Coalesce(
+            Sum(F('product__original_price') * F('quantity'), output_field=money), Decimal('0'), output_field=money
+        ),
+    }
+
+
+def _summary(totals):
+    subtotal = totals['subtotal'].quantize(CENT)
+    return {
+        'item_count': totals['item_count'],
+        'subtotal': subtotal,
+        'savings': totals['original_total'].quantize(CENT) - subtotal,
+    }
+
+
+def compute_cart_summary(user_id):
+    items, aggregates = _cart_totals(user_id)
+    return _summary(items.aggregate(**aggregates))
+
+
+def get_cart_summary(user_id):
+    key = cart_summary_key(user_id)
+    summary = cache.get(key)
+    if summary is None:
+        summary = compute_cart_summary(user_id)
+        cache.set(key, summary, CART_SUMMARY_TIMEOUT)
+    return summary
+
+
+async def aget_cart_summary(user_id):
+    """``get_cart_summary`` through the async cache and ORM APIs."""
+    key = cart_summary_key(user_id)
+    summary = await cache.aget(key)
+    if summary is None:
+        items, aggregates = _cart_totals(user_id)
+        summary = _summary(await items.aaggregate(**aggregates))
+        await cache.aset(key, summary, CART_SUMMARY_TIMEOUT)
+    return summary
+
+
+def invalidate_cart_summary(user_id):
+    cache.delete(cart_summary_key(user_id))
+
+
+def invalidate_cart_summaries_for_products(product_ids):
+    """Drop the cached summary of every user with one of these products in their cart."""
+    user_ids = CartItem.objects.filter(product_id__in=product_ids).values_list('user_id', flat=True).distinct()
+    cache.delete_many([cart_summary_key(user_id) for user_id in user_ids])
+
+
+def add_to_cart(user, product, quantity):
+    """Add ``quantity`` of ``product``, raising the quantity if it is already in the cart."""
+    item, created = CartItem.objects.get_or_create(user=user, product=product, defaults={'quantity': quantity})
+    if not created:
+        item.quantity = F('quantity') + quantity
+        item.save(update_fields=['quantity'])
+        item.refresh_from_db(fields=['quantity'])
+        item.product = product
+    return item
+
+
+def apply_cart_operations(user_id, operations):
+    """
+    Apply ``{'op', 'product_id', 'quantity'}`` operations in order, where
+    ``add`` raises a product's quantity, ``update`` sets it and ``remove``
+    takes the product out of the cart. Either every operation is applied,
+    or none is and ``{operation index: [error]}`` is returned.
+    """
+    errors = {}
+    with transaction.atomic():
+        items = CartItem.objects.select_for_update().filter(
+            user_id=user_id, product_id__in={operation['product_id'] for operation in operations}
+        )
+        current = dict(items.values_list('product_id', 'quantity'))
+        wanted = dict(current)
+        # The last operation that left each product in the cart
+        added = {}
+        for index, operation in enumerate(operations):
+            product_id = operation['product_id']
+            if operation['op'] == 'remove':
+                wanted.pop(product_id, None)
+                added.pop(product_id, None)
+            else:
+                already = wanted.get(product_id, 0) if operation['op'] == 'add' else 0
+                wanted[product_id] = already + operation['quantity']
+                added[product_id] = index
+
+        stock = dict(Product.objects.filter(pk__in=added, is_active=True).values_list('id', 'stock'))
+        for product_id, index in added.items():
+            if product_id not in stock:
+                errors[index] = [f'Product {product_id} is not available.']
+            elif wanted[product_id] > stock[product_id]:
+                errors[index] = [f'Only {stock[product_id]} of product {product_id} left in stock.']
+        if errors:
+            return errors
+
+        removed = current.keys() - wanted.keys()
+        if removed:
+            CartItem.objects.filter(user_id=user_id, product_id__in=removed).delete()
+        changed = [
+            CartItem(user_id=user_id, product_id=product_id, quantity=quantity)
+            for product_id, quantity in wanted.items() if current.get(product_id) != quantity
+        ]
+        if changed:
+            CartItem.objects.bulk_create(
+                changed, update_conflicts=True, unique_fields=['user', 'product'], update_fields=['quantity'],
+            )
+    if changed:
+        # The upsert bypasses model signals
+        invalidate_cart_summary(user_id)
+    return errors
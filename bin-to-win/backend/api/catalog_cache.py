@@ -0,0 +1,192 @@
+"""
+Response cache for the public catalog endpoints.
+
+List and retrieve responses of ProductViewSet and CategoryViewSet are cached
+in the ``catalog`` cache alias, keyed on the normalized query parameters.
+The backend is whatever ``CACHES['catalog']`` configures (local-memory LRU,
+file-based, Redis, ...).
+
+Keys embed generation tokens rather than being deleted one by one: a model
+change replaces the token of every listing or object it can appear in, which
+orphans the old entries in O(1). ``signals.py`` calls the ``invalidate_*``
+helpers on post_save/post_delete; code that writes with ``update()`` or
+``bulk_create()`` must call them itself.
+"""
+import hashlib
+import threading
+import uuid
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.response import Response
+
+CACHE_ALIAS = 'catalog'
+
+PRODUCT_LIST = 'product-list'
+PRODUCT_DETAILS = 'product-details'
+CATEGORY_LIST = 'category-list'
+
+_stats_lock = threading.Lock()
+_stats = Counter()
+
+
+def get_cache():
+    return caches[CACHE_ALIAS]
+
+
+def _generation_key(name):
+    return f'catalog-gen:{name}'
+
+
+def _generations(names):
+    cache = get_cache()
+    keys = [_generation_key(name) for name in names]
+    found = cache.get_many(keys)
+    for key in keys:
+        if key not in found:
+            # add() keeps a token another process created in the meantime
+            cache.add(key, uuid.uuid4().hex, None)
+            found[key] = cache.get(key)
+    return [found[key] for key in keys]
+
+
+async def _agenerations(names):
+    cache = get_cache()
+    keys = [_generation_key(name) for name in names]
+    found = await cache.aget_many(keys)
+    for key in keys:
+        if key not in found:
+            await cache.aadd(key, uuid.uuid4().hex, None)
+            found[key] = await cache.aget(key)
+    return [found[key] for key in keys]
+
+
+def generation_names(resource, pk):
+    """Generation tokens a ``resource`` listing (``pk`` None) or object response depends on."""
+    if resource == 'product':
+        if pk is None:
+            return [PRODUCT_LIST]
+        return [PRODUCT_DETAILS, f'product:{pk}']
+    if pk is None:
+        return [CATEGORY_LIST]
+    return [f'category:{pk}']
+
+
+def response_key(resource, action, pk, request, generations):
+    params = sorted(
+        (key, value)
+        for key, values in request.query_params.lists()
+        for value in values
+        if value != ''
+    )
+    raw = '|'.join([
+        resource,
+        action,
+        str(pk if pk is not None else ''),
+        # Pagination links and image URLs are absolute
+        request.build_absolute_uri('/'),
+        repr(params),
+        *generations,
+    ])
+    return 'catalog:' + hashlib.sha256(raw.encode()).hexdigest()
+
+
+def current_generations(resource, pk):
+    return _generations(generation_names(resource, pk))
+
+
+async def acurrent_generations(resource, pk):
+    return await _agenerations(generation_names(resource, pk))
+
+
+def current_response_key(resource, action, pk, request):
+    """``response_key`` under the current generation tokens."""
+    return response_key(resource, action, pk, request, current_generations(resource, pk))
+
+
+async def aresponse_key(resource, action, pk, request):
+    return response_key(resource, action, pk, request, await acurrent_generations(resource, pk))
+
+
+def _bump(names):
+    get_cache().set_many({_generation_key(name): uuid.uuid4().hex for name in names}, None)
+
+
+def invalidate_products(product_ids=()):
+    _bump([PRODUCT_LIST, *(f'product:{pk}' for pk in product_ids)])
+
+
+def invalidate_categories(category_ids=()):
+    # Product rows embed their category's name
+    _bump([CATEGORY_LIST, PRODUCT_LIST, PRODUCT_DETAILS, *(f'category:{pk}' for pk in category_ids)])
+
+
+def invalidate_all_products():
+    """Cheaper than listing ids when a bulk write touched many products."""
+    _bump([PRODUCT_LIST, PRODUCT_DETAILS])
+
+
+def record(resource, outcome):
+    with _stats_lock:
+        _stats[(resource, outcome)] += 1
+
+
+def get_stats():
+    """Hit/miss counters of this process, per cached resource."""
+    with _stats_lock:
+        snapshot = dict(_stats)
+    stats = {}
+    for (resource, outcome), count in snapshot.items():
+        stats.setdefault(resource, {'hits': 0, 'misses': 0})[outcome] = count
+    for counts in stats.values():
+        total = counts['hits'] + counts['misses']
+        counts['hit_ratio'] = counts['hits'] / total if total else 0.0
+    return stats
+
+
+def reset_stats():
+    with _stats_lock:
+        _stats.clear()
+
+
+class CatalogCacheMixin:
+    """
+    Serve ``list`` and ``retrieve`` from the catalog cache.
+
+    ``cache_resource`` names the generation tokens the responses depend on;
+    see ``generation_names``.
+    """
+    cache_resource = None
+
+    def list(self, request, *args, **kwargs):
+        return self.cached(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached(super().retrieve, request, *args, **kwargs)
+
+    def cache_pk(self):
+        return self.kwargs.get(self.lookup_url_kwarg or self.lookup_field)
+
+    def cache_key(self, request):
+        return current_response_key(self.cache_resource, self.action, self.cache_pk(), request)
+
+    def cached(self, view, request, *args, **kwargs):
+        if not getattr(settings, 'CATALOG_CACHE_ENABLED', True):
+            return view(request, *args, **kwargs)
+
+        resource = f'{self.cache_resource}-{self.action}'
+        cache = get_cache()
+        # The key is computed before running the view, so a response built
+        # while a write invalidates it is stored under the old generation.
+        key = self.cache_key(request)
+        data = cache.get(key)
+        if data is not None:
+            record(resource, 'hits')
+            return Response(data)
+
+        record(resource, 'misses')
+        response = view(request, *args, **kwargs)
+        if response.status_code == 200:
+            cache.set(key, response.data)
+        return response
@@ -0,0 +1,138 @@
+"""
+Negotiated brotli/gzip compression of API responses.
+
+Like Django's GZipMiddleware, but:
+- It offers brotli (``br``) when the brotli package is installed. Brotli
+  usually makes JSON smaller than gzip does, at a similar cost.
+- It honours q-values in Accept-Encoding.
+- It only compresses responses of at least COMPRESSION_MIN_SIZE bytes.
+- It only compresses the text types the API produces (JSON, CSV, NDJSON,
+  the Prometheus text format).
+
+HTML is left alone: the browsable API pages carry CSRF tokens next to
+reflected input, which is what BREACH attacks exploit. Images and ranged
+blob downloads are left alone too.
+
+It sits right below PerformanceMiddleware, so ``response_bytes`` in
+api/metrics.py is the size on the wire.
+"""
+import zlib
+
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+from django.utils.deprecation import MiddlewareMixin
+
+try:
+    import brotli
+except ImportError:  # optional, see requirements.txt
+    brotli = None
+
+COMPRESSIBLE_TYPES = {
+    'application/json', 'application/x-ndjson', 'text/csv', 'text/plain',
+}
+
+
+def accepted_encodings(header):
+    """``{coding: q}`` from an Accept-Encoding header."""
+    encodings = {}
+    for item in header.split(','):
+        coding, _, params = item.partition(';')
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        for param in params.split(';'):
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        encodings[coding] = q
+    return encodings
+
+
+def choose_encoding(header):
+    """The best coding we support for an Accept-Encoding header, or None."""
+    accepted = accepted_encodings(header)
+    best, best_q = None, 0.0
+    # On equal q-values the first wins
+    for coding in ('br', 'gzip') if brotli is not None else ('gzip',):
+        q = accepted.get(coding, accepted.get('*', 0.0))
+        if q > best_q:
+            best, best_q = coding, q
+    return best
+
+
+def _compressor(coding):
+    """``(compress, flush)`` of an incremental compressor for one response body."""
+    if coding == 'br':
+        compressor = brotli.Compressor(quality=settings.COMPRESSION_BROTLI_QUALITY)
+        return compressor.process, compressor.finish
+    # wbits=31 writes a gzip header and trailer
+    compressor = zlib.compressobj(settings.COMPRESSION_GZIP_LEVEL, zlib.DEFLATED, 31)
+    return compressor.compress, compressor.flush
+
+
+def compress(coding, content):
+    compress_chunk, flush = _compressor(coding)
+    return compress_chunk(content) + flush()
+
+
+def compress_sequence(coding, chunks):
+    compress_chunk, flush = _compressor(coding)
+    for chunk in chunks:
+        if data := compress_chunk(chunk):
+            yield data
+    yield flush()
+
+
+async def acompress_sequence(coding, chunks):
+    compress_chunk, flush = _compressor(coding)
+    async for chunk in chunks:
+        if data := compress_chunk(chunk):
+            yield data
+    yield flush()
+
+
+def is_compressible(response):
+    content_type = response.get('Content-Type', '').partition(';')[0].strip().lower()
+    return (
+        content_type in COMPRESSIBLE_TYPES
+        and not response.has_header('Content-Encoding')
+        and not response.has_header('Content-Range')
+        and not response.has_header('Accept-Ranges')
+    )
+
+
+class CompressionMiddleware(MiddlewareMixin):
+    def process_response(self, request, response):
+        if not is_compressible(response):
+            return response
+        if not response.streaming and len(response.content) < settings.COMPRESSION_MIN_SIZE:
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+        coding = choose_encoding(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        if coding is None:
+            return response
+
+        if response.streaming:
+            if response.is_async:
+                response.streaming_content = acompress_sequence(coding, response.streaming_content)
+            else:
+                response.streaming_content = compress_sequence(coding, response.streaming_content)
+            del response.headers['Content-Length']
+        else:
+            compressed = compress(coding, response.content)
+            if len(compressed) >= len(response.content):
+                return response
+            response.content = compressed
+            response.headers['Content-Length'] = str(len(compressed))
+
+        # Compressed bodies differ byte for byte, so a strong ETag becomes weak
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response.headers['ETag'] = 'W/' + etag
+        response.headers['Content-Encoding'] = coding
+        return response
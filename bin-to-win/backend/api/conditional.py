@@ -0,0 +1,166 @@
+"""
+Conditional GET (ETag, and Last-Modified for details) for list and detail
+responses.
+
+The validators of a response come from one aggregate over the rows it is
+built from: the latest ``updated_at`` and the number of rows (which changes
+when one is deleted or leaves the filter). A request whose If-None-Match, or
+for a detail If-Modified-Since, still matches gets 304 Not Modified before
+the view queries the page or serializes anything. Responses carry
+``Cache-Control: no-cache`` so clients revalidate instead of guessing a
+freshness lifetime from Last-Modified.
+
+Lists have no Last-Modified: deleting a row, or one leaving the filter,
+lowers the count but doesn't move the latest ``updated_at`` forward, so a
+list can change without its Last-Modified changing. Only the ETag, which
+covers the count, validates them.
+
+This relies on every write that changes what a response shows touching
+``updated_at``; ``update()`` calls set it themselves. Product rows also
+embed their category's and retailer's names, which change without touching
+the products, so the catalog viewsets' ETags include the catalog cache's
+generation tokens (see catalog_cache.py), which those writes replace.
+
+For the catalog viewsets the aggregate results are kept in the catalog
+cache under the same generation tokens as the responses, so revalidating
+costs no query until the catalog changes. With a per-process cache backend
+the tokens, and so the ETags, differ between worker processes; a client
+revalidating against another worker then gets a full response.
+"""
+import datetime
+import hashlib
+
+from django.conf import settings
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db.models import Count, Max
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+
+from .catalog_cache import acurrent_generations, current_generations, get_cache, response_key
+
+
+def _fingerprint(view, request, pk, renderer_format, aggregates):
+    params = sorted(
+        (key, value)
+        for key, values in request.query_params.lists()
+        for value in values
+        if value != ''
+    )
+    raw = '|'.join([
+        type(view).__name__,
+        view.action,
+        str(pk if pk is not None else ''),
+        # Pagination links and image URLs are absolute
+        request.build_absolute_uri('/'),
+        renderer_format,
+        str(request.user.pk if view.conditional_per_user else ''),
+        repr(params),
+        repr(sorted(aggregates.items())),
+    ])
+    return f'W/"{hashlib.sha256(raw.encode()).hexdigest()[:32]}"'
+
+
+def _last_modified(aggregates):
+    times = [value for value in aggregates.values() if isinstance(value, datetime.datetime)]
+    return int(max(times).timestamp()) if times else None
+
+
+class ConditionalGetMixin:
+    """
+    Answer conditional ``list`` and ``retrieve`` requests with 304.
+
+    ``validator_aggregates()`` returns the aggregates a response depends on:
+    ``count`` and any number of latest modification times. Viewsets with a
+    ``cache_resource`` add its generation tokens.
+    ``conditional_per_user`` makes validators differ between users, for
+    viewsets whose rows depend on who asks.
+    """
+    conditional_per_user = False
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional(super().retrieve, request, *args, **kwargs)
+
+    def validator_aggregates(self):
+        return {'updated_at': Max('updated_at'), 'count': Count('pk')}
+
+    def validator_queryset(self, pk):
+        queryset = self.filter_queryset(self.get_queryset()).order_by()
+        if pk is not None:
+            queryset = queryset.filter(pk=pk)
+        return queryset
+
+    def uses_validator_cache(self):
+        return getattr(settings, 'CATALOG_CACHE_ENABLED', True)
+
+    def get_aggregates(self, request, pk):
+        queryset = self.validator_queryset(pk)
+        if getattr(self, 'cache_resource', None) is None:
+            return queryset.aggregate(**self.validator_aggregates())
+        # As in CatalogCacheMixin, the tokens are read before the query
+        generations = current_generations(self.cache_resource, pk)
+        aggregates = None
+        if self.uses_validator_cache():
+            key = 'validators:' + response_key(self.cache_resource, self.action, pk, request, generations)
+            aggregates = get_cache().get(key)
+        if aggregates is None:
+            aggregates = queryset.aggregate(**self.validator_aggregates())
+            if self.uses_validator_cache():
+                get_cache().set(key, aggregates)
+        return {**aggregates, 'generations': generations}
+
+    async def aget_aggregates(self, request, pk):
+        """``get_aggregates`` through the async cache and ORM APIs."""
+        queryset = self.validator_queryset(pk)
+        if getattr(self, 'cache_resource', None) is None:
+            return await queryset.aaggregate(**self.validator_aggregates())
+        generations = await acurrent_generations(self.cache_resource, pk)
+        aggregates = None
+        if self.uses_validator_cache():
+            key = 'validators:' + response_key(self.cache_resource, self.action, pk, request, generations)
+            aggregates = await get_cache().aget(key)
+        if aggregates is None:
+            aggregates = await queryset.aaggregate(**self.validator_aggregates())
+            if self.uses_validator_cache():
+                await get_cache().aset(key, aggregates)
+        return {**aggregates, 'generations': generations}
+
+    def validators(self, request, pk, aggregates, renderer_format):
+        """``(etag, last_modified)``, or None when there is nothing to validate."""
+        if pk is None:
+            return _fingerprint(self, request, pk, renderer_format, aggregates), None
+        if not aggregates['count']:
+            # Let the view answer 404
+            return None
+        return _fingerprint(self, request, pk, renderer_format, aggregates), _last_modified(aggregates)
+
+    def conditional(self, view, request, *args, **kwargs):
+        pk = self.kwargs.get(self.lookup_url_kwarg or self.lookup_field)
+        try:
+            aggregates = self.get_aggregates(request, pk)
+        except (DjangoValidationError, TypeError, ValueError):
+            # A malformed pk; the view answers 404
+            return view(request, *args, **kwargs)
+        validators = self.validators(request, pk, aggregates, request.accepted_renderer.format)
+        if validators is None:
+            return view(request, *args, **kwargs)
+        response = not_modified(request, *validators)
+        if response is None:
+            response = view(request, *args, **kwargs)
+        return with_validators(response, *validators, private=self.conditional_per_user)
+
+
+def not_modified(request, etag, last_modified):
+    """A 304 response if the request's validators match, else None."""
+    return get_conditional_response(request, etag=etag, last_modified=last_modified)
+
+
+def with_validators(response, etag, last_modified, private=False):
+    if response.status_code in (200, 304):
+        response['ETag'] = etag
+        if last_modified is not None:
+            response['Last-Modified'] = http_date(last_modified)
+        patch_cache_control(response, no_cache=True, **({'private': True} if private else {}))
+    return response
@@ -0,0 +1,87 @@
+"""
+Database connection tuning and read-replica routing.
+
+SQLite connections run the SQLITE_PRAGMAS from settings as they open (see
+``signals.py``). WAL lets readers carry on while a checkout holds the write
+lock, busy_timeout makes a blocked writer wait instead of failing with
+"database is locked", and synchronous=NORMAL only fsyncs at checkpoints.
+
+PrimaryReplicaRouter sends reads to one of DATABASE_REPLICAS while
+ReplicaReadMixin has switched replica reads on for a safe action of the
+catalog viewsets, or an async view has with ``replica_reads()``. Everything
+else, including every write, uses the primary. Replicas lag, so for
+DATABASE_REPLICA_LAG seconds after this process writes its reads stay on the
+primary too; otherwise a response read from a stale replica could be cached
+right after the write that invalidated it.
+"""
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from rest_framework.permissions import SAFE_METHODS
+
+_replica_reads = ContextVar('replica_reads', default=False)
+_last_write = float('-inf')
+
+
+def configure_sqlite(connection):
+    with connection.cursor() as cursor:
+        for name, value in getattr(settings, 'SQLITE_PRAGMAS', {}).items():
+            cursor.execute(f'PRAGMA {name} = {value}')
+
+
+def replica_aliases():
+    return getattr(settings, 'DATABASE_REPLICAS', [])
+
+
+@contextmanager
+def replica_reads():
+    token = _replica_reads.set(True)
+    try:
+        yield
+    finally:
+        _replica_reads.reset(token)
+
+
+class PrimaryReplicaRouter:
+    def db_for_read(self, model, **hints):
+        replicas = replica_aliases()
+        if not replicas or not _replica_reads.get():
+            return None
+        if time.monotonic() - _last_write < getattr(settings, 'DATABASE_REPLICA_LAG', 0):
+            return None
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        global _last_write
+        _last_write = time.monotonic()
+        return None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Every alias holds the same data
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas get their schema through replication
+        return False if db in replica_aliases() else None
+
+
+class ReplicaReadMixin:
+    """Serve ``replica_actions`` of a viewset from a read replica."""
+    replica_actions = ('list', 'retrieve')
+
+    def initial(self, request, *args, **kwargs):
+        # Authenticate against the primary first, so a token issued a moment
+        # ago isn't rejected by a replica that hasn't seen it yet.
+        super().initial(request, *args, **kwargs)
+        if request.method in SAFE_METHODS and self.action in self.replica_actions:
+            self._replica_token = _replica_reads.set(True)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        token = getattr(self, '_replica_token', None)
+        if token is not None:
+            self._replica_token = None
+            _replica_reads.reset(token)
+        return super().finalize_response(request, response, *args, **kwargs)
@@ -0,0 +1,87 @@
+"""
+Promo code discounts.
+
+PromoCodeViewSet.validate and checkout both look codes up with
+``get_active_promo`` and price them with ``calculate_discount``, so the
+discount a customer is quoted is the one they are charged, to the cent.
+
+Live and upcoming promo codes are kept in a per-process dict keyed by code.
+It is reloaded when a PromoCode is saved or deleted (see ``signals.py``), when
+the earliest loaded code expires, and at least every PROMO_CACHE_MAX_AGE
+seconds so that writes made by other processes show up. Validity windows are
+checked on every lookup, so a code becomes usable exactly at valid_from.
+"""
+import datetime
+import threading
+from decimal import ROUND_HALF_UP, Decimal
+
+from django.conf import settings
+from django.utils import timezone
+
+from .models import PromoCode
+
+CENT = Decimal('0.01')
+PROMO_CACHE_MAX_AGE = getattr(settings, 'PROMO_CACHE_MAX_AGE', 60)
+
+_lock = threading.Lock()
+_promos = None
+_refresh_at = None
+# Bumped by every invalidation, so a load that raced with one isn't kept
+_generation = 0
+
+
+def _load(now):
+    promos = {
+        promo.code: promo
+        for promo in PromoCode.objects.filter(is_active=True, valid_to__gte=now)
+    }
+    refresh_at = now + datetime.timedelta(seconds=PROMO_CACHE_MAX_AGE)
+    for promo in promos.values():
+        # Drop codes from the cache as soon as they expire
+        refresh_at = min(refresh_at, promo.valid_to)
+    return promos, refresh_at
+
+
+def active_promos(now=None):
+    global _promos, _refresh_at
+    now = now or timezone.now()
+    promos, refresh_at = _promos, _refresh_at
+    if promos is None or now > refresh_at:
+        with _lock:
+            if _promos is None or now > _refresh_at:
+                generation = _generation
+                promos, refresh_at = _load(now)
+                if generation == _generation:
+                    _promos, _refresh_at = promos, refresh_at
+            else:
+                promos = _promos
+    return promos
+
+
+def invalidate_promo_cache():
+    global _promos, _generation
+    _generation += 1
+    _promos = None
+
+
+def get_active_promo(code, now=None):
+    """Return the PromoCode for ``code`` if it can be used at ``now``, else None."""
+    now = now or timezone.now()
+    promo = active_promos(now).get(code)
+    if promo is None or not promo.valid_from <= now <= promo.valid_to:
+        return None
+    return promo
+
+
+def calculate_discount(promo, subtotal):
+    """
+    Discount for an order of ``subtotal``, rounded to the cent and never more
+    than the subtotal. Zero below the code's minimum order value.
+    """
+    if subtotal < promo.minimum_order_value:
+        return Decimal('0.00')
+    if promo.discount_percentage:
+        discount = subtotal * promo.discount_percentage / 100
+    else:
+        discount = promo.discount_amount
+    return min(discount, subtotal).quantize(CENT, rounding=ROUND_HALF_UP)
@@ -0,0 +1,124 @@
+"""
+Expiry engine for near-expiry stock.
+
+The ``run_expiry_engine`` command runs the STEPS below on a schedule (e.g.
+hourly from cron). Each run
+
+1. deactivates active products whose expiry date has passed,
+2. moves active products into the ExpiryBucket matching their days left and
+   marks their price down by that bucket's EXPIRY_MARKDOWNS percentage of
+   the price before any markdown, and
+3. restores the price of products whose expiry date moved out of every bucket.
+
+Every step walks an index in (expiry_date, id) order and updates one batch of
+ids per statement, so memory use does not grow with the catalog and write
+locks are held briefly. Bulk UPDATEs skip model signals, so each batch
+invalidates the catalog cache and cart summaries itself. Every step takes an
+optional ``products`` queryset to limit it to part of the catalog.
+"""
+import datetime
+from decimal import Decimal
+
+from django.conf import settings
+from django.db.models import DecimalField, F, Q
+from django.db.models.functions import Coalesce, Round
+from django.utils import timezone
+
+from .cart import invalidate_cart_summaries_for_products
+from .catalog_cache import invalidate_all_products
+from .models import ExpiryBucket, Product
+
+# Percent off the pre-markdown price per bucket
+DEFAULT_MARKDOWNS = {
+    ExpiryBucket.SEVEN_DAYS: 15,
+    ExpiryBucket.THREE_DAYS: 30,
+    ExpiryBucket.TODAY: 50,
+}
+
+
+def get_markdowns():
+    markdowns = getattr(settings, 'EXPIRY_MARKDOWNS', DEFAULT_MARKDOWNS)
+    return {ExpiryBucket(int(bucket)): percent for bucket, percent in markdowns.items()}
+
+
+def batched_ids(queryset, batch_size):
+    """Yield lists of ids from ``queryset`` in (expiry_date, id) order, seeking past each batch."""
+    last = None
+    while True:
+        page = queryset
+        if last is not None:
+            page = page.filter(Q(expiry_date__gt=last[0]) | Q(expiry_date=last[0], id__gt=last[1]))
+        rows = list(page.order_by('expiry_date', 'id').values_list('expiry_date', 'id')[:batch_size])
+        if not rows:
+            return
+        last = rows[-1]
+        yield [pk for _, pk in rows]
+
+
+def _changed(product_ids):
+    invalidate_all_products()
+    invalidate_cart_summaries_for_products(product_ids)
+
+
+def _catalog(products):
+    return Product.objects.all() if products is None else products
+
+
+def deactivate_expired(today, batch_size, products=None):
+    expired = _catalog(products).filter(is_active=True, expiry_date__lt=today)
+    count = 0
+    for ids in batched_ids(expired, batch_size):
+        count += Product.objects.filter(id__in=ids, is_active=True).update(
+            is_active=False, updated_at=timezone.now()
+        )
+        _changed(ids)
+    return count
+
+
+def apply_markdowns(today, batch_size, markdowns=None, products=None):
+    markdowns = get_markdowns() if markdowns is None else markdowns
+    base_price = Coalesce('markdown_base_price', 'price')
+    count = 0
+    first_day = today
+    for bucket in sorted(ExpiryBucket):
+        last_day = today + datetime.timedelta(days=bucket)
+        factor = Decimal(100 - markdowns.get(bucket, 0)) / 100
+        pending = _catalog(products).filter(
+            is_active=True, expiry_date__range=(first_day, last_day)
+        ).exclude(expiry_bucket=bucket)
+        for ids in batched_ids(pending, batch_size):
+            # Every right-hand side sees the row's values from before the UPDATE
+            count += Product.objects.filter(id__in=ids).update(
+                expiry_bucket=bucket,
+                markdown_base_price=base_price,
+                price=Round(base_price * factor, 2, output_field=DecimalField(max_digits=10, decimal_places=2)),
+                updated_at=timezone.now(),
+            )
+            _changed(ids)
+        first_day = last_day + datetime.timedelta(days=1)
+    return count
+
+
+def restore_prices(today, batch_size, products=None):
+    """Undo the markdown of products whose expiry date was pushed back out of every bucket."""
+    horizon = today + datetime.timedelta(days=max(ExpiryBucket))
+    extended = _catalog(products).filter(is_active=True, expiry_bucket__in=ExpiryBucket.values, expiry_date__gt=horizon)
+    count = 0
+    # Restored rows drop out of the filter (and the partial bucket index), so
+    # the next batch always starts from the top.
+    while ids := list(extended.values_list('id', flat=True)[:batch_size]):
+        count += Product.objects.filter(id__in=ids).update(
+            price=F('markdown_base_price'),
+            markdown_base_price=None,
+            expiry_bucket=None,
+            updated_at=timezone.now(),
+        )
+        _changed(ids)
+    return count
+
+
+STEPS = [
+    ('deactivated', deactivate_expired),
+    ('marked down', apply_markdowns),
+    ('restored', restore_prices),
+]
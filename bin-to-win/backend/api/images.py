@@ -0,0 +1,160 @@
+"""
+Resized renditions of product and profile images.
+
+Uploads are stored as they come, often multi-megabyte phone photos, so
+listings would otherwise send the full original for every card. Once an
+upload commits, ``schedule_renditions`` renders each size in SIZES as JPEG
+and WebP on a background thread pool (Pillow releases the GIL while it
+decodes, resizes and encodes) and records the stored names in the row's
+``<field>_renditions`` JSON column. Serializers fall back to the original
+until they are ready.
+
+Rendition names embed a hash of their bytes, so a URL never changes content
+and can be cached forever; a new upload gets new names. The column also
+records the original it was rendered from, so renditions of a replaced
+image are never served. Jobs lost with their worker process are picked up
+by ``manage.py render_images``.
+"""
+import functools
+import hashlib
+import io
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+RENDITION_DIR = 'renditions'
+
+# Longest side in pixels; smaller images are never upscaled
+SIZES = {
+    'thumbnail': 160,
+    'card': 480,
+    'detail': 1200,
+}
+# Rendition name suffix, file extension and encoder options per format
+FORMATS = {
+    'JPEG': ('', 'jpg', {'quality': 82, 'optimize': True, 'progressive': True}),
+    'WEBP': ('_webp', 'webp', {'quality': 80, 'method': 4}),
+}
+RENDITIONS = [f'{size}{FORMATS[fmt][0]}' for size in SIZES for fmt in FORMATS]
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.IMAGE_RENDITION_WORKERS, thread_name_prefix='renditions',
+            )
+    return _executor
+
+
+def rendition_urls(source, renditions):
+    """Map rendition names to URLs, or return None while ``source`` has none yet."""
+    if not source or not renditions or renditions.get('source') != source:
+        return None
+    return {name: default_storage.url(renditions[name]) for name in RENDITIONS if name in renditions}
+
+
+def needs_renditions(field_file, renditions):
+    return bool(field_file) and (renditions or {}).get('source') != field_file.name
+
+
+def _flatten(image):
+    # JPEG has no alpha channel; composite onto white like a browser would
+    background = Image.new('RGB', image.size, (255, 255, 255))
+    background.paste(image, mask=image.getchannel('A'))
+    return background
+
+
+def render(file):
+    """Return ``{rendition name: (bytes, extension)}`` for an open image file."""
+    with Image.open(file) as original:
+        # JPEG decodes straight to a reduced scale close to the largest size
+        largest = max(SIZES.values())
+        original.draft('RGB', (largest, largest))
+        image = ImageOps.exif_transpose(original)
+        if image.mode not in ('RGB', 'RGBA'):
+            has_alpha = 'A' in image.getbands() or 'transparency' in image.info
+            image = image.convert('RGBA' if has_alpha else 'RGB')
+
+        rendered = {}
+        # Largest first, so each smaller size is resized from the previous one
+        for size_name, size in sorted(SIZES.items(), key=lambda item: -item[1]):
+            image = image.copy()
+            image.thumbnail((size, size), Image.LANCZOS)
+            for fmt, (suffix, extension, options) in FORMATS.items():
+                encoded = _flatten(image) if fmt == 'JPEG' and image.mode == 'RGBA' else image
+                buffer = io.BytesIO()
+                encoded.save(buffer, fmt, **options)
+                rendered[size_name + suffix] = (buffer.getvalue(), extension)
+        return rendered
+
+
+def store(data, extension):
+    digest = hashlib.sha256(data).hexdigest()
+    name = f'{RENDITION_DIR}/{digest[:2]}/{digest[:32]}.{extension}'
+    if not default_storage.exists(name):
+        name = default_storage.save(name, ContentFile(data))
+    return name
+
+
+def update_renditions(model, pk, field_name, source):
+    """
+    Render and store the renditions of ``source`` and record them on row
+    ``pk``, unless its image changed meanwhile. Returns the recorded names,
+    or None when nothing was recorded.
+    """
+    try:
+        with default_storage.open(source, 'rb') as file:
+            rendered = render(file)
+    except Exception:
+        logger.exception('Could not render %s', source)
+        return None
+    renditions = {'source': source}
+    for name, (data, extension) in rendered.items():
+        renditions[name] = store(data, extension)
+    changes = {f'{field_name}_renditions': renditions}
+    if any(field.name == 'updated_at' for field in model._meta.concrete_fields):
+        # Responses embed rendition URLs; see api/conditional.py
+        changes['updated_at'] = timezone.now()
+    updated = model._default_manager.filter(pk=pk, **{field_name: source}).update(**changes)
+    return renditions if updated else None
+
+
+def _run(model, pk, field_name, source, on_ready):
+    if update_renditions(model, pk, field_name, source) and on_ready:
+        on_ready()
+
+
+def _run_in_background(job):
+    # Pool threads keep their own connections; treat each job like a request
+    close_old_connections()
+    try:
+        job()
+    except Exception:
+        logger.exception('Rendition job failed')
+    finally:
+        close_old_connections()
+
+
+def schedule_renditions(instance, field_name, on_ready=None):
+    """Render ``instance``'s ``field_name`` image in the background once the transaction commits."""
+    job = functools.partial(
+        _run, type(instance), instance.pk, field_name, getattr(instance, field_name).name, on_ready,
+    )
+    if settings.IMAGE_RENDITIONS_ASYNC:
+        transaction.on_commit(lambda: get_executor().submit(_run_in_background, job))
+    else:
+        transaction.on_commit(job)
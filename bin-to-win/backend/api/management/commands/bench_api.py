@@ -0,0 +1,408 @@
+import datetime
+import io
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+import warnings
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.core.paginator import UnorderedObjectListWarning
+from django.db import connection
+from django.db.models import Count
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import URLPattern, URLResolver, get_resolver
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from api.benchmarks import benchmark_database, percentile
+from api.blobs import get_blob_store
+from api.models import (
+    BinaryFile, CartItem, Category, ExpiringToken, Order, Product, PromoCode,
+    Retailer, Review, User, Wishlist
+)
+from api.product_io import COLUMNS
+from api.synthetic import PASSWORD, SCALES, generate_dataset
+
+
+class Scenario:
+    """
+    One timed request: ``route`` is the URL name it exercises, ``url`` and
+    ``data`` are formatted with the fixtures, and ``prepare(fixtures, run)``,
+    if given, sets up state for a run outside the timing and returns extra
+    format values (e.g. a fresh cart for a checkout).
+    """
+    def __init__(self, name, route, who, method, url, data=None, status=200, prepare=None, format='json'):
+        self.name = name
+        self.route = route
+        self.who = who
+        self.method = method
+        self.url = url
+        self.data = data
+        self.status = status
+        self.prepare = prepare
+        self.format = format
+
+
+def _fill_cart(fixtures, run):
+    CartItem.objects.filter(user=fixtures['writer']).delete()
+    CartItem.objects.bulk_create(
+        CartItem(user=fixtures['writer'], product_id=pk, quantity=1) for pk in fixtures['in_stock'][:3]
+    )
+    Product.objects.filter(pk__in=fixtures['in_stock'][:3]).update(stock=1000)
+    return {}
+
+
+def _new_cart_item(fixtures, run):
+    CartItem.objects.filter(user=fixtures['writer']).delete()
+    item = CartItem.objects.create(user=fixtures['writer'], product_id=fixtures['product'], quantity=1)
+    return {'new_cart_item': item.pk}
+
+
+def _import_file(fixtures, run):
+    lines = [','.join(COLUMNS)]
+    expiry = (timezone.localdate() + datetime.timedelta(days=5)).isoformat()
+    for i in range(100):
+        lines.append(f"bench-import-{i},Imported {i},Bulk row {i},1.50,3.00,{expiry},{run},{fixtures['category_slug']},,")
+    upload = io.BytesIO('\n'.join(lines).encode())
+    upload.name = 'products.csv'
+    return {'upload': upload}
+
+
+def _empty_cart(fixtures, run):
+    CartItem.objects.filter(user=fixtures['writer']).delete()
+    return {'free_product': fixtures['in_stock'][run % len(fixtures['in_stock'])]}
+
+
+def _offline_cart(fixtures, run):
+    # Sync a cart edited offline: three items in the cart, seven added, one changed, one removed
+    _fill_cart(fixtures, run)
+    products = fixtures['in_stock'][:10]
+    Product.objects.filter(pk__in=products).update(stock=1000)
+    operations = [{'op': 'add', 'product_id': pk, 'quantity': 1} for pk in products[3:]]
+    operations += [
+        {'op': 'update', 'product_id': products[0], 'quantity': 3},
+        {'op': 'remove', 'product_id': products[1]},
+    ]
+    return {'cart_operations': operations}
+
+
+def _empty_wishlist(fixtures, run):
+    Wishlist.objects.filter(user=fixtures['writer']).delete()
+    return {'free_product': fixtures['in_stock'][run % len(fixtures['in_stock'])]}
+
+
+SCENARIOS = [
+    # Reads
+    Scenario('api-root', 'api-root', 'consumer', 'get', '/api/'),
+    Scenario('token-auth', 'token_auth', None, 'post', '/api/token-auth/',
+             {'username': '{consumer_username}', 'password': PASSWORD}),
+    Scenario('catalog-cache-stats', 'catalog_cache_stats', 'staff', 'get', '/api/catalog-cache/stats/'),
+    Scenario('metrics', 'metrics', 'staff', 'get', '/api/metrics/'),
+    Scenario('user-list', 'user-list', 'staff', 'get', '/api/users/'),
+    Scenario('user-me', 'user-me', 'consumer', 'get', '/api/users/me/'),
+    Scenario('user-detail', 'user-detail', 'staff', 'get', '/api/users/{consumer_id}/'),
+    Scenario('category-list', 'category-list', None, 'get', '/api/categories/'),
+    Scenario('category-detail', 'category-detail', None, 'get', '/api/categories/{category}/'),
+    Scenario('retailer-list', 'retailer-list', 'consumer', 'get', '/api/retailers/'),
+    Scenario('retailer-detail', 'retailer-detail', 'consumer', 'get', '/api/retailers/{retailer_id}/'),
+    Scenario('retailer-my-profile', 'retailer-my-profile', 'retailer', 'get', '/api/retailers/my_profile/'),
+    Scenario('product-list', 'product-list', None, 'get', '/api/products/'),
+    Scenario('product-list-page-5', 'product-list', None, 'get', '/api/products/?page=5'),
+    Scenario('product-list-category', 'product-list', None, 'get', '/api/products/?category={category_slug}'),
+    Scenario('product-list-search', 'product-list', None, 'get', '/api/products/?search=fresh'),
+    Scenario('product-list-cheapest', 'product-list', None, 'get', '/api/products/?sort_by=price_asc'),
+    Scenario('product-list-discount', 'product-list', None, 'get', '/api/products/?sort_by=discount'),
+    Scenario('product-list-rating', 'product-list', None, 'get', '/api/products/?sort_by=rating'),
+    Scenario('product-list-expiring', 'product-list', None, 'get', '/api/products/?expiring_soon=3'),
+    Scenario('product-list-fields', 'product-list', None, 'get', '/api/products/?fields=id,name,price'),
+    Scenario('product-detail', 'product-detail', None, 'get', '/api/products/{product}/'),
+    Scenario('product-retailer-products', 'product-retailer-products', 'retailer', 'get',
+             '/api/products/retailer_products/'),
+    Scenario('product-export', 'product-export', 'retailer', 'get', '/api/products/export/'),
+    Scenario('cart-item-list', 'cart-item-list', 'consumer', 'get', '/api/cart-items/'),
+    Scenario('cart-item-detail', 'cart-item-detail', 'consumer', 'get', '/api/cart-items/{cart_item}/'),
+    Scenario('cart-item-cart-total', 'cart-item-cart-total', 'consumer', 'get', '/api/cart-items/cart_total/'),
+    Scenario('wishlist-list', 'wishlist-list', 'consumer', 'get', '/api/wishlists/'),
+    Scenario('wishlist-detail', 'wishlist-detail', 'consumer', 'get', '/api/wishlists/{wishlist}/'),
+    Scenario('order-list', 'order-list', 'consumer', 'get', '/api/orders/'),
+    Scenario('order-list-retailer', 'order-list', 'retailer', 'get', '/api/orders/'),
+    Scenario('order-list-staff', 'order-list', 'staff', 'get', '/api/orders/'),
+    Scenario('order-detail', 'order-detail', 'consumer', 'get', '/api/orders/{order}/'),
+    Scenario('promocode-list', 'promocode-list', 'staff', 'get', '/api/promo-codes/'),
+    Scenario('promocode-detail', 'promocode-detail', 'staff', 'get', '/api/promo-codes/{promo_code}/'),
+    Scenario('review-list', 'review-list', 'consumer', 'get', '/api/reviews/?product={reviewed_product}'),
+    Scenario('review-detail', 'review-detail', 'consumer', 'get', '/api/reviews/{review}/'),
+    Scenario('binaryfile-list', 'binaryfile-list', 'consumer', 'get', '/api/binary-files/'),
+    Scenario('binaryfile-detail', 'binaryfile-detail', 'consumer', 'get', '/api/binary-files/{binary_file}/'),
+    Scenario('binaryfile-download', 'binaryfile-download', 'consumer', 'get',
+             '/api/binary-files/{binary_file}/download/'),
+    # Writes, by a user the reads don't look at
+    Scenario('promocode-validate', 'promocode-validate', 'writer', 'post', '/api/promo-codes/validate/',
+             {'code': '{promo_code_code}', 'cart_total': '100.00'}),
+    Scenario('cart-item-create', 'cart-item-list', 'writer', 'post', '/api/cart-items/',
+             {'product_id': '{free_product}', 'quantity': 1}, status=201, prepare=_empty_cart),
+    Scenario('cart-item-batch', 'cart-item-batch', 'writer', 'post', '/api/cart-items/batch/',
+             {'operations': '{cart_operations}'}, prepare=_offline_cart),
+    Scenario('cart-item-update', 'cart-item-detail', 'writer', 'patch', '/api/cart-items/{new_cart_item}/',
+             {'quantity': 2}, prepare=_new_cart_item),
+    Scenario('cart-item-destroy', 'cart-item-detail', 'writer', 'delete', '/api/cart-items/{new_cart_item}/',
+             status=204, prepare=_new_cart_item),
+    Scenario('wishlist-create', 'wishlist-list', 'writer', 'post', '/api/wishlists/',
+             {'product_id': '{free_product}'}, status=201, prepare=_empty_wishlist),
+    Scenario('order-create', 'order-list', 'writer', 'post', '/api/orders/',
+             {'shipping_address': '1 Bench Street', 'shipping_cost': '4.99'}, status=201, prepare=_fill_cart),
+    Scenario('review-create', 'review-list', 'writer', 'post', '/api/reviews/',
+             {'product': '{product}', 'rating': 4, 'comment': 'Benchmarked'}, status=201),
+    Scenario('product-create', 'product-list', 'retailer', 'post', '/api/products/', {
+        'name': 'Bench loaf', 'slug': 'bench-loaf-{run}', 'description': 'Benchmarked', 'price': '1.00',
+        'original_price': '2.00', 'expiry_date': '{expiry_date}', 'stock': 5, 'category': '{category}',
+        'retailer': '{retailer_id}',
+    }, status=201),
+    Scenario('product-update', 'product-detail', 'retailer', 'patch', '/api/products/{retailer_product}/',
+             {'stock': 7}),
+    Scenario('product-import', 'product-import-file', 'retailer', 'post', '/api/products/import/',
+             {'file': '{upload}'}, prepare=_import_file, format='multipart'),
+]
+
+
+def _format(value, values):
+    if isinstance(value, dict):
+        return {key: _format(item, values) for key, item in value.items()}
+    if isinstance(value, str) and value.startswith('{') and value.endswith('}') and value.count('{') == 1:
+        # A lone placeholder keeps its type (ids stay ints, uploads stay files)
+        return values[value[1:-1]]
+    if isinstance(value, str):
+        return value.format(**values)
+    return value
+
+
+def _route_names(resolver=None, prefix=''):
+    names = set()
+    for pattern in (resolver or get_resolver()).url_patterns:
+        if isinstance(pattern, URLResolver):
+            if pattern.namespace in ('admin', 'rest_framework'):
+                continue
+            names |= _route_names(pattern)
+        elif isinstance(pattern, URLPattern) and pattern.name:
+            names.add(pattern.name)
+    return names
+
+
+class Command(BaseCommand):
+    help = (
+        'Generate a synthetic dataset, drive every API endpoint against it and '
+        'write latency percentiles and query counts per scenario to a JSON '
+        'report; --compare checks the report against an earlier one'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', choices=sorted(SCALES), default='small')
+        parser.add_argument('--products', type=int, help='Override the number of products of --scale')
+        parser.add_argument('--runs', type=int, default=20, help='Timed requests per scenario')
+        parser.add_argument('--warmup', type=int, default=2)
+        parser.add_argument('--scenario', action='append', help='Only run scenarios whose name starts with this')
+        parser.add_argument('--catalog-cache', action='store_true',
+                            help='Leave the catalog response cache on (measures cache hits)')
+        parser.add_argument('--output', default='bench_api.json', help='Where to write the JSON report')
+        parser.add_argument('--compare', help='Earlier report to compare against')
+        parser.add_argument('--threshold', type=float, default=25.0,
+                            help='Percent p50 slowdown counted as a regression (default 25)')
+        parser.add_argument('--fail-on-regression', action='store_true')
+
+    def handle(self, *args, **options):
+        warnings.simplefilter('ignore', UnorderedObjectListWarning)
+        scenarios = [
+            scenario for scenario in SCENARIOS
+            if not options['scenario'] or scenario.name.startswith(tuple(options['scenario']))
+        ]
+        counts = dict(SCALES[options['scale']])
+        if options['products'] is not None:
+            counts['products'] = options['products']
+
+        with benchmark_database(catalog_cache=options['catalog_cache']), \
+                tempfile.TemporaryDirectory() as blob_root, \
+                override_settings(BINARY_FILE_ROOT=blob_root):
+            self.stdout.write(f"Generating the {options['scale']} dataset")
+            timings = generate_dataset(**counts)
+            fixtures = self.fixtures()
+            self.stdout.write(
+                f"{'scenario':<28} {'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8} {'queries':>8} {'KiB':>8}"
+            )
+            results = {}
+            for scenario in scenarios:
+                results[scenario.name] = result = self.run(scenario, fixtures, options)
+                self.stdout.write(
+                    f"{scenario.name:<28} {result['p50_ms']:8.2f} {result['p90_ms']:8.2f} "
+                    f"{result['p99_ms']:8.2f} {result['queries']:>8} {result['bytes'] / 1024:8.1f}"
+                )
+
+        uncovered = sorted(_route_names() - {scenario.route for scenario in SCENARIOS})
+        if uncovered:
+            self.stderr.write(f"Endpoints without a scenario: {', '.join(uncovered)}")
+        report = {
+            'created_at': timezone.now().isoformat(),
+            'environment': self.environment(),
+            'options': {
+                'scale': options['scale'], 'counts': counts, 'runs': options['runs'],
+                'warmup': options['warmup'], 'catalog_cache': options['catalog_cache'],
+            },
+            'dataset': {
+                kind: {'rows': rows, 'seconds': round(seconds, 3)} for kind, (rows, seconds) in timings.items()
+            },
+            'scenarios': results,
+            'uncovered_endpoints': uncovered,
+        }
+        with open(options['output'], 'w') as file:
+            json.dump(report, file, indent=2)
+        self.stdout.write(self.style.SUCCESS(f"Wrote {options['output']}"))
+
+        if options['compare']:
+            self.compare(report, options)
+
+    def fixtures(self):
+        """Users with tokens and the ids the scenario URLs need."""
+        staff = User.objects.create(username='bench-staff', is_staff=True, user_type='admin')
+        writer = User.objects.create(username='bench-writer')
+        # The busiest customer: the most orders, with a cart and wishlist
+        consumer = (
+            User.objects.filter(user_type='consumer', cart_items__isnull=False, wishlist_items__isnull=False)
+            .annotate(order_count=Count('orders', distinct=True))
+            .order_by('-order_count', 'id').first()
+        )
+        retailer = Retailer.objects.annotate(
+            product_count=Count('products')
+        ).order_by('-product_count', 'id').select_related('user').first()
+        if consumer is None or retailer is None:
+            raise CommandError('The dataset needs at least one retailer and one customer with a cart and wishlist')
+        in_stock = list(
+            Product.objects.filter(is_active=True, stock__gt=0).order_by('id').values_list('id', flat=True)[:50]
+        )
+        reviewed = Product.objects.filter(is_active=True).order_by('-rating_count', 'id').first()
+        promo = PromoCode.objects.filter(
+            is_active=True, valid_from__lte=timezone.now(), valid_to__gte=timezone.now()
+        ).order_by('id').first()
+        store = get_blob_store()
+        sha256, size = store.save([b'benchmark blob ' * 4096])
+        binary_file = BinaryFile.objects.create(name='bench.bin', sha256=sha256, size=size, file_type='application/octet-stream')
+        category = Category.objects.filter(products__is_active=True).order_by('id').first()
+
+        return {
+            'staff': staff,
+            'writer': writer,
+            'consumer': consumer,
+            'retailer': retailer.user,
+            'tokens': {
+                who: ExpiringToken.objects.create(user=user).key
+                for who, user in (('staff', staff), ('writer', writer), ('consumer', consumer), ('retailer', retailer.user))
+            },
+            'consumer_id': consumer.pk,
+            'consumer_username': consumer.username,
+            'category': category.pk,
+            'category_slug': category.slug,
+            'retailer_id': retailer.pk,
+            'product': in_stock[0],
+            'in_stock': in_stock,
+            'retailer_product': retailer.products.order_by('id').values_list('id', flat=True).first(),
+            'reviewed_product': reviewed.pk,
+            'cart_item': CartItem.objects.filter(user=consumer).order_by('id').first().pk,
+            'wishlist': Wishlist.objects.filter(user=consumer).order_by('id').first().pk,
+            'order': Order.objects.filter(user=consumer).order_by('id').first().pk,
+            'promo_code': promo.pk,
+            'promo_code_code': promo.code,
+            # Reviews are only listed to their author unless filtered by product
+            'review': (
+                Review.objects.filter(user=consumer).order_by('id').first()
+                or Review.objects.create(product=reviewed, user=consumer, rating=5, comment='Benchmarked')
+            ).pk,
+            'binary_file': binary_file.pk,
+            'expiry_date': (timezone.localdate() + datetime.timedelta(days=5)).isoformat(),
+        }
+
+    def run(self, scenario, fixtures, options):
+        client = APIClient()
+        if scenario.who:
+            client.credentials(HTTP_AUTHORIZATION=f"Token {fixtures['tokens'][scenario.who]}")
+        samples, queries, size = [], set(), 0
+        for run in range(options['warmup'] + options['runs']):
+            values = {**fixtures, 'run': run}
+            if scenario.prepare:
+                values.update(scenario.prepare(fixtures, run))
+            url = _format(scenario.url, values)
+            data = _format(scenario.data, values)
+            kwargs = {'data': data, 'format': scenario.format} if data is not None else {}
+
+            with CaptureQueriesContext(connection) as captured:
+                started = time.perf_counter()
+                response = getattr(client, scenario.method)(url, **kwargs)
+                content = b''.join(response.streaming_content) if response.streaming else response.content
+                elapsed = (time.perf_counter() - started) * 1000
+            if response.status_code != scenario.status:
+                raise CommandError(
+                    f'{scenario.name} returned {response.status_code}, expected {scenario.status}: {content[:300]!r}'
+                )
+            if run >= options['warmup']:
+                samples.append(elapsed)
+                queries.add(len(captured))
+                size = len(content)
+
+        samples.sort()
+        return {
+            'route': scenario.route,
+            'method': scenario.method.upper(),
+            'url': scenario.url,
+            'runs': len(samples),
+            'mean_ms': round(sum(samples) / len(samples), 3),
+            'p50_ms': round(percentile(samples, 50), 3),
+            'p90_ms': round(percentile(samples, 90), 3),
+            'p99_ms': round(percentile(samples, 99), 3),
+            'max_ms': round(samples[-1], 3),
+            # The most any run needed; writes can vary, e.g. a first-time cache miss
+            'queries': max(queries),
+            'bytes': size,
+        }
+
+    def environment(self):
+        try:
+            commit = subprocess.run(
+                ['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR,
+                capture_output=True, text=True, timeout=5,
+            ).stdout.strip() or None
+        except (OSError, subprocess.SubprocessError):
+            commit = None
+        return {
+            'commit': commit,
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'database': connection.vendor,
+            'cpu_count': os.cpu_count(),
+        }
+
+    def compare(self, report, options):
+        with open(options['compare']) as file:
+            baseline = json.load(file)
+        self.stdout.write(f"Compared with {options['compare']} ({baseline['environment'].get('commit')})")
+        regressions = []
+        for name, result in report['scenarios'].items():
+            before = baseline['scenarios'].get(name)
+            if before is None:
+                self.stdout.write(f'{name:<28} new')
+                continue
+            change = (result['p50_ms'] - before['p50_ms']) / before['p50_ms'] * 100 if before['p50_ms'] else 0.0
+            line = (
+                f"{name:<28} p50 {before['p50_ms']:8.2f} -> {result['p50_ms']:8.2f}ms ({change:+6.1f}%)  "
+                f"queries {before['queries']} -> {result['queries']}"
+            )
+            # Ignore sub-millisecond jitter on the fastest endpoints
+            slower = change > options['threshold'] and result['p50_ms'] - before['p50_ms'] > 1
+            if result['queries'] > before['queries'] or slower:
+                regressions.append(line)
+                self.stdout.write(self.style.ERROR(f'{line}  REGRESSION'))
+            else:
+                self.stdout.write(line)
+        if regressions and options['fail_on_regression']:
+            raise CommandError(f'{len(regressions)} scenarios regressed')
@@ -0,0 +1,62 @@
+import random
+
+from django.core.management.base import BaseCommand
+from rest_framework.test import APIClient
+
+from api.benchmarks import benchmark_database, measure, seed_catalog
+from api.catalog_cache import get_cache, get_stats, reset_stats
+from api.models import Category, Product
+
+SORTS = ['newest', 'price_asc', 'price_desc', 'discount']
+
+
+class Command(BaseCommand):
+    help = 'Measure catalog cache hit/miss latency and the hit ratio of a skewed anonymous workload'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=50000)
+        parser.add_argument('--requests', type=int, default=5000)
+        parser.add_argument('--write-every', type=int, default=500,
+                            help='Save one product every N requests (0 disables writes)')
+        parser.add_argument('--runs', type=int, default=50)
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        client = APIClient()
+        rng = random.Random(options['seed'])
+
+        with benchmark_database(catalog_cache=True):
+            seed_catalog(options['products'])
+            categories = list(Category.objects.values_list('slug', flat=True))
+            product_ids = list(Product.objects.values_list('id', flat=True)[:1000])
+
+            params = {'sort_by': 'discount', 'category': categories[0]}
+            get_cache().clear()
+            miss = measure(lambda: (get_cache().clear(), client.get('/api/products/', params)), runs=options['runs'])
+            client.get('/api/products/', params)
+            hit = measure(lambda: client.get('/api/products/', params), runs=options['runs'])
+            self.stdout.write(f"{options['products']} products")
+            self.stdout.write(f"miss  p50={miss['p50_ms']:7.2f}ms  p99={miss['p99_ms']:7.2f}ms")
+            self.stdout.write(f"hit   p50={hit['p50_ms']:7.2f}ms  p99={hit['p99_ms']:7.2f}ms")
+
+            # Most traffic lands on the first pages of popular listings
+            pool = [
+                {'sort_by': sort_by, 'category': category, 'page': page}
+                for sort_by in SORTS for category in categories for page in range(1, 6)
+            ]
+            weights = [1 / (rank + 1) for rank in range(len(pool))]
+            get_cache().clear()
+            reset_stats()
+            for i in range(1, options['requests'] + 1):
+                if rng.random() < 0.2:
+                    client.get(f'/api/products/{rng.choice(product_ids)}/')
+                else:
+                    client.get('/api/products/', rng.choices(pool, weights)[0])
+                if options['write_every'] and i % options['write_every'] == 0:
+                    Product.objects.get(pk=rng.choice(product_ids)).save()
+
+            for resource, counts in sorted(get_stats().items()):
+                self.stdout.write(
+                    f"{resource:<18} hits={counts['hits']:6d}  misses={counts['misses']:6d}  "
+                    f"hit ratio={counts['hit_ratio']:.1%}"
+                )
@@ -0,0 +1,146 @@
+import random
+import time
+import warnings
+from collections import defaultdict
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.core.paginator import UnorderedObjectListWarning
+from django.urls import resolve
+from rest_framework.test import APIClient
+
+from api.benchmarks import benchmark_database
+from api.models import Category, Order, Product, User
+from api.synthetic import SCALES, generate_dataset, zipf_weights
+
+SORTS = ['', 'newest', 'price_asc', 'discount']
+
+
+def build_trace(rng, clients, requests, products, categories, write_every):
+    """
+    ``[(client, url or None)]``: each client is a frontend tab polling a few
+    pages over and over, the popular ones more often; None marks a write.
+    """
+    product_weights = zipf_weights(len(products))
+    category_weights = zipf_weights(len(categories))
+    tabs = []
+    for _ in range(clients):
+        pages = ['/api/categories/', '/api/orders/', '/api/products/']
+        for _ in range(3):
+            category = rng.choices(categories, cum_weights=category_weights)[0]
+            pages.append(f'/api/products/?category={category}&sort_by={rng.choice(SORTS)}')
+        for _ in range(4):
+            pages.append(f'/api/products/{rng.choices(products, cum_weights=product_weights)[0]}/')
+        tabs.append(pages)
+
+    trace = []
+    for number in range(1, requests + 1):
+        client = rng.randrange(clients)
+        trace.append((client, rng.choice(tabs[client])))
+        if write_every and number % write_every == 0:
+            trace.append((client, None))
+    return trace
+
+
+class Command(BaseCommand):
+    help = (
+        'Replay a trace of frontend polling (catalog pages, product details, '
+        'categories and the user\'s orders, with some writes) once with clients '
+        'that ignore ETags and once with clients that revalidate, and report '
+        'the bytes and server CPU time conditional requests save'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', choices=sorted(SCALES), default='small')
+        parser.add_argument('--products', type=int, help='Override the number of products of --scale')
+        parser.add_argument('--clients', type=int, default=50)
+        parser.add_argument('--requests', type=int, default=3000)
+        parser.add_argument('--write-every', type=int, default=100,
+                            help='Change a product or an order every N requests (0 disables writes)')
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        warnings.simplefilter('ignore', UnorderedObjectListWarning)
+        counts = dict(SCALES[options['scale']])
+        if options['products'] is not None:
+            counts['products'] = options['products']
+
+        results = {}
+        for mode in ('plain', 'conditional'):
+            # Both replays start from the same dataset and make the same writes
+            with benchmark_database(catalog_cache=True):
+                generate_dataset(**counts, seed=options['seed'])
+                results[mode] = self.replay(options, revalidate=mode == 'conditional')
+
+        plain, conditional = results['plain'], results['conditional']
+        self.stdout.write(
+            f"{options['requests']} requests from {options['clients']} clients, "
+            f"a write every {options['write_every']}"
+        )
+        self.stdout.write(f"{'endpoint':<16} {'requests':>8} {'304':>7} {'KiB plain':>10} {'KiB cond':>10} "
+                          f"{'CPU ms plain':>13} {'CPU ms cond':>12}")
+        for name in sorted(plain['endpoints']):
+            before, after = plain['endpoints'][name], conditional['endpoints'][name]
+            self.stdout.write(
+                f"{name:<16} {after['requests']:>8} {after['not_modified'] / after['requests']:>7.1%} "
+                f"{before['bytes'] / 1024:>10,.1f} {after['bytes'] / 1024:>10,.1f} "
+                f"{before['cpu'] * 1000:>13,.0f} {after['cpu'] * 1000:>12,.0f}"
+            )
+        for label, key, scale, unit in (('bytes', 'bytes', 1 / 1024, 'KiB'), ('CPU', 'cpu', 1000, 'ms')):
+            saved = plain[key] - conditional[key]
+            self.stdout.write(
+                f"{label:<6} {plain[key] * scale:10,.1f} {unit} -> {conditional[key] * scale:10,.1f} {unit}  "
+                f"({saved / plain[key]:.1%} saved)"
+            )
+
+    def replay(self, options, revalidate):
+        rng = random.Random(options['seed'])
+        users = list(
+            User.objects.filter(user_type='consumer', orders__isnull=False).distinct().order_by('id')
+            [:options['clients']]
+        )
+        products = list(Product.objects.filter(is_active=True).order_by('id').values_list('id', flat=True))
+        categories = list(Category.objects.order_by('id').values_list('slug', flat=True))
+        trace = build_trace(rng, len(users), options['requests'], products, categories, options['write_every'])
+
+        clients = []
+        for user in users:
+            client = APIClient()
+            client.force_authenticate(user)
+            clients.append(client)
+        etags = defaultdict(dict)
+        endpoints = defaultdict(lambda: {'requests': 0, 'not_modified': 0, 'bytes': 0, 'cpu': 0.0})
+        for client, url in trace:
+            if url is None:
+                self.write(rng, users[client], products)
+                continue
+            headers = {}
+            if revalidate and url in etags[client]:
+                headers['HTTP_IF_NONE_MATCH'] = etags[client][url]
+            # The test client serves the request in this process
+            started = time.process_time()
+            response = clients[client].get(url, **headers)
+            cpu = time.process_time() - started
+            if response.has_header('ETag'):
+                etags[client][url] = response['ETag']
+            stats = endpoints[resolve(url.split('?')[0]).url_name]
+            stats['requests'] += 1
+            stats['not_modified'] += response.status_code == 304
+            stats['bytes'] += len(response.content)
+            stats['cpu'] += cpu
+        return {
+            'endpoints': dict(endpoints),
+            'bytes': sum(stats['bytes'] for stats in endpoints.values()),
+            'cpu': sum(stats['cpu'] for stats in endpoints.values()),
+        }
+
+    def write(self, rng, user, products):
+        if rng.random() < 0.8:
+            # A retailer marks a product down
+            product = Product.objects.get(pk=rng.choice(products))
+            product.price = max(product.price - Decimal('0.10'), Decimal('0.10'))
+            product.save()
+        else:
+            order = Order.objects.filter(user=user).order_by('-created_at').first()
+            order.status = 'processing' if order.status != 'processing' else 'shipped'
+            order.save()
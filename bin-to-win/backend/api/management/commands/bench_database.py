@@ -0,0 +1,130 @@
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connection, connections
+from django.test.utils import override_settings
+from rest_framework.test import APIClient
+
+from api.benchmarks import benchmark_database, percentile, seed_catalog
+from api.models import CartItem, Product, User
+
+TUNED_PRAGMAS = {'journal_mode': 'WAL', 'busy_timeout': 5000, 'synchronous': 'NORMAL'}
+
+# (name, SQLITE_PRAGMAS, CONN_MAX_AGE)
+SQLITE_PROFILES = [
+    ('sqlite-rollback', {'journal_mode': 'DELETE', 'synchronous': 'FULL'}, 0),
+    ('sqlite-wal', TUNED_PRAGMAS, 0),
+    ('sqlite-wal-persistent', TUNED_PRAGMAS, 600),
+]
+POSTGRES_PROFILES = [
+    ('postgresql', {}, 0),
+    ('postgresql-persistent', {}, 600),
+]
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare concurrent catalog reads and cart writes across database '
+        'profiles (SQLite journal modes, connection reuse) on a file-backed '
+        'test database'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=2000)
+        parser.add_argument('--threads', type=int, default=8)
+        parser.add_argument('--duration', type=float, default=5.0, help='Seconds per profile')
+        parser.add_argument('--write-ratio', type=float, default=0.2,
+                            help='Share of requests that update a cart item')
+        parser.add_argument('--profile', action='append',
+                            help='Only run these profiles (repeatable)')
+
+    def handle(self, *args, **options):
+        profiles = SQLITE_PROFILES if connection.vendor == 'sqlite' else POSTGRES_PROFILES
+        if options['profile']:
+            profiles = [profile for profile in profiles if profile[0] in options['profile']]
+
+        self.stdout.write(
+            f"{options['threads']} threads, {options['write_ratio']:.0%} writes, "
+            f"{options['duration']:.0f}s per profile, replicas: {settings.DATABASE_REPLICAS or 'none'}"
+        )
+        self.stdout.write(
+            f"{'profile':<22} {'reads/s':>8} {'writes/s':>9} {'read p50/p99 ms':>16} "
+            f"{'write p50/p99 ms':>17} {'errors':>7}"
+        )
+        for name, pragmas, conn_max_age in profiles:
+            with override_settings(SQLITE_PRAGMAS=pragmas):
+                self.run_profile(name, conn_max_age, options)
+
+    def run_profile(self, name, conn_max_age, options):
+        old_max_age = settings.DATABASES['default'].get('CONN_MAX_AGE', 0)
+        with benchmark_database(on_disk=True):
+            # Threads open their own connections from settings.DATABASES
+            settings.DATABASES['default']['CONN_MAX_AGE'] = conn_max_age
+            try:
+                workers = self.seed(options)
+                deadline = time.perf_counter() + options['duration']
+                with ThreadPoolExecutor(max_workers=options['threads']) as pool:
+                    results = list(pool.map(lambda worker: self.work(worker, deadline, options), workers))
+            finally:
+                settings.DATABASES['default']['CONN_MAX_AGE'] = old_max_age
+                connections.close_all()
+
+        reads = sorted(latency for result in results for latency in result['read'])
+        writes = sorted(latency for result in results for latency in result['write'])
+        errors = sum(result['errors'] for result in results)
+        duration = options['duration']
+        self.stdout.write(
+            f"{name:<22} {len(reads) / duration:8.1f} {len(writes) / duration:9.1f} "
+            f"{percentile(reads, 50):7.2f}/{percentile(reads, 99):<8.2f} "
+            f"{percentile(writes, 50):8.2f}/{percentile(writes, 99):<8.2f} {errors:>7}"
+        )
+
+    def seed(self, options):
+        seed_catalog(options['products'])
+        product_ids = list(Product.objects.values_list('id', flat=True))
+        users = User.objects.bulk_create(
+            User(username=f'db-bench-{i}') for i in range(options['threads'])
+        )
+        items = CartItem.objects.bulk_create(
+            CartItem(user=user, product_id=product_ids[i % len(product_ids)], quantity=1)
+            for i, user in enumerate(users)
+        )
+        pages = max(1, len(product_ids) // settings.REST_FRAMEWORK['PAGE_SIZE'])
+        return [
+            {'user': user, 'item': item.pk, 'pages': pages, 'seed': i}
+            for i, (user, item) in enumerate(zip(users, items))
+        ]
+
+    def work(self, worker, deadline, options):
+        rng = random.Random(worker['seed'])
+        client = APIClient()
+        client.force_authenticate(worker['user'])
+        result = {'read': [], 'write': [], 'errors': 0}
+        try:
+            while time.perf_counter() < deadline:
+                write = rng.random() < options['write_ratio']
+                started = time.perf_counter()
+                try:
+                    if write:
+                        response = client.patch(
+                            f"/api/cart-items/{worker['item']}/", {'quantity': rng.randint(1, 5)}, format='json'
+                        )
+                    else:
+                        response = client.get(f"/api/products/?page={rng.randint(1, worker['pages'])}")
+                    ok = response.status_code == 200
+                except Exception:
+                    ok = False
+                latency = (time.perf_counter() - started) * 1000
+                if ok:
+                    result['write' if write else 'read'].append(latency)
+                else:
+                    result['errors'] += 1
+                # The test client skips Django's per-request connection
+                # handling; close (or keep) the connection as a server would.
+                close_old_connections()
+        finally:
+            connection.close()
+        return result
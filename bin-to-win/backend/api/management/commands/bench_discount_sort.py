@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand
+from rest_framework.test import APIClient
+
+from api.benchmarks import benchmark_database, measure, seed_catalog
+from api.models import Product
+
+
+class Command(BaseCommand):
+    help = 'Measure page-1 latency of /api/products/?sort_by=discount at several catalog sizes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='10000,100000,1000000',
+                            help='Comma separated catalog sizes to benchmark')
+        parser.add_argument('--runs', type=int, default=20)
+        parser.add_argument('--legacy', action='store_true',
+                            help='Also time the old in-Python sort for comparison')
+
+    def handle(self, *args, **options):
+        sizes = sorted(int(size) for size in options['sizes'].split(','))
+        client = APIClient()
+
+        with benchmark_database():
+            for size in sizes:
+                seed_catalog(size)
+                stats = measure(
+                    lambda: client.get('/api/products/', {'sort_by': 'discount'}),
+                    runs=options['runs']
+                )
+                self.stdout.write(
+                    f"{size:>9} products  sql sort   p50={stats['p50_ms']:.2f}ms  p99={stats['p99_ms']:.2f}ms"
+                )
+
+                if options['legacy']:
+                    def legacy_sort():
+                        queryset = Product.objects.filter(is_active=True)
+                        return sorted(
+                            queryset,
+                            key=lambda x: ((x.original_price - x.price) / x.original_price) if x.original_price > 0 else 0,
+                            reverse=True
+                        )[:10]
+
+                    stats = measure(legacy_sort, runs=max(1, options['runs'] // 10), warmup=0)
+                    self.stdout.write(
+                        f"{size:>9} products  python sort p50={stats['p50_ms']:.2f}ms  p99={stats['p99_ms']:.2f}ms"
+                    )
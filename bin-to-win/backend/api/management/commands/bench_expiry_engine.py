@@ -0,0 +1,24 @@
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+
+from api.benchmarks import benchmark_database, seed_catalog
+
+
+class Command(BaseCommand):
+    help = 'Run the expiry engine over a seeded catalog and report throughput and peak memory per step'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='100000,1000000',
+                            help='Comma separated catalog sizes to benchmark')
+        parser.add_argument('--batch-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        sizes = sorted(int(size) for size in options['sizes'].split(','))
+        for size in sizes:
+            # Fresh database per size so every run starts with unprocessed products
+            with benchmark_database():
+                seed_catalog(size)
+                self.stdout.write(f'{size} products')
+                call_command(
+                    'run_expiry_engine', batch_size=options['batch_size'], trace_memory=True, stdout=self.stdout
+                )
@@ -0,0 +1,95 @@
+import io
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.test import Client
+from django.test.utils import override_settings
+from PIL import Image
+
+from api.benchmarks import benchmark_database, seed_catalog
+from api.images import RENDITIONS, render, update_renditions
+from api.models import Product
+
+
+def photo(width, height, seed):
+    """A JPEG with smooth shapes and sensor-like grain, compressed like a phone camera."""
+    shapes = Image.effect_noise((width // 64 + 1, height // 64 + 1), 80 + seed % 40)
+    gradient = Image.linear_gradient('L').rotate(seed * 37 % 360).resize((width, height))
+    grain = Image.effect_noise((width, height), 10)
+    shapes = shapes.resize((width, height), Image.BICUBIC)
+    image = Image.merge('RGB', (shapes, gradient, Image.blend(shapes, grain, 0.3)))
+    buffer = io.BytesIO()
+    image.save(buffer, 'JPEG', quality=92)
+    return buffer.getvalue()
+
+
+class Command(BaseCommand):
+    help = (
+        'Upload phone-sized product photos, then report bytes per product card '
+        '(list JSON plus the image a card shows) with the original and with each '
+        'card rendition, and how fast renditions render'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--cards', type=int, default=10, help='Products, one photo each')
+        parser.add_argument('--size', default='4032x3024', help='Photo size as WIDTHxHEIGHT')
+        parser.add_argument('--workers', type=int, default=4)
+
+    def handle(self, *args, **options):
+        width, height = (int(value) for value in options['size'].split('x'))
+        with benchmark_database(), tempfile.TemporaryDirectory() as media_root, \
+                override_settings(MEDIA_ROOT=media_root):
+            seed_catalog(options['cards'])
+            for number, pk in enumerate(Product.objects.order_by('id').values_list('id', flat=True)):
+                name = default_storage.save(f'product_images/photo-{number}.jpg', ContentFile(photo(width, height, number)))
+                Product.objects.filter(pk=pk).update(image=name)
+            products = list(Product.objects.values_list('id', 'image'))
+            originals = sum(default_storage.size(name) for _, name in products) / len(products)
+            self.stdout.write(
+                f'{len(products)} photos {width}x{height}, {originals / 1024:,.0f} KiB on average'
+            )
+
+            json_before = self.json_per_card()
+
+            started = time.perf_counter()
+            for _, name in products:
+                with default_storage.open(name, 'rb') as file:
+                    render(file)
+            serial = (time.perf_counter() - started) / len(products)
+
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+                list(executor.map(lambda row: update_renditions(Product, row[0], 'image', row[1]), products))
+            pooled = len(products) / (time.perf_counter() - started)
+            self.stdout.write(
+                f'render {serial * 1000:,.0f} ms/photo serially, '
+                f"{pooled:,.1f} photos/s (incl. storing) on {options['workers']} threads"
+            )
+
+            renditions = list(Product.objects.values_list('image_renditions', flat=True))
+            for name in RENDITIONS:
+                size = sum(default_storage.size(row[name]) for row in renditions) / len(renditions)
+                self.stdout.write(f'  {name:<15} {size / 1024:8.1f} KiB')
+
+            json_after = self.json_per_card()
+            self.stdout.write('bytes per card (list JSON + card image):')
+            for label, json_size, image_size in (
+                ('original', json_before, originals),
+                ('card', json_after, self.average_size(renditions, 'card')),
+                ('card_webp', json_after, self.average_size(renditions, 'card_webp')),
+            ):
+                self.stdout.write(
+                    f'  {label:<10} {json_size:6,.0f} B JSON + {image_size / 1024:8.1f} KiB '
+                    f'= {(json_size + image_size) / 1024:8.1f} KiB  ({originals / image_size:5.1f}x smaller image)'
+                )
+
+    def average_size(self, renditions, name):
+        return sum(default_storage.size(row[name]) for row in renditions) / len(renditions)
+
+    def json_per_card(self):
+        response = Client().get('/api/products/')
+        return len(response.content) / len(response.json()['results'])
@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand
+from rest_framework.test import APIClient
+
+from api.benchmarks import benchmark_database, measure, seed_catalog
+
+SORTS = ['newest', 'price_asc', 'price_desc', 'discount']
+
+
+class Command(BaseCommand):
+    help = 'Compare deep-page latency of page-number and cursor pagination on /api/products/'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=100000)
+        parser.add_argument('--page', type=int, default=1000)
+        parser.add_argument('--runs', type=int, default=20)
+
+    def handle(self, *args, **options):
+        client = APIClient()
+        page = options['page']
+
+        with benchmark_database():
+            seed_catalog(options['products'])
+            self.stdout.write(f"{options['products']} products, page {page}")
+
+            for sort_by in SORTS:
+                cases = [
+                    ('page number', {'sort_by': sort_by, 'page': page}),
+                    ('page, no count', {'sort_by': sort_by, 'page': page, 'count': 'false'}),
+                    ('cursor', self.cursor_params(client, sort_by, page)),
+                    ('cursor, no count', {**self.cursor_params(client, sort_by, page), 'count': 'false'}),
+                ]
+                for label, params in cases:
+                    stats = measure(lambda: client.get('/api/products/', params), runs=options['runs'])
+                    self.stdout.write(
+                        f"{sort_by:<11} {label:<17} p50={stats['p50_ms']:7.2f}ms  p99={stats['p99_ms']:7.2f}ms"
+                    )
+
+    def cursor_params(self, client, sort_by, page):
+        """Follow next links to find the cursor that opens ``page``."""
+        params = {'sort_by': sort_by, 'pagination': 'cursor', 'count': 'false'}
+        for _ in range(page - 1):
+            next_link = client.get('/api/products/', params).data['next']
+            params = {'sort_by': sort_by, 'cursor': next_link.split('cursor=')[1].split('&')[0]}
+        return params
@@ -0,0 +1,93 @@
+import csv
+import datetime
+import json
+import os
+import resource
+import tempfile
+import time
+import tracemalloc
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from api.benchmarks import benchmark_database, seed_catalog
+from api.models import Product, Retailer
+from api.product_io import COLUMNS, FORMATS, export_rows, import_products
+
+
+class Command(BaseCommand):
+    help = (
+        'Time bulk product import (creating, then updating every row) and export '
+        'for a generated CSV or JSON Lines file, and report peak memory'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=100000)
+        parser.add_argument('--format', choices=FORMATS, default='csv')
+        parser.add_argument('--batch-size', type=int, default=2000)
+        parser.add_argument('--trace-memory', action='store_true',
+                            help='Report peak Python memory per step (slows every step down)')
+
+    def handle(self, *args, **options):
+        with benchmark_database(on_disk=True), tempfile.TemporaryDirectory() as directory:
+            seed_catalog(0)
+            retailer = Retailer.objects.order_by('id').first()
+            path = os.path.join(directory, f"products.{options['format']}")
+            self.write_file(path, options['rows'], options['format'])
+            self.stdout.write(
+                f"{options['rows']} rows, {options['format']}, "
+                f"{os.path.getsize(path) / 1024 / 1024:.1f} MiB, batches of {options['batch_size']}"
+            )
+
+            def run_import():
+                with open(path, 'rb') as file:
+                    return import_products(file, options['format'], retailer, batch_size=options['batch_size'])
+
+            for label in ('create', 'update'):
+                report, elapsed, memory = self.timed(run_import, options['trace_memory'])
+                self.stdout.write(
+                    f"import/{label:<7} {elapsed:7.2f}s {options['rows'] / elapsed:>9,.0f} rows/s  {memory}  "
+                    f"({report.created} created, {report.updated} updated, {report.error_count} invalid)"
+                )
+
+            size, elapsed, memory = self.timed(
+                lambda: sum(len(line) for line in export_rows(Product.objects.all(), options['format'])),
+                options['trace_memory'],
+            )
+            self.stdout.write(
+                f"export         {elapsed:7.2f}s {options['rows'] / elapsed:>9,.0f} rows/s  {memory}  "
+                f"({size / 1024 / 1024:.1f} MiB)"
+            )
+
+    def timed(self, func, trace_memory):
+        if trace_memory:
+            tracemalloc.start()
+        started = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - started
+        if trace_memory:
+            memory = f'peak {tracemalloc.get_traced_memory()[1] / 1024 / 1024:6.1f} MiB'
+            tracemalloc.stop()
+        else:
+            # ru_maxrss is in KiB on Linux
+            memory = f'max RSS {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:6.1f} MiB'
+        return result, elapsed, memory
+
+    def write_file(self, path, rows, file_format):
+        today = timezone.localdate()
+        with open(path, 'w', newline='') as file:
+            writer = csv.writer(file) if file_format == 'csv' else None
+            if writer:
+                writer.writerow(COLUMNS)
+            for i in range(rows):
+                original_price = f'{1 + (i * 37) % 99}.{i % 100:02d}'
+                row = [
+                    f'import-{i}', f'Imported product #{i}', f'Bulk imported surplus stock, lot {i}.',
+                    f'{(i * 13) % 100 / 100 * float(original_price):.2f}', original_price,
+                    (today + datetime.timedelta(days=i % 60)).isoformat(), (i * 11) % 200,
+                    f'category-{i % 10}', i % 20 == 0, True,
+                ]
+                if writer:
+                    writer.writerow(row)
+                else:
+                    file.write(json.dumps(dict(zip(COLUMNS, row))) + '\n')
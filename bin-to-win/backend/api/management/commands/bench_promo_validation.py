@@ -0,0 +1,69 @@
+import datetime
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from api.benchmarks import benchmark_database
+from api.discounts import calculate_discount, get_active_promo
+from api.models import PromoCode, User
+from api.views import PromoCodeViewSet
+
+
+class Command(BaseCommand):
+    help = 'Report promo code validations per second: database lookup vs the cached discount engine'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--codes', type=int, default=1000)
+        parser.add_argument('--validations', type=int, default=20000)
+
+    def handle(self, *args, **options):
+        with benchmark_database():
+            now = timezone.now()
+            PromoCode.objects.bulk_create(
+                PromoCode(
+                    code=f'BENCH{i}',
+                    discount_percentage=10 if i % 2 else 0,
+                    discount_amount=Decimal('5.00'),
+                    valid_from=now - datetime.timedelta(days=1),
+                    valid_to=now + datetime.timedelta(days=30),
+                    minimum_order_value=Decimal('20.00'),
+                )
+                for i in range(options['codes'])
+            )
+            codes = [f'BENCH{i % options["codes"]}' for i in range(options['validations'])]
+            subtotal = Decimal('42.50')
+
+            def database_lookup(code):
+                moment = timezone.now()
+                promo = PromoCode.objects.get(
+                    code=code, is_active=True, valid_from__lte=moment, valid_to__gte=moment
+                )
+                return calculate_discount(promo, subtotal)
+
+            def engine_lookup(code):
+                return calculate_discount(get_active_promo(code), subtotal)
+
+            user = User.objects.create(username='bench-promo')
+            factory = APIRequestFactory()
+            view = PromoCodeViewSet.as_view({'post': 'validate'})
+
+            def endpoint(code):
+                request = factory.post(
+                    '/api/promo-codes/validate/', {'code': code, 'cart_total': '42.50'}, format='json'
+                )
+                force_authenticate(request, user)
+                return view(request)
+
+            for label, func, count in [
+                ('database lookup', database_lookup, len(codes) // 10),
+                ('discount engine', engine_lookup, len(codes)),
+                ('validate endpoint', endpoint, len(codes) // 10),
+            ]:
+                started = time.perf_counter()
+                for code in codes[:count]:
+                    func(code)
+                elapsed = time.perf_counter() - started
+                self.stdout.write(f'{label:<18} {count / elapsed:>12,.0f} validations/s')
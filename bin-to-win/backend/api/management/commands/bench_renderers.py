@@ -0,0 +1,83 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from api import compression
+from api.benchmarks import benchmark_database, measure
+from api.models import Order, Product
+from api.renderers import FastJSONRenderer, orjson
+from api.serializers import OrderSerializer, ProductCardSerializer, ProductSerializer, ValuesSerializer
+from api.synthetic import generate_dataset
+from api.views import OrderViewSet
+
+
+class Command(BaseCommand):
+    help = (
+        'Time serializing and encoding product and order pages with DRF\'s '
+        'JSONRenderer and the orjson renderer, and report their size on the '
+        'wire uncompressed, gzipped and (with the brotli package) brotli-compressed'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=100, help='Rows per page')
+        parser.add_argument('--runs', type=int, default=50)
+
+    def handle(self, *args, **options):
+        rows = options['rows']
+        request = Request(APIRequestFactory().get('/api/products/'))
+        context = {'request': request}
+        renderers = [('json', JSONRenderer())]
+        if orjson is not None:
+            renderers.append(('orjson', FastJSONRenderer()))
+        else:
+            self.stderr.write('orjson is not installed; FastJSONRenderer falls back to json')
+        codings = ['gzip'] + (['br'] if compression.brotli is not None else [])
+
+        with benchmark_database():
+            generate_dataset(users=rows, retailers=10, categories=12, products=rows * 2, orders=rows * 2)
+            products = list(
+                Product.objects.filter(is_active=True).select_related('category', 'retailer')
+                .order_by('-created_at', '-id')[:rows]
+            )
+            card_values = ValuesSerializer(ProductCardSerializer(context=context))
+            card_rows = list(card_values.queryset(
+                Product.objects.filter(id__in=[product.id for product in products]).order_by('-created_at', '-id')
+            ))
+            orders = list(OrderViewSet().prefetch_items(Order.objects.order_by('-created_at', '-id'))[:rows])
+            pages = [
+                ('product (full)', lambda: ProductSerializer(products, many=True, context=context).data),
+                ('product (card)', lambda: card_values.represent(card_rows)),
+                ('order', lambda: OrderSerializer(orders, many=True, context=context).data),
+            ]
+
+            self.stdout.write(
+                f"{rows} rows per page, gzip level {settings.COMPRESSION_GZIP_LEVEL}, "
+                f"brotli quality {settings.COMPRESSION_BROTLI_QUALITY}"
+                + ('' if compression.brotli is not None else ' (brotli not installed)')
+            )
+            for label, serialize in pages:
+                data = serialize()
+                serialized = measure(serialize, runs=options['runs'])
+                self.stdout.write(f"{label:<16} serialize       p50={serialized['p50_ms']:7.2f}ms")
+                outputs = {}
+                for name, renderer in renderers:
+                    outputs[name] = renderer.render(data)
+                    encoded = measure(lambda: renderer.render(data), runs=options['runs'])
+                    self.stdout.write(
+                        f"{'':<16} encode {name:<8} p50={encoded['p50_ms']:7.2f}ms  "
+                        f"serialize+encode {serialized['p50_ms'] + encoded['p50_ms']:7.2f}ms"
+                    )
+                if len(set(outputs.values())) > 1:
+                    raise CommandError(f'{label}: the renderers disagree')
+
+                payload = outputs[renderers[-1][0]]
+                self.stdout.write(f"{'':<16} wire identity   {len(payload) / 1024:8.1f} KiB")
+                for coding in codings:
+                    compressed = compression.compress(coding, payload)
+                    timed = measure(lambda: compression.compress(coding, payload), runs=options['runs'])
+                    self.stdout.write(
+                        f"{'':<16} wire {coding:<10} {len(compressed) / 1024:8.1f} KiB  "
+                        f"({len(payload) / len(compressed):4.1f}x, p50={timed['p50_ms']:6.2f}ms)"
+                    )
@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from api.benchmarks import benchmark_database, measure, seed_catalog
+from api.models import Product
+from api.search import search_products
+
+QUERIES = ['tomatoes', 'organic apples', 'smok', 'fresh salmon retailer', 'lot 4242', 'nothingmatches']
+
+
+class Command(BaseCommand):
+    help = 'Compare full-text product search against the icontains scan'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=100000)
+        parser.add_argument('--runs', type=int, default=20)
+
+    def handle(self, *args, **options):
+        with benchmark_database():
+            seed_catalog(options['products'])
+            base = Product.objects.filter(is_active=True)
+
+            self.stdout.write(f"{options['products']} products, first page of 10 results")
+            for text in QUERIES:
+                def icontains():
+                    queryset = base.filter(Q(name__icontains=text) | Q(description__icontains=text))
+                    queryset.count()
+                    return list(queryset.order_by('-created_at')[:10])
+
+                def fulltext():
+                    queryset = search_products(base, text, ranked=True)
+                    queryset.count()
+                    return list(queryset.order_by('-search_rank', '-created_at')[:10])
+
+                for label, func in (('icontains', icontains), ('fulltext', fulltext)):
+                    stats = measure(func, runs=options['runs'])
+                    self.stdout.write(
+                        f"{text!r:<26} {label:<10} p50={stats['p50_ms']:8.2f}ms  p99={stats['p99_ms']:8.2f}ms"
+                    )
@@ -0,0 +1,59 @@
+from django.core.management.base import BaseCommand
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from api.benchmarks import benchmark_database, measure, seed_catalog
+from api.models import Product
+from api.serializers import ProductCardSerializer, ProductSerializer, ValuesSerializer
+
+SPARSE_FIELDS = ['id', 'name', 'price', 'image']
+
+
+class Command(BaseCommand):
+    help = (
+        'Time product list serialization (query + serialize + render) for the '
+        'full serializer, the card serializer, the values() fast path and a '
+        'sparse fieldset, and report the payload size'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', default='1000,10000', help='Comma separated row counts')
+        parser.add_argument('--runs', type=int, default=5)
+
+    def handle(self, *args, **options):
+        row_counts = sorted(int(rows) for rows in options['rows'].split(','))
+        request = Request(APIRequestFactory().get('/api/products/'))
+        context = {'request': request}
+        renderer = JSONRenderer()
+
+        def instances(serializer_class, **kwargs):
+            return lambda queryset: serializer_class(queryset, many=True, context=context, **kwargs).data
+
+        def values(serializer_class, **kwargs):
+            serializer = ValuesSerializer(serializer_class(context=context, **kwargs))
+            return lambda queryset: serializer.represent(serializer.queryset(queryset))
+
+        variants = [
+            ('full, instances', instances(ProductSerializer)),
+            ('card, instances', instances(ProductCardSerializer)),
+            ('full, values()', values(ProductSerializer)),
+            ('card, values()', values(ProductCardSerializer)),
+            (f"fields={','.join(SPARSE_FIELDS)}", values(ProductSerializer, fields=SPARSE_FIELDS)),
+        ]
+
+        with benchmark_database():
+            seed_catalog(max(row_counts))
+            for rows in row_counts:
+                queryset = (
+                    Product.objects.filter(is_active=True)
+                    .select_related('category', 'retailer')
+                    .order_by('-created_at', '-id')[:rows]
+                )
+                for label, serialize in variants:
+                    payload = renderer.render(serialize(queryset))
+                    stats = measure(lambda: renderer.render(serialize(queryset)), runs=options['runs'], warmup=1)
+                    self.stdout.write(
+                        f"{rows:>6} rows  {label:<26} p50={stats['p50_ms']:8.2f}ms  "
+                        f"{stats['p50_ms'] * 1000 / rows:6.1f}us/row  {len(payload) / 1024:8.1f} KiB"
+                    )
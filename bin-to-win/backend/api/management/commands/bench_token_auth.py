@@ -0,0 +1,52 @@
+from django.core.cache import caches
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.test import APIRequestFactory
+
+from api.authentication import CACHE_ALIAS, CachedTokenAuthentication
+from api.benchmarks import benchmark_database, measure
+from api.models import ExpiringToken, User
+from api.views import UserViewSet
+
+
+class UncachedTokenAuthentication(TokenAuthentication):
+    model = ExpiringToken
+
+
+AUTHENTICATORS = [
+    ('token', UncachedTokenAuthentication),
+    ('cached token', CachedTokenAuthentication),
+]
+
+
+class Command(BaseCommand):
+    help = 'Compare authenticated GET /api/users/me/ latency with and without the token cache'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=500)
+
+    def handle(self, *args, **options):
+        factory = APIRequestFactory()
+
+        with benchmark_database():
+            user = User.objects.create(username='bench-user', email='bench@example.com')
+            token = ExpiringToken.objects.create(user=user)
+            headers = {'HTTP_AUTHORIZATION': f'Token {token.key}'}
+
+            for label, authenticator in AUTHENTICATORS:
+                view = UserViewSet.as_view({'get': 'me'}, authentication_classes=[authenticator])
+                caches[CACHE_ALIAS].clear()
+
+                def get():
+                    response = view(factory.get('/api/users/me/', **headers))
+                    assert response.status_code == 200, response.status_code
+
+                stats = measure(get, runs=options['runs'])
+                with CaptureQueriesContext(connection) as queries:
+                    get()
+                self.stdout.write(
+                    f"{label:<13} p50={stats['p50_ms']:6.3f}ms  p99={stats['p99_ms']:6.3f}ms  "
+                    f"queries={len(queries)}"
+                )
@@ -0,0 +1,152 @@
+import datetime
+import warnings
+
+from django.core.management.base import BaseCommand, CommandError
+from django.core.paginator import UnorderedObjectListWarning
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from api.benchmarks import benchmark_database, seed_catalog
+from api.models import (
+    BinaryFile, CartItem, Category, Order, OrderItem, Product,
+    PromoCode, Retailer, Review, User, Wishlist
+)
+
+# Maximum number of queries each endpoint may run, whatever the number of
+# rows on the page. (name, who, url template, budget)
+# Catalog and order reads include the aggregate behind their ETag
+# (api/conditional.py), which the catalog cache keeps on later requests.
+ENDPOINTS = [
+    ('user-list', 'staff', '/api/users/', 2),
+    ('user-me', 'consumer', '/api/users/me/', 0),
+    ('category-list', None, '/api/categories/', 3),
+    ('category-detail', None, '/api/categories/{category}/', 2),
+    ('retailer-list', 'consumer', '/api/retailers/', 2),
+    ('retailer-detail', 'consumer', '/api/retailers/{retailer_id}/', 1),
+    ('retailer-my-profile', 'retailer', '/api/retailers/my_profile/', 1),
+    ('product-list', None, '/api/products/', 3),
+    ('product-detail', None, '/api/products/{product}/', 2),
+    ('product-retailer-products', 'retailer', '/api/products/retailer_products/', 2),
+    ('cart-item-list', 'consumer', '/api/cart-items/', 2),
+    ('cart-item-detail', 'consumer', '/api/cart-items/{cart_item}/', 1),
+    ('cart-item-cart-total', 'consumer', '/api/cart-items/cart_total/', 1),
+    ('wishlist-list', 'consumer', '/api/wishlists/', 2),
+    ('wishlist-detail', 'consumer', '/api/wishlists/{wishlist}/', 1),
+    ('order-list', 'consumer', '/api/orders/', 4),
+    ('order-detail', 'consumer', '/api/orders/{order}/', 3),
+    ('order-list-staff', 'staff', '/api/orders/', 4),
+    ('order-list-retailer', 'retailer', '/api/orders/', 4),
+    ('promo-code-list', 'staff', '/api/promo-codes/', 2),
+    ('promo-code-detail', 'staff', '/api/promo-codes/{promo_code}/', 1),
+    ('review-list', 'consumer', '/api/reviews/?product={product}', 2),
+    ('review-detail', 'consumer', '/api/reviews/{review}/', 1),
+    ('binary-file-list', 'consumer', '/api/binary-files/', 2),
+    ('binary-file-detail', 'consumer', '/api/binary-files/{binary_file}/', 1),
+]
+
+
+def request_endpoint(fixtures, who, url):
+    """GET one of ENDPOINTS as ``who``; returns the response and the number of queries it ran."""
+    client = APIClient()
+    if who:
+        client.force_authenticate(fixtures[who])
+    with CaptureQueriesContext(connection) as queries:
+        response = client.get(url.format(**fixtures))
+    return response, len(queries)
+
+
+def seed(rows):
+    """``rows`` of every kind ENDPOINTS lists; returns the values their URLs are formatted with."""
+    seed_catalog(max(rows, 2), categories=rows, retailers=rows)
+    products = list(Product.objects.order_by('id')[:rows])
+    retailer = Retailer.objects.select_related('user').order_by('id').first()
+    staff = User.objects.create(username='bench-staff', is_staff=True)
+    consumer = User.objects.create(username='bench-consumer')
+    now = timezone.now()
+
+    for product in products:
+        CartItem.objects.create(user=consumer, product=product, quantity=2)
+        Wishlist.objects.create(user=consumer, product=product)
+    for i in range(rows):
+        order = Order.objects.create(
+            user=consumer,
+            order_number=f'ORD-BENCH{i}',
+            shipping_address='1 Bench St',
+            shipping_cost=0,
+            subtotal=0,
+            total=0
+        )
+        OrderItem.objects.bulk_create(
+            OrderItem(order=order, product=product, price=product.price, quantity=1)
+            for product in products
+        )
+        order.sync_retailer_links()
+        Review.objects.create(product=products[0], user=consumer, rating=5, comment='Great')
+        PromoCode.objects.create(
+            code=f'BENCH{i}',
+            discount_percentage=10,
+            valid_from=now,
+            valid_to=now + datetime.timedelta(days=1)
+        )
+        BinaryFile.objects.create(name=f'file-{i}', sha256='0' * 64, file_type='text/plain', size=64)
+
+    return {
+        'staff': staff,
+        'consumer': consumer,
+        'category': Category.objects.order_by('id').first().pk,
+        'retailer_id': retailer.pk,
+        'retailer': retailer.user,
+        'product': products[0].pk,
+        'cart_item': CartItem.objects.filter(user=consumer).first().pk,
+        'wishlist': Wishlist.objects.filter(user=consumer).first().pk,
+        'order': Order.objects.filter(user=consumer).first().pk,
+        'promo_code': PromoCode.objects.first().pk,
+        'review': Review.objects.first().pk,
+        'binary_file': BinaryFile.objects.first().pk,
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        'Fail if any list/retrieve endpoint runs more queries than its pinned '
+        'budget, or if its query count grows with the number of rows returned'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=12,
+                            help='Rows of each kind to seed for the "full page" run')
+
+    def handle(self, *args, **options):
+        warnings.simplefilter('ignore', UnorderedObjectListWarning)
+        runs = {}
+        for rows in (1, options['rows']):
+            with benchmark_database():
+                runs[rows] = self.count_queries(rows)
+
+        failures = []
+        for name, who, url, budget in ENDPOINTS:
+            counts = [runs[rows][name] for rows in runs]
+            line = f'{name:<28} {" -> ".join(str(c) for c in counts):<10} budget {budget}'
+            if max(counts) > budget:
+                failures.append(f'{line}  (over budget)')
+            elif len(set(counts)) > 1:
+                failures.append(f'{line}  (grows with page size)')
+            else:
+                self.stdout.write(line)
+
+        for failure in failures:
+            self.stderr.write(failure)
+        if failures:
+            raise CommandError(f'{len(failures)} endpoints exceed their query budget')
+        self.stdout.write(self.style.SUCCESS(f'All {len(ENDPOINTS)} endpoints are within budget'))
+
+    def count_queries(self, rows):
+        fixtures = seed(rows)
+        counts = {}
+        for name, who, url, budget in ENDPOINTS:
+            response, counts[name] = request_endpoint(fixtures, who, url)
+            if response.status_code != 200:
+                raise CommandError(f'{name} returned {response.status_code}: {response.content[:200]}')
+        return counts
@@ -0,0 +1,93 @@
+import itertools
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from api.benchmarks import benchmark_database, seed_catalog
+from api.models import Category, Retailer
+from api.views import ProductViewSet
+
+SORT_OPTIONS = [None, 'price_asc', 'price_desc', 'newest', 'discount', 'rating']
+
+# Plan fragments that mean the product table is read row by row
+FULL_SCAN_MARKERS = {
+    'sqlite': lambda line: 'SCAN api_product' in line and 'USING' not in line,
+    'postgresql': lambda line: 'Seq Scan on api_product' in line,
+}
+
+
+def filter_values():
+    category = Category.objects.order_by('id').first()
+    retailer = Retailer.objects.order_by('id').first()
+    return [
+        ('category', category.slug),
+        ('retailer', str(retailer.id)),
+        ('featured', 'true'),
+        ('expiring_soon', 'true'),
+        ('min_price', '10'),
+        ('max_price', '20'),
+    ]
+
+
+def query_params():
+    """Every combination of listing filters, with every sort order."""
+    filters = filter_values()
+    for size in range(len(filters) + 1):
+        for combination in itertools.combinations(filters, size):
+            for sort_by in SORT_OPTIONS:
+                params = dict(combination)
+                if sort_by:
+                    params['sort_by'] = sort_by
+                yield params
+
+
+def explain(params):
+    view = ProductViewSet()
+    view.action = 'list'
+    view.format_kwarg = None
+    view.request = Request(APIRequestFactory().get('/api/products/', params))
+    queryset = view.get_queryset()
+    return queryset[:10].explain()
+
+
+def full_scans(plans):
+    """The ``(params, plan)`` pairs whose plan reads the product table row by row."""
+    is_full_scan = FULL_SCAN_MARKERS[connection.vendor]
+    return [(params, plan) for params, plan in plans if any(is_full_scan(line) for line in plan.splitlines())]
+
+
+class Command(BaseCommand):
+    help = (
+        'EXPLAIN every filter/sort combination of the product listing on a seeded '
+        'catalog and fail if any of them falls back to a full table scan'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=500000,
+                            help='Number of products to seed before explaining')
+        parser.add_argument('--verbose-plans', action='store_true',
+                            help='Print the plan of every combination')
+
+    def handle(self, *args, **options):
+        if connection.vendor not in FULL_SCAN_MARKERS:
+            raise CommandError(f'No plan checks defined for the {connection.vendor} backend')
+
+        with benchmark_database():
+            seed_catalog(options['products'])
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE')
+
+            plans = [(params, explain(params)) for params in query_params()]
+            if options['verbose_plans']:
+                for params, plan in plans:
+                    self.stdout.write(f'{params}\n{plan}\n')
+            failures = full_scans(plans)
+            checked = len(plans)
+
+        for params, plan in failures:
+            self.stderr.write(f'Full scan for {params}:\n{plan}\n')
+        if failures:
+            raise CommandError(f'{len(failures)} of {checked} product queries use a full table scan')
+        self.stdout.write(self.style.SUCCESS(f'All {checked} product queries use an index'))
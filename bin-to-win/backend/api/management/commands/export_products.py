@@ -0,0 +1,35 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.models import Product
+from api.product_io import FORMATS, export_rows
+
+
+class Command(BaseCommand):
+    help = 'Stream products as CSV or JSON Lines, in the format import_products reads'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', help='Default: standard output')
+        parser.add_argument('--retailer', type=int, help='Only this retailer (default: all)')
+        parser.add_argument('--format', choices=FORMATS, default='csv')
+        parser.add_argument('--chunk-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        products = Product.objects.all()
+        if options['retailer']:
+            products = products.filter(retailer_id=options['retailer'])
+
+        started = time.perf_counter()
+        rows = -1 if options['format'] == 'csv' else 0
+        output = open(options['path'], 'wb') if options['path'] else sys.stdout.buffer
+        try:
+            for line in export_rows(products, options['format'], chunk_size=options['chunk_size']):
+                output.write(line)
+                rows += 1
+        finally:
+            if options['path']:
+                output.close()
+        elapsed = time.perf_counter() - started
+        self.stderr.write(f'{rows} rows in {elapsed:.2f}s ({rows / elapsed if elapsed else 0:,.0f} rows/s)')
@@ -0,0 +1,40 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from api.synthetic import PASSWORD, SCALES, generate_dataset
+
+
+class Command(BaseCommand):
+    help = (
+        'Add synthetic users, retailers, categories, products, carts, wishlists, '
+        'orders, reviews and promo codes with bulk inserts. Start from a --scale '
+        'preset and override any count.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', choices=sorted(SCALES), default='small')
+        for kind in SCALES['small']:
+            parser.add_argument(f"--{kind.replace('_', '-')}", type=int, dest=kind,
+                                help='Default: from --scale')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--allow-production', action='store_true',
+                            help='Run even with DEBUG off. Generated users share a published password.')
+
+    def handle(self, *args, **options):
+        if not settings.DEBUG and not options['allow_production']:
+            raise CommandError(
+                'DEBUG is off, so this may be a production database, and every generated user '
+                f'logs in with the password {PASSWORD!r}. Pass --allow-production to run anyway.'
+            )
+        counts = dict(SCALES[options['scale']])
+        counts.update({kind: options[kind] for kind in counts if options[kind] is not None})
+        timings = generate_dataset(
+            **counts, seed=options['seed'], batch_size=options['batch_size'], log=self.stdout.write,
+        )
+        rows = sum(rows for kind, (rows, _) in timings.items() if kind != 'derived')
+        seconds = sum(seconds for _, seconds in timings.values())
+        self.stdout.write(self.style.SUCCESS(
+            f'{rows} rows in {seconds:.2f}s ({rows / seconds if seconds else 0:,.0f} rows/s). '
+            f'Generated users log in with password {PASSWORD!r}.'
+        ))
@@ -0,0 +1,57 @@
+import tracemalloc
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.models import Retailer
+from api.product_io import FORMATS, ImportFormatError, detect_format, import_products
+
+
+class Command(BaseCommand):
+    help = (
+        "Create or update a retailer's products from a CSV or JSON Lines file, "
+        'matched by slug, in batched bulk writes'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--retailer', type=int, required=True, help='Retailer id')
+        parser.add_argument('--format', choices=FORMATS, help='Default: from the file extension')
+        parser.add_argument('--batch-size', type=int, default=2000)
+        parser.add_argument('--dry-run', action='store_true', help='Validate without writing')
+        parser.add_argument('--trace-memory', action='store_true',
+                            help='Report peak Python memory allocated by the import')
+
+    def handle(self, *args, **options):
+        file_format = options['format'] or detect_format(options['path'])
+        if file_format is None:
+            raise CommandError('Give --format or a .csv/.jsonl file')
+        try:
+            retailer = Retailer.objects.get(pk=options['retailer'])
+        except Retailer.DoesNotExist:
+            raise CommandError(f"Unknown retailer {options['retailer']}")
+
+        if options['trace_memory']:
+            tracemalloc.start()
+        with open(options['path'], 'rb') as file:
+            try:
+                report = import_products(
+                    file, file_format, retailer,
+                    batch_size=options['batch_size'], dry_run=options['dry_run'],
+                ).as_dict()
+            except ImportFormatError as exc:
+                raise CommandError(str(exc))
+
+        for error in report['errors']:
+            self.stderr.write(f"line {error['line']}: {error['errors']}")
+        if report['error_count'] > len(report['errors']):
+            self.stderr.write(f"... {report['error_count'] - len(report['errors'])} more invalid rows")
+        line = (
+            f"{report['rows']} rows in {report['seconds']:.2f}s ({report['rows_per_second']:,} rows/s): "
+            f"{report['created']} created, {report['updated']} updated, {report['error_count']} invalid"
+        )
+        if options['trace_memory']:
+            line += f'  peak {tracemalloc.get_traced_memory()[1] / 1024 / 1024:.1f} MiB'
+            tracemalloc.stop()
+        if options['dry_run']:
+            line += ' (dry run, nothing written)'
+        self.stdout.write(self.style.SUCCESS(line))
@@ -0,0 +1,199 @@
+import asyncio
+import importlib.util
+import os
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+
+from api.benchmarks import benchmark_database, percentile, seed_catalog
+from api.models import CartItem, ExpiringToken, Product, User
+
+HOST = '127.0.0.1'
+
+SERVERS = {
+    # Threaded WSGI workers: one thread per in-flight request
+    'wsgi': ('gunicorn', lambda port, options: [
+        sys.executable, '-m', 'gunicorn', 'backend.wsgi:application',
+        '--bind', f'{HOST}:{port}', '--worker-class', 'gthread',
+        '--workers', str(options['workers']), '--threads', str(options['threads']),
+        '--backlog', '2048', '--log-level', 'warning',
+    ]),
+    # One event loop per worker, serving api/async_views.py natively
+    'asgi': ('uvicorn', lambda port, options: [
+        sys.executable, '-m', 'uvicorn', 'backend.asgi:application',
+        '--host', HOST, '--port', str(port), '--workers', str(options['workers']),
+        '--backlog', '2048', '--log-level', 'warning', '--no-access-log',
+    ]),
+}
+
+
+class Command(BaseCommand):
+    help = (
+        'Load test the hot catalog reads (product list and detail, categories, '
+        'cart summary) under the WSGI and the ASGI deployment at several '
+        'numbers of concurrent keep-alive connections'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--server', action='append', choices=sorted(SERVERS),
+                            help='Server(s) to test (default: all)')
+        parser.add_argument('--concurrency', default='100,500,1000',
+                            help='Comma separated numbers of concurrent connections')
+        parser.add_argument('--duration', type=float, default=10.0, help='Seconds per run')
+        parser.add_argument('--products', type=int, default=2000)
+        parser.add_argument('--workers', type=int, default=1, help='Server worker processes')
+        parser.add_argument('--threads', type=int, default=32, help='Threads per WSGI worker')
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument('--catalog-cache', action='store_true',
+                            help='Leave the catalog response cache on in the servers')
+
+    def handle(self, *args, **options):
+        servers = options['server'] or sorted(SERVERS)
+        for server in servers:
+            module = SERVERS[server][0]
+            if importlib.util.find_spec(module) is None:
+                raise CommandError(f'{server} needs {module}: pip install {module}')
+        levels = [int(level) for level in options['concurrency'].split(',')]
+        self.raise_open_files_limit(max(levels))
+
+        with benchmark_database(on_disk=True):
+            paths, headers = self.seed(options)
+            env = {
+                **os.environ,
+                'DJANGO_SETTINGS_MODULE': os.environ.get('DJANGO_SETTINGS_MODULE', 'backend.settings'),
+                'DB_NAME': str(connection.settings_dict['NAME']),
+                'CATALOG_CACHE_ENABLED': '1' if options['catalog_cache'] else '0',
+            }
+            connections.close_all()
+
+            self.stdout.write(
+                f"{options['products']} products, {options['workers']} worker(s), "
+                f"catalog cache {'on' if options['catalog_cache'] else 'off'}, {options['duration']:.0f}s per run"
+            )
+            self.stdout.write(
+                f"{'server':<6} {'conns':>6} {'req/s':>9} {'p50 ms':>9} {'p99 ms':>9} {'errors':>7}"
+            )
+            for server in servers:
+                server_env = dict(env)
+                server_env['ASYNC_CATALOG_VIEWS'] = '1' if server == 'asgi' else '0'
+                with self.running(server, server_env, options):
+                    for level in levels:
+                        latencies, errors = asyncio.run(self.load(level, paths, headers, options))
+                        latencies.sort()
+                        self.stdout.write(
+                            f"{server:<6} {level:>6} {len(latencies) / options['duration']:9.1f} "
+                            f"{percentile(latencies, 50):9.2f} {percentile(latencies, 99):9.2f} {errors:>7}"
+                        )
+
+    def raise_open_files_limit(self, connections_needed):
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        wanted = connections_needed * 2 + 256
+        if soft < wanted:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (min(wanted, hard), hard))
+
+    def seed(self, options):
+        seed_catalog(options['products'])
+        user = User.objects.create(username='load-catalog')
+        product_ids = list(Product.objects.filter(is_active=True).values_list('id', flat=True)[:200])
+        CartItem.objects.bulk_create(CartItem(user=user, product_id=pk, quantity=1) for pk in product_ids[:3])
+        token = ExpiringToken.objects.create(user=user)
+
+        pages = max(1, len(product_ids) // settings.REST_FRAMEWORK['PAGE_SIZE'])
+        paths = ['/api/products/', '/api/categories/', '/api/cart-items/cart_total/']
+        paths += [f'/api/products/?page={page}' for page in range(2, min(pages, 10) + 1)]
+        paths += [f'/api/products/{pk}/' for pk in product_ids[:20]]
+        return paths, {'Authorization': f'Token {token.key}'}
+
+    def running(self, server, env, options):
+        command = self
+
+        class Server:
+            def __enter__(self):
+                self.log = tempfile.TemporaryFile()
+                self.process = subprocess.Popen(
+                    SERVERS[server][1](options['port'], options), cwd=settings.BASE_DIR,
+                    env=env, stdout=self.log, stderr=subprocess.STDOUT,
+                )
+                command.wait_until_listening(self.process, self.log, options['port'])
+                return self
+
+            def __exit__(self, *exc_info):
+                self.process.terminate()
+                try:
+                    self.process.wait(timeout=10)
+                except subprocess.TimeoutExpired:
+                    self.process.kill()
+                self.log.close()
+
+        return Server()
+
+    def wait_until_listening(self, process, log, port, timeout=30):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                log.seek(0)
+                raise CommandError(f'Server exited with {process.returncode}:\n{log.read().decode()[-2000:]}')
+            try:
+                socket.create_connection((HOST, port), timeout=1).close()
+                return
+            except OSError:
+                time.sleep(0.2)
+        process.kill()
+        raise CommandError(f'Server did not listen on port {port} within {timeout}s')
+
+    async def load(self, concurrency, paths, headers, options):
+        deadline = time.perf_counter() + options['duration']
+        results = await asyncio.gather(*(
+            self.client(number, paths, headers, deadline, options['port']) for number in range(concurrency)
+        ))
+        latencies = [latency for client_latencies, _ in results for latency in client_latencies]
+        return latencies, sum(errors for _, errors in results)
+
+    async def client(self, number, paths, headers, deadline, port):
+        """One keep-alive connection issuing requests back to back until ``deadline``."""
+        extra = ''.join(f'{name}: {value}\r\n' for name, value in headers.items())
+        latencies, errors = [], 0
+        reader = writer = None
+        index = number
+        while time.perf_counter() < deadline:
+            path = paths[index % len(paths)]
+            index += 1
+            started = time.perf_counter()
+            try:
+                if writer is None:
+                    reader, writer = await asyncio.open_connection(HOST, port)
+                writer.write(f'GET {path} HTTP/1.1\r\nHost: {HOST}:{port}\r\n{extra}\r\n'.encode())
+                status, keep_alive = await asyncio.wait_for(self.read_response(reader), timeout=30)
+            except (OSError, asyncio.IncompleteReadError, asyncio.TimeoutError, ValueError):
+                status, keep_alive = None, False
+            if status == 200:
+                latencies.append((time.perf_counter() - started) * 1000)
+            else:
+                errors += 1
+            if not keep_alive and writer is not None:
+                writer.close()
+                reader = writer = None
+        if writer is not None:
+            writer.close()
+        return latencies, errors
+
+    async def read_response(self, reader):
+        status = int((await reader.readline()).split()[1])
+        length = 0
+        keep_alive = True
+        while (line := await reader.readline()) not in (b'\r\n', b''):
+            name, _, value = line.decode('latin-1').partition(':')
+            name = name.strip().lower()
+            if name == 'content-length':
+                length = int(value)
+            elif name == 'connection' and value.strip().lower() == 'close':
+                keep_alive = False
+        await reader.readexactly(length)
+        return status, keep_alive
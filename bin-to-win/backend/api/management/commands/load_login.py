@@ -0,0 +1,66 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext, override_settings
+from rest_framework.test import APIClient
+
+from api.benchmarks import benchmark_database, percentile
+from api.models import ExpiringToken, User
+
+PASSWORD = 'load-test-password'
+
+
+class Command(BaseCommand):
+    help = 'Measure POST /api/token-auth/ throughput at one or more password hasher costs'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=50)
+        parser.add_argument('--logins', type=int, default=200, help='Logins per hasher cost')
+        parser.add_argument('--threads', type=int, default=4)
+        parser.add_argument('--iterations', default='720000,260000',
+                            help='Comma separated PBKDF2 iteration counts to compare')
+
+    def handle(self, *args, **options):
+        costs = [int(cost) for cost in options['iterations'].split(',')]
+        with benchmark_database(on_disk=True):
+            users = User.objects.bulk_create(
+                User(username=f'login-{i}') for i in range(options['users'])
+            )
+            for cost in costs:
+                with override_settings(PASSWORD_HASH_ITERATIONS=cost):
+                    # Hash at the configured cost so logins don't re-encode them
+                    User.objects.filter(pk__in=[user.pk for user in users]).update(
+                        password=make_password(PASSWORD)
+                    )
+                    self.report(cost, users, options)
+
+    def report(self, cost, users, options):
+        with CaptureQueriesContext(connection) as queries:
+            self.login(users[0].username)
+        usernames = [users[i % len(users)].username for i in range(options['logins'])]
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['threads']) as pool:
+            latencies = sorted(pool.map(self.login, usernames))
+        elapsed = time.perf_counter() - started
+
+        self.stdout.write(
+            f"{cost:>7} iterations  {len(usernames) / elapsed:7.1f} logins/s  "
+            f"p50={percentile(latencies, 50):7.2f}ms  p99={percentile(latencies, 99):7.2f}ms  "
+            f"queries/login={len(queries)}  tokens={ExpiringToken.objects.count()}"
+        )
+
+    def login(self, username):
+        client = APIClient()
+        try:
+            started = time.perf_counter()
+            response = client.post('/api/token-auth/', {'username': username, 'password': PASSWORD}, format='json')
+            latency = (time.perf_counter() - started) * 1000
+        finally:
+            connection.close()
+        if response.status_code != 200:
+            raise CommandError(f'Login failed with {response.status_code}: {response.content[:200]}')
+        return latency
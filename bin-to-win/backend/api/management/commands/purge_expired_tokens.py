@@ -0,0 +1,25 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from api.models import ExpiringToken
+
+
+class Command(BaseCommand):
+    help = 'Delete expired API tokens in batches. Meant to run on a schedule, e.g. daily from cron.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        # Small batches keep each DELETE's write lock short
+        expired = ExpiringToken.objects.filter(expires_at__lte=timezone.now())
+        started = time.perf_counter()
+        deleted = 0
+        while keys := list(expired.values_list('key', flat=True)[:options['batch_size']]):
+            deleted += ExpiringToken.objects.filter(key__in=keys).delete()[0]
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Deleted {deleted} expired tokens in {elapsed:.2f}s'
+        ))
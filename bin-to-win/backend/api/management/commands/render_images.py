@@ -0,0 +1,80 @@
+import datetime
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.utils import timezone
+
+from api.catalog_cache import invalidate_all_products
+from api.images import RENDITION_DIR, update_renditions
+from api.models import Product, User
+
+IMAGE_FIELDS = [(Product, 'image'), (User, 'profile_image')]
+
+
+def _render(job):
+    try:
+        return update_renditions(*job)
+    finally:
+        # Each pool thread opens its own connection
+        connection.close()
+
+
+class Command(BaseCommand):
+    help = (
+        'Render missing or stale product and profile image renditions, e.g. '
+        'for images uploaded before renditions existed or jobs lost in a restart. '
+        '--prune deletes rendition files no row refers to any more.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+        parser.add_argument('--force', action='store_true', help='Render every image again')
+        parser.add_argument('--prune', action='store_true',
+                            help='Delete unreferenced rendition files older than an hour')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        jobs = []
+        for model, field_name in IMAGE_FIELDS:
+            rows = (
+                model.objects.exclude(**{field_name: ''}).exclude(**{f'{field_name}__isnull': True})
+                .values_list('pk', field_name, f'{field_name}_renditions').iterator()
+            )
+            for pk, source, renditions in rows:
+                if options['force'] or (renditions or {}).get('source') != source:
+                    jobs.append((model, pk, field_name, source))
+
+        with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+            rendered = sum(1 for result in executor.map(_render, jobs) if result)
+        if rendered:
+            invalidate_all_products()
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Rendered {rendered} of {len(jobs)} images in {elapsed:.2f}s '
+            f'({rendered / elapsed if elapsed else 0:,.1f} images/s)'
+        ))
+        if options['prune']:
+            self.prune()
+
+    def prune(self):
+        referenced = set()
+        for model, field_name in IMAGE_FIELDS:
+            for renditions in model.objects.values_list(f'{field_name}_renditions', flat=True).iterator():
+                referenced.update((renditions or {}).values())
+
+        # Renditions stored by a job that has not recorded them yet are recent
+        cutoff = timezone.now() - datetime.timedelta(hours=1)
+        deleted = 0
+        if default_storage.exists(RENDITION_DIR):
+            for directory in default_storage.listdir(RENDITION_DIR)[0]:
+                for filename in default_storage.listdir(f'{RENDITION_DIR}/{directory}')[1]:
+                    name = f'{RENDITION_DIR}/{directory}/{filename}'
+                    if name not in referenced and default_storage.get_modified_time(name) < cutoff:
+                        default_storage.delete(name)
+                        deleted += 1
+        self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} unreferenced renditions'))
@@ -0,0 +1,55 @@
+import datetime
+import time
+import tracemalloc
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from api.expiry import STEPS
+
+
+class Command(BaseCommand):
+    help = (
+        'Deactivate expired products, assign expiry buckets and apply markdowns '
+        'in batched UPDATEs. Meant to run on a schedule, e.g. hourly from cron.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date', help='Run as if today were this ISO date (default: today)')
+        parser.add_argument('--batch-size', type=int, default=2000)
+        parser.add_argument('--skip-markdowns', action='store_true',
+                            help='Only deactivate expired products')
+        parser.add_argument('--trace-memory', action='store_true',
+                            help='Report peak Python memory allocated by each step')
+
+    def handle(self, *args, **options):
+        if options['date']:
+            try:
+                today = datetime.date.fromisoformat(options['date'])
+            except ValueError:
+                raise CommandError(f"Invalid --date {options['date']!r}, expected YYYY-MM-DD")
+        else:
+            today = timezone.localdate()
+
+        steps = STEPS[:1] if options['skip_markdowns'] else STEPS
+        total_rows = 0
+        total_seconds = 0.0
+        for label, step in steps:
+            if options['trace_memory']:
+                tracemalloc.start()
+            started = time.perf_counter()
+            rows = step(today, options['batch_size'])
+            elapsed = time.perf_counter() - started
+            line = f'{label:<12} {rows:>9} rows in {elapsed:7.2f}s ({rows / elapsed if elapsed else 0:,.0f} rows/s)'
+            if options['trace_memory']:
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+                line += f'  peak {peak / 1024 / 1024:.1f} MiB'
+            self.stdout.write(line)
+            total_rows += rows
+            total_seconds += elapsed
+
+        self.stdout.write(self.style.SUCCESS(
+            f'{total_rows} products updated in {total_seconds:.2f}s '
+            f'({total_rows / total_seconds if total_seconds else 0:,.0f} rows/s) for {today.isoformat()}'
+        ))
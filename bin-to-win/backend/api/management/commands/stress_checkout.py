@@ -0,0 +1,101 @@
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Sum
+from rest_framework.test import APIClient
+
+from api.benchmarks import benchmark_database, seed_catalog
+from api.models import CartItem, Order, OrderItem, Product, RetailerOrder, User
+
+
+class Command(BaseCommand):
+    help = (
+        'Run concurrent checkouts against a file-backed test database and '
+        'verify that stock is never oversold'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=200)
+        parser.add_argument('--threads', type=int, default=8)
+        parser.add_argument('--products', type=int, default=20)
+        parser.add_argument('--stock', type=int, default=30,
+                            help='Starting stock of every product; keep it low to force contention')
+        parser.add_argument('--items', type=int, default=3, help='Cart lines per user')
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        with benchmark_database(on_disk=True):
+            users = self.seed(options)
+            initial_stock = dict(Product.objects.values_list('id', 'stock'))
+
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=options['threads']) as pool:
+                results = list(pool.map(self.checkout, users))
+            elapsed = time.perf_counter() - started
+
+            outcomes = {}
+            for user, outcome in results:
+                outcomes.setdefault(outcome, []).append(user)
+            self.verify(initial_stock, outcomes)
+
+        placed = len(outcomes.get(201, []))
+        self.stdout.write(
+            f"{len(users)} checkouts on {options['threads']} threads in {elapsed:.2f}s "
+            f"({len(users) / elapsed:.1f} req/s, {placed / elapsed:.1f} orders/s)"
+        )
+        for outcome, outcome_users in sorted(outcomes.items(), key=lambda item: str(item[0])):
+            self.stdout.write(f'  {outcome}: {len(outcome_users)}')
+        self.stdout.write(self.style.SUCCESS('Stock and orders are consistent'))
+
+    def seed(self, options):
+        rng = random.Random(options['seed'])
+        seed_catalog(options['products'])
+        Product.objects.update(stock=options['stock'])
+        products = list(Product.objects.all())
+
+        users = User.objects.bulk_create(
+            User(username=f'shopper-{i}') for i in range(options['users'])
+        )
+        CartItem.objects.bulk_create(
+            CartItem(user=user, product=product, quantity=rng.randint(1, 3))
+            for user in users
+            for product in rng.sample(products, options['items'])
+        )
+        return users
+
+    def checkout(self, user):
+        client = APIClient()
+        client.force_authenticate(user)
+        try:
+            response = client.post('/api/orders/', {'shipping_address': '1 Stress St'}, format='json')
+            return user.pk, response.status_code
+        except Exception as exc:
+            return user.pk, type(exc).__name__
+        finally:
+            connection.close()
+
+    def verify(self, initial_stock, outcomes):
+        errors = []
+        sold = dict(OrderItem.objects.values('product').annotate(total=Sum('quantity')).values_list('product', 'total'))
+        for product_id, stock in Product.objects.values_list('id', 'stock'):
+            expected = initial_stock[product_id] - sold.get(product_id, 0)
+            if stock != expected:
+                errors.append(f'product {product_id}: stock {stock}, expected {expected}')
+
+        placed = outcomes.get(201, [])
+        if Order.objects.count() != len(placed):
+            errors.append(f'{Order.objects.count()} orders stored for {len(placed)} successful checkouts')
+        if CartItem.objects.filter(user_id__in=placed).exists():
+            errors.append('cart not cleared for a successful checkout')
+        expected_links = set(OrderItem.objects.values_list('order', 'product__retailer').distinct())
+        if set(RetailerOrder.objects.values_list('order', 'retailer')) != expected_links:
+            errors.append('retailer order links do not match order items')
+        rejected = [user for outcome, users in outcomes.items() if outcome != 201 for user in users]
+        if CartItem.objects.filter(user_id__in=rejected).values('user').distinct().count() != len(rejected):
+            errors.append('cart lost for a rejected checkout')
+
+        if errors:
+            raise CommandError('Checkout is inconsistent:\n' + '\n'.join(errors))
@@ -0,0 +1,332 @@
+"""
+Per-view request metrics and a slow request log.
+
+``PerformanceMiddleware`` records, for each view and action (e.g.
+``product-list``, ``order-create``), the wall time, the number and total
+time of database queries, the time spent serializing and the response size.
+Samples go into in-process log-linear histograms (in the style of
+HdrHistogram), which ``MetricsView`` exposes in the Prometheus text format
+(or as JSON with ``?format=json``). Like the catalog cache stats, the
+numbers are per process, since the last restart.
+
+Queries are counted by an execute wrapper on every database connection,
+which finds the request through a context variable, so queries made from
+``sync_to_async`` threads under ASGI are attributed too. Serializer time is
+the time spent in ``serialization()`` blocks: ``.data`` of the list and
+retrieve actions of viewsets with ``SerializerTimingMixin``, the async views
+and ``ValuesSerializer.represent``. Other actions aren't timed.
+
+Requests slower than ``SLOW_REQUEST_SECONDS`` are logged to ``api.metrics``
+with their SQL statements, slowest first. Query parameters carry tokens,
+password hashes and personal data, so they are only kept and logged with
+``SLOW_REQUEST_LOG_PARAMS`` on.
+"""
+import logging
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from rest_framework.renderers import BaseRenderer
+from rest_framework.response import Response
+
+logger = logging.getLogger(__name__)
+
+# Values are recorded as integers in these units and reported in base units
+MICROSECONDS = 1_000_000
+QUANTILES = (0.5, 0.9, 0.99)
+MAX_CAPTURED_QUERIES = 200
+SLOW_LOG_QUERIES = 20
+
+_current = ContextVar('request_sample', default=None)
+_lock = threading.Lock()
+_histograms = {}
+_requests = Counter()
+
+
+class Histogram:
+    """
+    Log-linear histogram: every power of two is split into 2**SUB_BUCKET_BITS
+    linear buckets, so each value is kept to within about 3% while memory
+    only grows with the number of distinct magnitudes recorded.
+    """
+    SUB_BUCKET_BITS = 5
+
+    def __init__(self):
+        self.buckets = Counter()
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def record(self, value):
+        shift = max(value.bit_length() - self.SUB_BUCKET_BITS, 0)
+        self.buckets[shift, value >> shift] += 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q):
+        """The highest value in the bucket holding the ``q`` quantile."""
+        if not self.count:
+            return 0
+        rank = q * self.count
+        seen = 0
+        for (shift, mantissa), count in sorted(self.buckets.items()):
+            seen += count
+            if seen >= rank:
+                return min(((mantissa + 1) << shift) - 1, self.max)
+        return self.max
+
+    def summary(self, scale=1):
+        convert = (lambda value: value / scale) if scale != 1 else int
+        summary = {'count': self.count, 'sum': convert(self.total), 'max': convert(self.max)}
+        for q in QUANTILES:
+            summary[f'p{q * 100:g}'] = convert(self.quantile(q))
+        return summary
+
+
+# name: (help, scale of the recorded integers)
+METRICS = {
+    'request_seconds': ('Wall time per request', MICROSECONDS),
+    'db_queries': ('Database queries per request', 1),
+    'db_seconds': ('Time spent in database queries per request', MICROSECONDS),
+    'serializer_seconds': ('Time spent serializing per request', MICROSECONDS),
+    'response_bytes': ('Response body size', 1),
+}
+
+
+class RequestSample:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.serializer_seconds = 0.0
+        self.serializing = False
+        self.statements = []
+
+
+def _record_query(execute, sql, params, many, context):
+    sample = _current.get()
+    if sample is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        elapsed = time.perf_counter() - started
+        sample.queries += 1
+        sample.db_seconds += elapsed
+        if len(sample.statements) < MAX_CAPTURED_QUERIES:
+            sample.statements.append((elapsed, sql, params if settings.SLOW_REQUEST_LOG_PARAMS else None))
+
+
+def _wrap_connection(connection, **kwargs):
+    if _record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_record_query)
+
+
+@contextmanager
+def serialization():
+    """Count the time spent in the block as serializer time of the current request."""
+    sample = _current.get()
+    if sample is None or sample.serializing:
+        yield
+        return
+    sample.serializing = True
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        sample.serializer_seconds += time.perf_counter() - started
+        sample.serializing = False
+
+
+class SerializerTimingMixin:
+    """
+    DRF's ``list`` and ``retrieve`` with ``.data`` timed as serializer time.
+    Goes right before the viewset base class, below mixins that wrap them.
+    """
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            serializer = self.get_serializer(page, many=True)
+            with serialization():
+                data = serializer.data
+            return self.get_paginated_response(data)
+        # Query first, so only serialization is timed
+        serializer = self.get_serializer(list(queryset), many=True)
+        with serialization():
+            data = serializer.data
+        return Response(data)
+
+    def retrieve(self, request, *args, **kwargs):
+        serializer = self.get_serializer(self.get_object())
+        with serialization():
+            data = serializer.data
+        return Response(data)
+
+
+def install():
+    """Wrap database connections; called when the middleware is enabled."""
+    connection_created.connect(_wrap_connection, dispatch_uid='api.metrics')
+    for connection in connections.all(initialized_only=True):
+        _wrap_connection(connection)
+
+
+def view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unmatched'
+    # Viewset routes are named per URL; split them per action
+    actions = getattr(match.func, 'actions', None)
+    basename = getattr(match.func, 'initkwargs', {}).get('basename')
+    if actions and basename and request.method.lower() in actions:
+        return f"{basename}-{actions[request.method.lower()].replace('_', '-')}"
+    return match.view_name
+
+
+def _response_bytes(response):
+    if not response.streaming:
+        return len(response.content)
+    if response.has_header('Content-Length'):
+        return int(response['Content-Length'])
+    return None
+
+
+def record(request, response, sample):
+    elapsed = time.perf_counter() - sample.started
+    name = view_name(request)
+    values = {
+        'request_seconds': round(elapsed * MICROSECONDS),
+        'db_queries': sample.queries,
+        'db_seconds': round(sample.db_seconds * MICROSECONDS),
+        'serializer_seconds': round(sample.serializer_seconds * MICROSECONDS),
+        'response_bytes': _response_bytes(response),
+    }
+    with _lock:
+        _requests[name, response.status_code] += 1
+        for metric, value in values.items():
+            if value is not None:
+                histogram = _histograms.get((metric, name))
+                if histogram is None:
+                    histogram = _histograms[metric, name] = Histogram()
+                histogram.record(value)
+
+    if elapsed >= settings.SLOW_REQUEST_SECONDS:
+        _log_slow_request(request, response, name, elapsed, sample)
+
+
+def _log_slow_request(request, response, name, elapsed, sample):
+    lines = [
+        f'Slow request {request.method} {request.get_full_path()} ({name}) -> {response.status_code}: '
+        f'{elapsed * 1000:.1f}ms, {sample.queries} queries in {sample.db_seconds * 1000:.1f}ms, '
+        f'serializing {sample.serializer_seconds * 1000:.1f}ms'
+    ]
+    for seconds, sql, params in sorted(sample.statements, key=lambda statement: -statement[0])[:SLOW_LOG_QUERIES]:
+        line = f'  {seconds * 1000:8.2f}ms  {sql}'
+        if params is not None:
+            line += f'  {params!r}'
+        lines.append(line[:2000])
+    if sample.queries > SLOW_LOG_QUERIES:
+        lines.append(f'  ... {sample.queries - SLOW_LOG_QUERIES} more')
+    logger.warning('\n'.join(lines))
+
+
+def get_metrics():
+    """Per view: request counts by status and a summary of each histogram, in base units."""
+    with _lock:
+        requests = dict(_requests)
+        summaries = {key: histogram.summary(METRICS[key[0]][1]) for key, histogram in _histograms.items()}
+    metrics = {}
+    for (name, status), count in requests.items():
+        metrics.setdefault(name, {'requests': {}})['requests'][str(status)] = count
+    for (metric, name), summary in summaries.items():
+        metrics.setdefault(name, {'requests': {}})[metric] = summary
+    return dict(sorted(metrics.items()))
+
+
+def reset_metrics():
+    with _lock:
+        _histograms.clear()
+        _requests.clear()
+
+
+class PerformanceMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        sample = RequestSample()
+        token = _current.set(sample)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        record(request, response, sample)
+        return response
+
+    async def __acall__(self, request):
+        sample = RequestSample()
+        token = _current.set(sample)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        record(request, response, sample)
+        return response
+
+
+def _label(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+class PrometheusRenderer(BaseRenderer):
+    """Renders ``get_metrics()`` in the Prometheus text exposition format."""
+    media_type = 'text/plain'
+    format = 'prometheus'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if isinstance(data.get('detail'), str):
+            # An error response, e.g. permission denied
+            return f"# {data['detail']}\n"
+        lines = [
+            '# HELP api_requests_total Requests per view and status code',
+            '# TYPE api_requests_total counter',
+        ]
+        for name, metrics in data.items():
+            for status, count in metrics['requests'].items():
+                lines.append(f'api_requests_total{{view="{_label(name)}",status="{status}"}} {count}')
+        for metric, (help_text, _) in METRICS.items():
+            family = f'api_{metric}'
+            lines += [f'# HELP {family} {help_text}', f'# TYPE {family} summary']
+            for name, metrics in data.items():
+                if metric not in metrics:
+                    continue
+                summary = metrics[metric]
+                view = f'view="{_label(name)}"'
+                for q in QUANTILES:
+                    lines.append(f'{family}{{{view},quantile="{q:g}"}} {summary[f"p{q * 100:g}"]}')
+                lines.append(f'{family}_sum{{{view}}} {summary["sum"]}')
+                lines.append(f'{family}_count{{{view}}} {summary["count"]}')
+        lines += [
+            '# HELP api_request_seconds_max Slowest request per view',
+            '# TYPE api_request_seconds_max gauge',
+        ]
+        for name, metrics in data.items():
+            if 'request_seconds' in metrics:
+                lines.append(f'api_request_seconds_max{{view="{_label(name)}"}} {metrics["request_seconds"]["max"]}')
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,63 @@
+import hashlib
+import os
+import tempfile
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+# The blob layout of api/blobs.py when this migration was written, frozen
+# here so that later changes to that module don't change history.
+def blob_path(digest):
+    return os.path.join(os.fspath(settings.BINARY_FILE_ROOT), digest[:2], digest[2:4], digest)
+
+
+def save_blob(content):
+    digest = hashlib.sha256(content).hexdigest()
+    path = blob_path(digest)
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=os.path.dirname(path), prefix='.upload-', delete=False) as tmp:
+            tmp.write(content)
+        os.replace(tmp.name, path)
+    return digest, len(content)
+
+
+def move_content_to_store(apps, schema_editor):
+    BinaryFile = apps.get_model('api', 'BinaryFile')
+    for binary_file in BinaryFile.objects.only('id', 'content').iterator(chunk_size=100):
+        digest, size = save_blob(bytes(binary_file.content))
+        BinaryFile.objects.filter(pk=binary_file.pk).update(sha256=digest, size=size)
+
+
+def restore_content_from_store(apps, schema_editor):
+    BinaryFile = apps.get_model('api', 'BinaryFile')
+    for binary_file in BinaryFile.objects.only('id', 'sha256').iterator(chunk_size=100):
+        with open(blob_path(binary_file.sha256), 'rb') as handle:
+            BinaryFile.objects.filter(pk=binary_file.pk).update(content=handle.read())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_product_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='binaryfile',
+            name='sha256',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=64),
+            preserve_default=False,
+        ),
+        migrations.AlterField(
+            model_name='binaryfile',
+            name='content',
+            field=models.BinaryField(null=True),
+        ),
+        migrations.RunPython(move_content_to_store, restore_content_from_store),
+        migrations.RemoveField(
+            model_name='binaryfile',
+            name='content',
+        ),
+    ]
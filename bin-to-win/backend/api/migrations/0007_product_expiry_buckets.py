@@ -0,0 +1,27 @@
+# Generated by Django 5.0.3 on 2026-10-18 15:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_keyset_pagination_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='expiry_bucket',
+            field=models.PositiveSmallIntegerField(blank=True, choices=[(0, 'Expires today'), (3, 'Expires within 3 days'), (7, 'Expires within 7 days')], editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='markdown_base_price',
+            field=models.DecimalField(blank=True, decimal_places=2, editable=False, max_digits=10, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(condition=models.Q(('expiry_bucket__isnull', False), ('is_active', True)), fields=['expiry_bucket', 'expiry_date'], name='product_active_bucket_idx'),
+        ),
+    ]
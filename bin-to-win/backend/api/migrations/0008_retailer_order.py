@@ -0,0 +1,47 @@
+# Generated by Django 5.0.3 on 2026-10-18 15:34
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def backfill_retailer_orders(apps, schema_editor):
+    OrderItem = apps.get_model('api', 'OrderItem')
+    RetailerOrder = apps.get_model('api', 'RetailerOrder')
+    links = OrderItem.objects.values_list(
+        'product__retailer_id', 'order_id', 'order__created_at'
+    ).distinct().order_by()
+    batch = []
+    for retailer_id, order_id, created_at in links.iterator(chunk_size=2000):
+        batch.append(RetailerOrder(retailer_id=retailer_id, order_id=order_id, created_at=created_at))
+        if len(batch) >= 2000:
+            RetailerOrder.objects.bulk_create(batch)
+            batch = []
+    if batch:
+        RetailerOrder.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_product_expiry_buckets'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RetailerOrder',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField()),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='retailer_links', to='api.order')),
+                ('retailer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='order_links', to='api.retailer')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['retailer', '-created_at', '-order'], name='retailer_order_inbox_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='retailerorder',
+            constraint=models.UniqueConstraint(fields=('retailer', 'order'), name='unique_retailer_order'),
+        ),
+        migrations.RunPython(backfill_retailer_orders, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 5.0.3 on 2026-10-18 15:38
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+from django.utils import timezone
+
+
+def copy_drf_tokens(apps, schema_editor):
+    # Keep existing sessions: every DRF token becomes an expiring token
+    # with a full lifetime ahead of it.
+    Token = apps.get_model('authtoken', 'Token')
+    ExpiringToken = apps.get_model('api', 'ExpiringToken')
+    expires_at = timezone.now() + settings.AUTH_TOKEN_LIFETIME
+    batch = []
+    for token in Token.objects.iterator(chunk_size=2000):
+        batch.append(ExpiringToken(key=token.key, user_id=token.user_id, created=token.created, expires_at=expires_at))
+        if len(batch) >= 2000:
+            ExpiringToken.objects.bulk_create(batch)
+            batch = []
+    if batch:
+        ExpiringToken.objects.bulk_create(batch)
+    # auto_now_add overwrote created on insert
+    ExpiringToken.objects.update(created=Subquery(Token.objects.filter(key=OuterRef('key')).values('created')))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_retailer_order'),
+        ('authtoken', '0003_tokenproxy'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExpiringToken',
+            fields=[
+                ('key', models.CharField(max_length=40, primary_key=True, serialize=False)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('expires_at', models.DateTimeField(db_index=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='auth_tokens', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.RunPython(copy_drf_tokens, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,62 @@
+# Generated by Django 5.0.3 on 2026-10-18 15:43
+
+import django.db.models.expressions
+import django.db.models.lookups
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_expiring_token'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='rating_1_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_2_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_3_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_4_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_5_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_avg',
+            field=models.GeneratedField(db_persist=True, expression=models.Case(models.When(django.db.models.lookups.GreaterThan(django.db.models.expressions.CombinedExpression(django.db.models.expressions.CombinedExpression(django.db.models.expressions.CombinedExpression(django.db.models.expressions.CombinedExpression(models.F('rating_1_count'), '+', models.F('rating_2_count')), '+', models.F('rating_3_count')), '+', models.F('rating_4_count')), '+', models.F('rating_5_count')), 0), then=django.db.models.expressions.CombinedExpression(django.db.models.expressions.CombinedExpression(django.db.models.expressions.CombinedExpression(django.db.models.expressions.CombinedExpression(django.db.models.expressions.CombinedExpression(django.db.models.expressions.CombinedExpression(django.db.models.expressions.CombinedExpression(django.db.models.expressions.CombinedExpression(models.F('rating_1_count'), '+', django.db.models.expressions.CombinedExpression(models.F('rating_2_count'), '*', models.Value(2))), '+', django.db.models.expressions.CombinedExpression(models.F('rating_3_count'), '*', models.Value(3))), '+', django.db.models.expressions.CombinedExpression(models.F('rating_4_count'), '*', models.Value(4))), '+', django.db.models.expressions.CombinedExpression(models.F('rating_5_count'), '*', models.Value(5))), '*', models.Value(200)), '+', django.db.models.expressions.CombinedExpression(django.db.models.expressions.CombinedExpression(django.db.models.expressions.CombinedExpression(django.db.models.expressions.CombinedExpression(models.F('rating_1_count'), '+', models.F('rating_2_count')), '+', models.F('rating_3_count')), '+', models.F('rating_4_count')), '+', models.F('rating_5_count'))), '/', django.db.models.expressions.CombinedExpression(django.db.models.expressions.CombinedExpression(django.db.models.expressions.CombinedExpression(django.db.models.expressions.CombinedExpression(django.db.models.expressions.CombinedExpression(models.F('rating_1_count'), '+', models.F('rating_2_count')), '+', models.F('rating_3_count')), '+', models.F('rating_4_count')), '+', models.F('rating_5_count')), '*', models.Value(2))), '/', models.Value(100.0))), default=models.Value(0.0), output_field=models.DecimalField(decimal_places=2, max_digits=3)), output_field=models.DecimalField(decimal_places=2, max_digits=3)),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_count',
+            field=models.GeneratedField(db_persist=True, expression=django.db.models.expressions.CombinedExpression(django.db.models.expressions.CombinedExpression(django.db.models.expressions.CombinedExpression(django.db.models.expressions.CombinedExpression(models.F('rating_1_count'), '+', models.F('rating_2_count')), '+', models.F('rating_3_count')), '+', models.F('rating_4_count')), '+', models.F('rating_5_count')), output_field=models.IntegerField()),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['-rating_avg', '-rating_count', '-id'], name='product_active_rating_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='review',
+            index=models.Index(fields=['product', '-created_at', '-id'], name='review_product_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='review',
+            index=models.Index(fields=['user', '-created_at', '-id'], name='review_user_created_idx'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.0.3 on 2026-10-18 16:49
+
+from django.db import migrations, models
+from django.db.models import Count, Min, Sum
+
+
+def merge_duplicate_cart_items(apps, schema_editor):
+    CartItem = apps.get_model('api', 'CartItem')
+    duplicates = (
+        CartItem.objects.values('user_id', 'product_id')
+        .annotate(rows=Count('id'), keep=Min('id'), quantity=Sum('quantity'))
+        .filter(rows__gt=1).order_by()
+    )
+    for group in duplicates.iterator(chunk_size=2000):
+        items = CartItem.objects.filter(user_id=group['user_id'], product_id=group['product_id'])
+        items.filter(pk=group['keep']).update(quantity=group['quantity'])
+        items.exclude(pk=group['keep']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0011_image_renditions'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_cart_items, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='cartitem',
+            constraint=models.UniqueConstraint(fields=('user', 'product'), name='unique_cart_item'),
+        ),
+    ]
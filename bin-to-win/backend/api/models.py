@@ -1,5 +1,15 @@
+import binascii
+import os
+
+from django.conf import settings
 from django.db import models
+from django.db.models import Case, F, Q, Value, When
+from django.db.models.functions import Cast, Round
+from django.db.models.lookups import GreaterThan
 from django.contrib.auth.models import AbstractUser
+from django.utils import timezone
+
+from .images import rendition_urls
 
 class User(AbstractUser):
     USER_TYPE_CHOICES = (
@@ -12,15 +22,44 @@ class User(AbstractUser):
     phone = models.CharField(max_length=15, blank=True, null=True)
     address = models.TextField(blank=True, null=True)
     profile_image = models.ImageField(upload_to='profile_images/', blank=True, null=True)
+    # Resized copies of profile_image, written in the background (api/images.py)
+    profile_image_renditions = models.JSONField(default=dict, blank=True, editable=False)
+    
+    @property
+    def profile_image_rendition_urls(self):
+        return rendition_urls(self.profile_image.name, self.profile_image_renditions)
     
     def __str__(self):
         return self.username
 
+class ExpiringToken(models.Model):
+    """
+    API token that expires AUTH_TOKEN_LIFETIME after it was last refreshed.
+    
+    A user gets a new token per login, so each device can log out on its own.
+    Expired tokens are removed by ``manage.py purge_expired_tokens``.
+    """
+    key = models.CharField(max_length=40, primary_key=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='auth_tokens')
+    created = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True)
+    
+    def save(self, *args, **kwargs):
+        if not self.key:
+            self.key = binascii.hexlify(os.urandom(20)).decode()
+        if not self.expires_at:
+            self.expires_at = timezone.now() + settings.AUTH_TOKEN_LIFETIME
+        super().save(*args, **kwargs)
+    
+    def __str__(self):
+        return f"Token for {self.user_id}"
+
 class Category(models.Model):
     name = models.CharField(max_length=100)
     slug = models.SlugField(unique=True)
     description = models.TextField(blank=True, null=True)
     icon = models.CharField(max_length=50, blank=True, null=True)  # For storing icon name
+    updated_at = models.DateTimeField(auto_now=True)
     
     def __str__(self):
         return self.name
@@ -38,6 +77,31 @@ class Retailer(models.Model):
     def __str__(self):
         return self.company_name
 
+def _cents(field_name):
+    return Cast(Round(F(field_name) * 100), models.IntegerField())
+
+RATING_COUNT_FIELDS = [f'rating_{stars}_count' for stars in range(1, 6)]
+
+def _rating_count():
+    return sum((F(field) for field in RATING_COUNT_FIELDS[1:]), F(RATING_COUNT_FIELDS[0]))
+
+def _rating_avg():
+    # Integer hundredths rounded half up ((2w + n) div 2n), then scaled, so
+    # SQLite and PostgreSQL store the same two-decimal value.
+    weighted = sum((F(field) * stars for stars, field in enumerate(RATING_COUNT_FIELDS[1:], start=2)), F(RATING_COUNT_FIELDS[0]))
+    hundredths = (weighted * 200 + _rating_count()) / (_rating_count() * 2)
+    return Case(
+        When(GreaterThan(_rating_count(), 0), then=hundredths / Value(100.0)),
+        default=Value(0.0),
+        output_field=models.DecimalField(max_digits=3, decimal_places=2),
+    )
+
+class ExpiryBucket(models.IntegerChoices):
+    # Values are the most days left a product in the bucket can have
+    TODAY = 0, 'Expires today'
+    THREE_DAYS = 3, 'Expires within 3 days'
+    SEVEN_DAYS = 7, 'Expires within 7 days'
+
 class Product(models.Model):
     name = models.CharField(max_length=255)
     slug = models.SlugField(unique=True)
@@ -49,16 +113,103 @@ class Product(models.Model):
     retailer = models.ForeignKey(Retailer, on_delete=models.CASCADE, related_name='products')
     stock = models.PositiveIntegerField(default=0)
     image = models.ImageField(upload_to='product_images/', blank=True, null=True)
+    # Resized copies of image, written in the background (api/images.py)
+    image_renditions = models.JSONField(default=dict, blank=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     is_featured = models.BooleanField(default=False)
     is_active = models.BooleanField(default=True)
+    # Whole-percent discount computed by the database so that sorting by it
+    # can use an index. Prices are compared in integer cents to keep the
+    # truncation identical on SQLite (floating point) and PostgreSQL (numeric).
+    discount_percentage = models.GeneratedField(
+        expression=Case(
+            When(
+                original_price__gt=0,
+                then=(
+                    (_cents('original_price') - _cents('price')) * 100
+                    / _cents('original_price')
+                ),
+            ),
+            default=Value(0),
+        ),
+        output_field=models.IntegerField(),
+        db_persist=True,
+    )
+    # Maintained by the expiry engine (api/expiry.py): the bucket whose
+    # markdown is applied to price, and the price it was taken from.
+    expiry_bucket = models.PositiveSmallIntegerField(choices=ExpiryBucket.choices, null=True, blank=True, editable=False)
+    markdown_base_price = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True, editable=False)
+    # Review histogram, kept up to date by signals.py as reviews change and
+    # rebuilt by ``manage.py recompute_ratings``. Count and average derive
+    # from it in the database so they can't drift apart.
+    rating_1_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_2_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_3_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_4_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_5_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_count = models.GeneratedField(
+        expression=_rating_count(),
+        output_field=models.IntegerField(),
+        db_persist=True,
+    )
+    rating_avg = models.GeneratedField(
+        expression=_rating_avg(),
+        output_field=models.DecimalField(max_digits=3, decimal_places=2),
+        db_persist=True,
+    )
+    
+    class Meta:
+        # Partial indexes over active products only, matching the filter/sort
+        # combinations supported by ProductViewSet.get_queryset. Sort keys
+        # end in id so keyset pagination can seek straight to a cursor.
+        indexes = [
+            models.Index(fields=['-discount_percentage', '-id'], name='product_active_discount_idx', condition=Q(is_active=True)),
+            models.Index(fields=['price', 'id'], name='product_active_price_idx', condition=Q(is_active=True)),
+            models.Index(fields=['-created_at', '-id'], name='product_active_created_idx', condition=Q(is_active=True)),
+            models.Index(fields=['expiry_date'], name='product_active_expiry_idx', condition=Q(is_active=True)),
+            models.Index(fields=['category', 'price', 'id'], name='product_active_cat_price_idx', condition=Q(is_active=True)),
+            models.Index(fields=['category', '-created_at', '-id'], name='product_active_cat_new_idx', condition=Q(is_active=True)),
+            models.Index(fields=['category', 'expiry_date'], name='product_active_cat_exp_idx', condition=Q(is_active=True)),
+            models.Index(fields=['retailer', '-created_at', '-id'], name='product_active_ret_new_idx', condition=Q(is_active=True)),
+            models.Index(fields=['-created_at', '-id'], name='product_featured_new_idx', condition=Q(is_active=True, is_featured=True)),
+            models.Index(fields=['expiry_bucket', 'expiry_date'], name='product_active_bucket_idx', condition=Q(is_active=True, expiry_bucket__isnull=False)),
+            models.Index(fields=['-rating_avg', '-rating_count', '-id'], name='product_active_rating_idx', condition=Q(is_active=True)),
+        ]
+    
+    def save(self, *args, **kwargs):
+        """
+        Like Model.save(), except that a plain save() of a loaded product
+        passes update_fields without the rating counts: they only move
+        through F() updates (see signals.py), and writing back the loaded
+        values would undo concurrent reviews. Name them in update_fields to
+        write them. As with any update_fields save, a row deleted meanwhile
+        raises DatabaseError instead of being inserted again; an INSERT
+        writes every column.
+        """
+        updating = not self._state.adding
+        plain = not args and kwargs.get('update_fields') is None and not kwargs.get('force_insert')
+        if updating and self.pk is not None and plain:
+            deferred = self.get_deferred_fields()
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and not field.generated
+                and field.attname not in RATING_COUNT_FIELDS and field.attname not in deferred
+            ]
+        super().save(*args, **kwargs)
+        if updating:
+            # UPDATE doesn't return generated columns; defer the stale values
+            # so they are reloaded from the database on next access.
+            for field in ('discount_percentage', 'rating_count', 'rating_avg'):
+                self.__dict__.pop(field, None)
     
     @property
-    def discount_percentage(self):
-        if self.original_price == 0:
-            return 0
-        return int(((self.original_price - self.price) / self.original_price) * 100)
+    def image_rendition_urls(self):
+        return rendition_urls(self.image.name, self.image_renditions)
+    
+    @property
+    def rating_histogram(self):
+        return {stars: getattr(self, field) for stars, field in enumerate(RATING_COUNT_FIELDS, start=1)}
     
     def __str__(self):
         return self.name
@@ -69,6 +220,12 @@ class CartItem(models.Model):
     quantity = models.PositiveIntegerField(default=1)
     added_at = models.DateTimeField(auto_now_add=True)
     
+    class Meta:
+        constraints = [
+            # Adding a product already in the cart raises its quantity (see api/cart.py)
+            models.UniqueConstraint(fields=['user', 'product'], name='unique_cart_item'),
+        ]
+    
     def __str__(self):
         return f"{self.quantity} x {self.product.name}"
     
@@ -108,8 +265,22 @@ class Order(models.Model):
     promo_code = models.CharField(max_length=50, blank=True, null=True)
     promo_discount = models.DecimalField(max_digits=10, decimal_places=2, default=0)
     
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', '-created_at', '-id'], name='order_user_created_idx'),
+        ]
+    
     def __str__(self):
         return self.order_number
+    
+    def sync_retailer_links(self):
+        """Make the RetailerOrder rows match the retailers of this order's items."""
+        retailer_ids = set(self.items.values_list('product__retailer_id', flat=True))
+        self.retailer_links.exclude(retailer_id__in=retailer_ids).delete()
+        RetailerOrder.objects.bulk_create(
+            [RetailerOrder(retailer_id=pk, order=self, created_at=self.created_at) for pk in retailer_ids],
+            ignore_conflicts=True
+        )
 
 class OrderItem(models.Model):
     order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='items')
@@ -124,6 +295,28 @@ class OrderItem(models.Model):
     def total_price(self):
         return self.price * self.quantity
 
+class RetailerOrder(models.Model):
+    """
+    One row per retailer with products in an order, written at checkout.
+    
+    created_at is copied from the order so a retailer's inbox is a single
+    range scan of retailer_order_inbox_idx.
+    """
+    retailer = models.ForeignKey(Retailer, on_delete=models.CASCADE, related_name='order_links')
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='retailer_links')
+    created_at = models.DateTimeField()
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['retailer', 'order'], name='unique_retailer_order'),
+        ]
+        indexes = [
+            models.Index(fields=['retailer', '-created_at', '-order'], name='retailer_order_inbox_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.order.order_number} for {self.retailer.company_name}"
+
 class PromoCode(models.Model):
     code = models.CharField(max_length=50, unique=True)
     discount_amount = models.DecimalField(max_digits=10, decimal_places=2, default=0)
@@ -143,16 +336,37 @@ class Review(models.Model):
     comment = models.TextField()
     created_at = models.DateTimeField(auto_now_add=True)
     
+    class Meta:
+        indexes = [
+            models.Index(fields=['product', '-created_at', '-id'], name='review_product_created_idx'),
+            models.Index(fields=['user', '-created_at', '-id'], name='review_user_created_idx'),
+        ]
+    
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # signals.py moves the product's rating counts from these on change
+        instance._loaded_rating = (instance.__dict__.get('product_id'), instance.__dict__.get('rating'))
+        return instance
+    
     def __str__(self):
         return f"{self.user.username}'s review on {self.product.name}"
 
 class BinaryFile(models.Model):
     name = models.CharField(max_length=255)
-    content = models.BinaryField()
+    # Content lives in the on-disk blob store (see blobs.py), keyed by hash
+    sha256 = models.CharField(max_length=64, db_index=True, editable=False)
     file_type = models.CharField(max_length=50)
     size = models.IntegerField()
     uploaded_at = models.DateTimeField(auto_now_add=True)
     description = models.TextField(blank=True, null=True)
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # signals.py releases the old blob when the content is replaced
+        instance._loaded_sha256 = instance.__dict__.get('sha256')
+        return instance
+
     def __str__(self):
         return self.name
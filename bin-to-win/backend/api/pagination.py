@@ -0,0 +1,234 @@
+import base64
+import binascii
+import datetime
+import json
+from collections import OrderedDict
+from decimal import Decimal
+
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.core.paginator import InvalidPage
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+async def apaginate_page_numbers(pagination, queryset, request):
+    """
+    ``PageNumberPagination.paginate_queryset`` for async views: the COUNT and
+    the page are fetched through the async ORM, everything else is DRF's.
+    """
+    pagination.request = request
+    page_size = pagination.get_page_size(request)
+    if not page_size:
+        return None
+
+    paginator = pagination.django_paginator_class(queryset, page_size)
+    paginator.count = await queryset.acount()
+    page_number = pagination.get_page_number(request, paginator)
+    try:
+        pagination.page = paginator.page(page_number)
+    except InvalidPage as exc:
+        raise NotFound(pagination.invalid_page_message.format(page_number=page_number, message=str(exc)))
+    pagination.page.object_list = [row async for row in pagination.page.object_list]
+    return list(pagination.page)
+
+
+class CatalogPagination(PageNumberPagination):
+    """
+    Page-number pagination with two opt-ins for large listings.
+
+    ``?count=false`` skips the COUNT(*) query. ``?pagination=cursor`` switches
+    to keyset pagination: instead of an OFFSET, each page seeks past the
+    (sort key, id) values of the previous page's last row, so deep pages cost
+    the same as the first. The queryset's ordering must be plain fields ending
+    in ``id``; anything else falls back to page numbers.
+    """
+    mode_query_param = 'pagination'
+    cursor_query_param = 'cursor'
+    count_query_param = 'count'
+    invalid_cursor_message = 'Invalid cursor.'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.select_mode(queryset, request)
+        if self.ordering is not None:
+            return self.paginate_keyset(queryset, request)
+        if self.include_count:
+            return super().paginate_queryset(queryset, request, view)
+        return self.paginate_without_count(queryset, request)
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        """``paginate_queryset`` for async views."""
+        self.select_mode(queryset, request)
+        if self.ordering is not None:
+            return await self.apaginate_keyset(queryset, request)
+        if self.include_count:
+            return await apaginate_page_numbers(self, queryset, request)
+        return await self.apaginate_without_count(queryset, request)
+
+    def select_mode(self, queryset, request):
+        self.request = request
+        self.include_count = request.query_params.get(self.count_query_param, '').lower() != 'false'
+        self.ordering = None
+        if self.cursor_query_param in request.query_params or \
+                request.query_params.get(self.mode_query_param) == 'cursor':
+            self.ordering = self.get_keyset_ordering(queryset)
+
+    def get_paginated_response(self, data):
+        if self.ordering is None and self.include_count:
+            return super().get_paginated_response(data)
+        response = OrderedDict()
+        if self.include_count:
+            response['count'] = self.count
+        response['next'] = self.get_next_link()
+        response['previous'] = self.get_previous_link()
+        response['results'] = data
+        return Response(response)
+
+    def get_next_link(self):
+        if self.ordering is not None:
+            if self.next_cursor is None:
+                return None
+            url = remove_query_param(self.request.build_absolute_uri(), self.page_query_param)
+            return replace_query_param(url, self.cursor_query_param, self.next_cursor)
+        if not self.include_count:
+            if not self.has_next:
+                return None
+            return replace_query_param(self.request.build_absolute_uri(), self.page_query_param, self.page_number + 1)
+        return super().get_next_link()
+
+    def get_previous_link(self):
+        if self.ordering is not None:
+            # Cursors only move forwards; clients keep their own history
+            return None
+        if not self.include_count:
+            if self.page_number == 1:
+                return None
+            url = self.request.build_absolute_uri()
+            if self.page_number == 2:
+                return remove_query_param(url, self.page_query_param)
+            return replace_query_param(url, self.page_query_param, self.page_number - 1)
+        return super().get_previous_link()
+
+    def get_html_context(self):
+        if self.ordering is None and self.include_count:
+            return super().get_html_context()
+        return {'previous_url': self.get_previous_link(), 'next_url': self.get_next_link(), 'page_links': []}
+
+    # Page numbers without COUNT(*)
+
+    def paginate_without_count(self, queryset, request):
+        page = self.page_without_count(queryset, request)
+        return self.finish_page_without_count(list(page))
+
+    async def apaginate_without_count(self, queryset, request):
+        page = self.page_without_count(queryset, request)
+        return self.finish_page_without_count([row async for row in page])
+
+    def page_without_count(self, queryset, request):
+        """The requested page plus one row, to tell whether there is a next page."""
+        self.current_page_size = self.get_page_size(request)
+        try:
+            self.page_number = int(request.query_params.get(self.page_query_param, 1))
+        except ValueError:
+            self.page_number = 0
+        if self.page_number < 1:
+            raise NotFound(self.invalid_page_message.format(page_number=self.page_number, message=''))
+
+        offset = (self.page_number - 1) * self.current_page_size
+        return queryset[offset:offset + self.current_page_size + 1]
+
+    def finish_page_without_count(self, rows):
+        self.has_next = len(rows) > self.current_page_size
+        return rows[:self.current_page_size]
+
+    # Keyset pagination
+
+    def get_keyset_ordering(self, queryset):
+        """Return ``[(field, descending), ...]`` or ``None`` if the ordering can't be used as a key."""
+        order_by = queryset.query.order_by
+        if not order_by:
+            return None
+        ordering = []
+        for item in order_by:
+            if not isinstance(item, str):
+                return None
+            name = item.lstrip('-')
+            if '__' in name or name in queryset.query.extra:
+                return None
+            ordering.append(('id' if name == 'pk' else name, item.startswith('-')))
+        if ordering[-1][0] != 'id':
+            return None
+        return ordering
+
+    def paginate_keyset(self, queryset, request):
+        if self.include_count:
+            self.count = queryset.count()
+        return self.finish_keyset_page(list(self.keyset_page(queryset, request)))
+
+    async def apaginate_keyset(self, queryset, request):
+        if self.include_count:
+            self.count = await queryset.acount()
+        return self.finish_keyset_page([row async for row in self.keyset_page(queryset, request)])
+
+    def keyset_page(self, queryset, request):
+        """Rows after the cursor, plus one to tell whether there is a next page."""
+        self.current_page_size = self.get_page_size(request)
+        token = request.query_params.get(self.cursor_query_param)
+        if token:
+            try:
+                queryset = queryset.filter(self.seek_filter(self.decode_cursor(token)))
+            except (DjangoValidationError, TypeError, ValueError):
+                raise NotFound(self.invalid_cursor_message)
+        return queryset[:self.current_page_size + 1]
+
+    def finish_keyset_page(self, rows):
+        self.next_cursor = None
+        if len(rows) > self.current_page_size:
+            rows = rows[:self.current_page_size]
+            last = rows[-1]
+            if isinstance(last, dict):
+                values = [last[name] for name, _ in self.ordering]
+            else:
+                values = [getattr(last, name) for name, _ in self.ordering]
+            self.next_cursor = self.encode_cursor(values)
+        return rows
+
+    def seek_filter(self, values):
+        """
+        Rows strictly after ``values`` in the current ordering:
+        a >= x AND ((a > x) OR (a = x AND b > y) OR ...)
+
+        The redundant leading bound lets the database seek the index to x
+        instead of filtering every row before it.
+        """
+        condition = Q()
+        equal = Q()
+        for (name, descending), value in zip(self.ordering, values):
+            lookup = 'lt' if descending else 'gt'
+            condition |= equal & Q(**{f'{name}__{lookup}': value})
+            equal &= Q(**{name: value})
+        first_name, first_descending = self.ordering[0]
+        bound = Q(**{f"{first_name}__{'lte' if first_descending else 'gte'}": values[0]})
+        return bound & condition
+
+    def encode_cursor(self, values):
+        def encode(value):
+            if isinstance(value, (datetime.date, datetime.datetime)):
+                return value.isoformat()
+            if isinstance(value, Decimal):
+                return str(value)
+            return value
+        payload = json.dumps([encode(value) for value in values], separators=(',', ':'))
+        return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+    def decode_cursor(self, token):
+        try:
+            padded = token + '=' * (-len(token) % 4)
+            values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        except (binascii.Error, UnicodeDecodeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(values, list) or len(values) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+        return values
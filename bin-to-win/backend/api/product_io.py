@@ -0,0 +1,308 @@
+"""
+Bulk product import and export for retailers, as CSV or JSON Lines.
+
+``import_products`` streams rows from a binary file, validates each one and
+writes them in batches, matched by slug: one
+``bulk_create(update_conflicts=True)`` per batch inserts new slugs and
+updates the retailer's existing products in place; slugs owned by another
+retailer are rejected in the same transaction. Only one batch is held in
+memory, so a million-row file costs no more memory than a small one.
+Categories are resolved by slug from a single query up front. Each batch
+commits on its own; an invalid row is reported and skipped without failing
+the rest.
+
+``export_rows`` streams a retailer's products in the same format, so an
+export can be edited and imported again.
+
+Bulk writes skip model signals, so every batch invalidates the catalog
+cache and cart summaries itself (as in ``expiry.py``).
+"""
+import csv
+import datetime
+import io
+import json
+import re
+import time
+from decimal import Decimal, InvalidOperation
+
+from django.db import reset_queries, transaction
+
+from .cart import invalidate_cart_summaries_for_products
+from .catalog_cache import invalidate_all_products
+from .models import Category, Product
+
+FORMATS = ('csv', 'jsonl')
+
+# Columns of an import/export file; ``category`` holds the category's slug
+COLUMNS = [
+    'slug', 'name', 'description', 'price', 'original_price', 'expiry_date',
+    'stock', 'category', 'is_featured', 'is_active',
+]
+REQUIRED = {'slug', 'name', 'price', 'original_price', 'expiry_date', 'stock', 'category'}
+
+UPDATE_FIELDS = [
+    'name', 'description', 'price', 'original_price', 'expiry_date', 'stock',
+    'category', 'is_featured', 'is_active', 'updated_at',
+    # An imported price replaces any markdown, as in ProductSerializer.update
+    'markdown_base_price', 'expiry_bucket',
+]
+
+MAX_REPORTED_ERRORS = 100
+MAX_PRICE = Decimal('99999999.99')
+MAX_STOCK = 2147483647
+SLUG_RE = re.compile(r'^[-a-zA-Z0-9_]{1,50}$')
+TRUE_VALUES = {'1', 'true', 't', 'yes', 'y'}
+FALSE_VALUES = {'0', 'false', 'f', 'no', 'n'}
+
+
+class ImportFormatError(ValueError):
+    pass
+
+
+def detect_format(filename, default=None):
+    if filename:
+        extension = filename.rsplit('.', 1)[-1].lower()
+        if extension in ('jsonl', 'ndjson'):
+            return 'jsonl'
+        if extension == 'csv':
+            return 'csv'
+    return default
+
+
+def read_rows(binary_file, file_format):
+    """Yield ``(line number, dict)`` for each row of a CSV or JSON Lines file."""
+    if file_format not in FORMATS:
+        raise ImportFormatError(f"Unknown format {file_format!r}; expected one of {', '.join(FORMATS)}")
+    text = io.TextIOWrapper(binary_file, encoding='utf-8-sig', newline='')
+    try:
+        yield from _parse(text, file_format)
+    except UnicodeDecodeError:
+        raise ImportFormatError('The file is not UTF-8 encoded.')
+    finally:
+        # Leave closing the underlying file to its owner
+        text.detach()
+
+
+def _parse(text, file_format):
+    if file_format == 'csv':
+        reader = csv.DictReader(text)
+        missing = REQUIRED - set(reader.fieldnames or ())
+        if missing:
+            raise ImportFormatError(f"Missing CSV column(s): {', '.join(sorted(missing))}")
+        for row in reader:
+            yield reader.line_num, row
+    else:
+        for number, line in enumerate(text, start=1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError:
+                row = None
+            yield number, row if isinstance(row, dict) else {'__invalid__': True}
+
+
+def _text(value):
+    return '' if value is None else str(value).strip()
+
+
+def _decimal(value):
+    number = Decimal(_text(value))
+    if not number.is_finite() or number < 0 or number > MAX_PRICE or number.as_tuple().exponent < -2:
+        raise InvalidOperation
+    return number
+
+
+def _boolean(value, default):
+    if isinstance(value, bool):
+        return value
+    text = _text(value).lower()
+    if not text:
+        return default
+    if text in TRUE_VALUES:
+        return True
+    if text in FALSE_VALUES:
+        return False
+    raise ValueError
+
+
+def clean_row(row, category_ids):
+    """Return ``(values, errors)`` for one raw row; ``values`` is None if it is invalid."""
+    if '__invalid__' in row:
+        return None, {'row': 'Not a JSON object.'}
+    errors = {}
+    for name in REQUIRED:
+        if not _text(row.get(name)):
+            errors[name] = 'This field is required.'
+
+    values = {}
+    slug = _text(row.get('slug'))
+    if slug and not SLUG_RE.match(slug):
+        errors['slug'] = 'Enter a valid slug of at most 50 letters, numbers, underscores or hyphens.'
+    values['slug'] = slug
+    values['name'] = _text(row.get('name'))
+    if len(values['name']) > 255:
+        errors['name'] = 'Ensure this field has no more than 255 characters.'
+    values['description'] = _text(row.get('description'))
+    for name in ('price', 'original_price'):
+        if name not in errors:
+            try:
+                values[name] = _decimal(row[name])
+            except (InvalidOperation, ValueError):
+                errors[name] = 'Enter a number from 0 to 99999999.99 with at most 2 decimal places.'
+    if 'expiry_date' not in errors:
+        try:
+            values['expiry_date'] = datetime.date.fromisoformat(_text(row['expiry_date']))
+        except ValueError:
+            errors['expiry_date'] = 'Enter a date as YYYY-MM-DD.'
+    if 'stock' not in errors:
+        try:
+            values['stock'] = int(_text(row['stock']))
+            if not 0 <= values['stock'] <= MAX_STOCK:
+                raise ValueError
+        except ValueError:
+            errors['stock'] = 'Enter a whole number of at least 0.'
+    if 'category' not in errors:
+        values['category_id'] = category_ids.get(_text(row['category']))
+        if values['category_id'] is None:
+            errors['category'] = f"Unknown category {_text(row['category'])!r}."
+    for name, default in (('is_featured', False), ('is_active', True)):
+        try:
+            values[name] = _boolean(row.get(name), default)
+        except ValueError:
+            errors[name] = 'Enter true or false.'
+    return (None, errors) if errors else (values, None)
+
+
+class ImportReport:
+    def __init__(self):
+        self.rows = self.created = self.updated = self.error_count = 0
+        self.errors = []
+        self.started = time.perf_counter()
+        self.seconds = 0.0
+
+    def error(self, line, errors):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'line': line, 'errors': errors})
+
+    def finish(self):
+        self.seconds = time.perf_counter() - self.started
+        return self
+
+    def as_dict(self):
+        return {
+            'rows': self.rows,
+            'created': self.created,
+            'updated': self.updated,
+            'error_count': self.error_count,
+            'errors': self.errors,
+            'seconds': round(self.seconds, 3),
+            'rows_per_second': round(self.rows / self.seconds) if self.seconds else 0,
+        }
+
+
+def import_products(binary_file, file_format, retailer, batch_size=2000, dry_run=False):
+    """Upsert the rows of ``binary_file`` as ``retailer``'s products; returns an ImportReport."""
+    category_ids = dict(Category.objects.values_list('slug', 'id'))
+    report = ImportReport()
+    batch = []
+    for line, row in read_rows(binary_file, file_format):
+        report.rows += 1
+        values, errors = clean_row(row, category_ids)
+        if errors:
+            report.error(line, errors)
+            continue
+        batch.append((line, values))
+        if len(batch) >= batch_size:
+            _write_batch(batch, retailer, report, dry_run)
+            batch = []
+            # With DEBUG on Django logs every query; don't let a long import pile them up
+            reset_queries()
+    if batch:
+        _write_batch(batch, retailer, report, dry_run)
+    return report.finish()
+
+
+class _SlugTaken(Exception):
+    """Another retailer inserted one of a batch's new slugs while it was written."""
+
+
+def _plan_batch(rows, retailer):
+    """``(products, updated ids, [(line, errors)])`` for a batch, locking the rows it updates."""
+    existing = {
+        slug: (pk, retailer_id)
+        for slug, pk, retailer_id in Product.objects.select_for_update().filter(slug__in=rows)
+        .values_list('slug', 'id', 'retailer_id')
+    }
+    products, updated_ids, errors = [], [], []
+    for slug, (line, values) in rows.items():
+        if slug in existing:
+            pk, owner_id = existing[slug]
+            if owner_id != retailer.pk:
+                errors.append((line, {'slug': 'A product with this slug belongs to another retailer.'}))
+                continue
+            updated_ids.append(pk)
+        products.append(Product(retailer=retailer, markdown_base_price=None, expiry_bucket=None, **values))
+    return products, updated_ids, errors
+
+
+def _write_batch(batch, retailer, report, dry_run):
+    # A slug repeated within the batch keeps its last row
+    rows = {values['slug']: (line, values) for line, values in batch}
+    while True:
+        try:
+            with transaction.atomic():
+                # Ownership is read and the batch written in one transaction,
+                # so a product can't change hands in between
+                products, updated_ids, errors = _plan_batch(rows, retailer)
+                if not dry_run and products:
+                    # One INSERT .. ON CONFLICT per chunk; bulk_update would build a
+                    # CASE per field per row and is an order of magnitude slower.
+                    Product.objects.bulk_create(
+                        products, update_conflicts=True, unique_fields=['slug'], update_fields=UPDATE_FIELDS,
+                    )
+                    # ON CONFLICT can't be limited to the retailer's rows: if
+                    # another retailer inserted a new slug meanwhile, their
+                    # product was just updated. Roll back and plan again.
+                    written = [product.slug for product in products]
+                    if Product.objects.filter(slug__in=written).exclude(retailer=retailer).exists():
+                        raise _SlugTaken
+            break
+        except _SlugTaken:
+            continue
+
+    for line, line_errors in errors:
+        report.error(line, line_errors)
+    if not dry_run and products:
+        invalidate_all_products()
+        if updated_ids:
+            invalidate_cart_summaries_for_products(updated_ids)
+    report.created += len(products) - len(updated_ids)
+    report.updated += len(updated_ids)
+
+
+class _Echo:
+    """File-like object whose write() returns the written line, for csv.writer."""
+    def write(self, value):
+        return value
+
+
+def export_rows(queryset, file_format, chunk_size=2000):
+    """Yield ``queryset``'s products as encoded CSV or JSON Lines, one line at a time."""
+    rows = queryset.order_by('id').values_list(
+        'slug', 'name', 'description', 'price', 'original_price', 'expiry_date',
+        'stock', 'category__slug', 'is_featured', 'is_active',
+    ).iterator(chunk_size=chunk_size)
+    if file_format == 'csv':
+        writer = csv.writer(_Echo())
+        yield writer.writerow(COLUMNS).encode()
+        for row in rows:
+            yield writer.writerow(row).encode()
+    else:
+        for row in rows:
+            record = dict(zip(COLUMNS, row))
+            for name in ('price', 'original_price'):
+                record[name] = str(record[name])
+            record['expiry_date'] = record['expiry_date'].isoformat()
+            yield (json.dumps(record) + '\n').encode()
@@ -0,0 +1,41 @@
+"""
+Product rating histograms.
+
+signals.py moves a product's ``rating_<n>_count`` columns by one as reviews
+are written. ``recompute_ratings`` rebuilds them from the reviews instead,
+for ``manage.py recompute_ratings`` and for generated data (synthetic.py).
+It updates one batch of products per statement, each column from a
+correlated COUNT subquery, so nothing is loaded into Python.
+"""
+from django.db.models import Count, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .catalog_cache import invalidate_all_products
+from .models import RATING_COUNT_FIELDS, Product, Review
+
+
+def rating_counts():
+    """Subquery per histogram column counting the product's reviews with that rating."""
+    counts = {}
+    for stars, field in enumerate(RATING_COUNT_FIELDS, start=1):
+        reviews = (
+            Review.objects.filter(product=OuterRef('pk'), rating=stars)
+            .order_by().values('product').annotate(total=Count('*')).values('total')
+        )
+        counts[field] = Coalesce(Subquery(reviews, output_field=IntegerField()), Value(0))
+    return counts
+
+
+def recompute_ratings(products, batch_size):
+    """Rebuild the histograms of ``products``, a Product queryset; returns the row count."""
+    counts = rating_counts()
+    total = 0
+    last_id = 0
+    while ids := list(
+        products.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:batch_size]
+    ):
+        total += Product.objects.filter(id__in=ids).update(**counts, updated_at=timezone.now())
+        last_id = ids[-1]
+    invalidate_all_products()
+    return total
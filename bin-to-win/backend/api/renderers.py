@@ -0,0 +1,84 @@
+"""
+A drop-in JSONRenderer encoded by orjson.
+
+orjson is C-accelerated and several times faster than ``json.dumps`` with
+DRF's encoder on serialized pages. The output is byte for byte what
+``JSONRenderer`` produces with the default COMPACT_JSON, UNICODE_JSON and
+STRICT_JSON settings:
+
+- Dates, times and datetimes are handed to DRF's encoder (orjson's own
+  formats differ), as are Decimals, lazy strings, querysets and anything
+  else orjson doesn't know.
+- U+2028 and U+2029 are escaped as DRF does.
+
+- NaN and infinities, which orjson would write as ``null``, are handed to
+  ``JSONRenderer.render``, which raises ValueError as STRICT_JSON demands.
+  Only payloads whose output contains ``null`` are searched for them.
+
+The one difference is floats in exponent notation: orjson writes ``1e16``
+where ``json`` writes ``1e+16``. It is the same number, and the API doesn't
+produce floats that large or small.
+
+Indented output (the browsable API, ``Accept: application/json; indent=4``),
+other JSON settings, payloads orjson rejects (e.g. integers beyond 64 bits)
+and installs without orjson fall back to ``JSONRenderer.render``.
+"""
+import math
+from decimal import Decimal
+
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:  # optional, see requirements.txt
+    orjson = None
+
+if orjson is not None:
+    ORJSON_OPTIONS = (
+        orjson.OPT_PASSTHROUGH_DATETIME
+        | orjson.OPT_PASSTHROUGH_DATACLASS
+        | orjson.OPT_NON_STR_KEYS
+    )
+
+
+def has_non_finite_numbers(data):
+    """Whether ``data`` holds a NaN or infinite float or Decimal in its values."""
+    stack = [data]
+    while stack:
+        value = stack.pop()
+        if isinstance(value, float):
+            if not math.isfinite(value):
+                return True
+        elif isinstance(value, Decimal):
+            if not value.is_finite():
+                return True
+        elif isinstance(value, dict):
+            stack.extend(value.values())
+        elif isinstance(value, (list, tuple)):
+            stack.extend(value)
+    return False
+
+
+class FastJSONRenderer(JSONRenderer):
+    encoder = JSONEncoder()
+
+    def uses_orjson(self, accepted_media_type, renderer_context):
+        return (
+            orjson is not None
+            and self.compact and not self.ensure_ascii and self.strict
+            and self.get_indent(accepted_media_type, renderer_context or {}) is None
+        )
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None or not self.uses_orjson(accepted_media_type, renderer_context):
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            ret = orjson.dumps(data, default=self.encoder.default, option=ORJSON_OPTIONS)
+        except orjson.JSONEncodeError:
+            return super().render(data, accepted_media_type, renderer_context)
+        if b'null' in ret and has_non_finite_numbers(data):
+            return super().render(data, accepted_media_type, renderer_context)
+        if b'\xe2\x80\xa8' in ret or b'\xe2\x80\xa9' in ret:
+            ret = ret.replace('\u2028'.encode(), b'\\u2028').replace('\u2029'.encode(), b'\\u2029')
+        return ret
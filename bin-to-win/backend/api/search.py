@@ -0,0 +1,102 @@
+"""
+Full-text product search.
+
+On SQLite products are indexed in an FTS5 table (``api_product_fts``) that
+triggers on ``api_product`` keep in sync, so saves, deletes and bulk writes
+are all covered. On PostgreSQL a GIN index is built over the same tsvector
+expression that ``search_products`` filters on. Any other backend falls back
+to the old ``icontains`` scan. Migration 0004 creates the index.
+"""
+import re
+
+from django.db import connections
+from django.db.models import FloatField, Q, Value
+from django.db.models.expressions import RawSQL
+
+FTS_TABLE = 'api_product_fts'
+SEARCH_CONFIG = 'english'
+
+# Migration 0004 creates the FTS table and these triggers
+SQLITE_TRIGGERS = [
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON api_product BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, name, description) VALUES (new.id, new.name, new.description);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON api_product BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, description)
+        VALUES ('delete', old.id, old.name, old.description);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au AFTER UPDATE OF name, description ON api_product BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, description)
+        VALUES ('delete', old.id, old.name, old.description);
+        INSERT INTO {FTS_TABLE}(rowid, name, description) VALUES (new.id, new.name, new.description);
+    END""",
+]
+
+
+def parse_terms(text):
+    """Split user input into lowercase word tokens."""
+    return re.findall(r'\w+', text.lower())
+
+
+def product_search_vector():
+    from django.contrib.postgres.search import SearchVector
+
+    return SearchVector('name', 'description', config=SEARCH_CONFIG)
+
+
+def ensure_sqlite_triggers(using):
+    """
+    Recreate the FTS triggers if a migration rebuilt ``api_product``.
+
+    SQLite drops a table's triggers when Django's schema editor remakes it
+    (e.g. to add a NOT NULL column), so this runs after every migrate.
+    """
+    connection = connections[using]
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        if FTS_TABLE not in connection.introspection.table_names(cursor):
+            return
+        for statement in SQLITE_TRIGGERS:
+            cursor.execute(statement)
+
+
+def search_products(queryset, text, ranked=False):
+    """
+    Filter ``queryset`` to products matching every word in ``text``.
+
+    Each word is matched as a prefix ("tom" finds "tomatoes"). With
+    ``ranked=True`` a ``search_rank`` annotation is added where higher
+    means more relevant.
+    """
+    terms = parse_terms(text)
+    vendor = connections[queryset.db].vendor
+    if not terms or vendor not in ('sqlite', 'postgresql'):
+        queryset = queryset.filter(Q(name__icontains=text) | Q(description__icontains=text))
+        if ranked:
+            queryset = queryset.annotate(search_rank=Value(0.0, output_field=FloatField()))
+        return queryset
+
+    if vendor == 'sqlite':
+        match = ' '.join(f'"{term}"*' for term in terms)
+        if not ranked:
+            return queryset.filter(
+                id__in=RawSQL(f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s', [match])
+            )
+        # The ORM can't join a virtual table, and a correlated rank subquery
+        # re-runs the full-text query per row, so join it with extra().
+        # FTS5's rank is bm25(), where more negative is a better match.
+        return queryset.extra(
+            tables=[FTS_TABLE],
+            where=[f'{FTS_TABLE}.rowid = api_product.id', f'{FTS_TABLE} MATCH %s'],
+            params=[match],
+            select={'search_rank': f'-{FTS_TABLE}.rank'},
+        )
+
+    from django.contrib.postgres.search import SearchQuery, SearchRank
+
+    query = SearchQuery(' & '.join(f'{term}:*' for term in terms), config=SEARCH_CONFIG, search_type='raw')
+    queryset = queryset.annotate(search_vector=product_search_vector()).filter(search_vector=query)
+    if ranked:
+        queryset = queryset.annotate(search_rank=SearchRank('search_vector', query))
+    return queryset
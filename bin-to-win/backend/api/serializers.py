@@ -1,5 +1,12 @@
+import operator
+
 from rest_framework import serializers
 from django.contrib.auth import get_user_model
+from django.db.models.fields.files import FieldFile
+from .blobs import get_blob_store
+from .cart import MAX_CART_OPERATIONS, add_to_cart
+from .images import rendition_urls
+from .metrics import serialization
 from .models import (
     Category, 
     Retailer, 
@@ -10,17 +17,96 @@ from .models import (
     OrderItem, 
     PromoCode, 
     Review,
-    BinaryFile
+    BinaryFile,
+    RATING_COUNT_FIELDS
 )
 
 User = get_user_model()
 
+def absolute_urls(urls, request):
+    """``urls`` made absolute with ``request``, as DRF's ImageField does for the image itself."""
+    if urls is None or request is None:
+        return urls
+    return {name: request.build_absolute_uri(url) for name, url in urls.items()}
+
+class RenditionUrlsField(serializers.DictField):
+    """Rendition name -> absolute URL, for the Next.js app on another origin."""
+    child = serializers.CharField()
+    
+    def to_representation(self, value):
+        return super().to_representation(absolute_urls(value, self.context.get('request')))
+
+class SparseFieldsMixin:
+    """Pass ``fields=[...]`` to keep only those of the serializer's fields."""
+    
+    def __init__(self, *args, **kwargs):
+        fields = kwargs.pop('fields', None)
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+class ValuesSerializer:
+    """
+    Builds the same representation as ``serializer`` (an unbound
+    ModelSerializer, possibly trimmed to sparse fields) from ``values()`` rows
+    instead of model instances, skipping model construction and DRF's
+    per-field attribute lookup. Each field still formats its value with its
+    own ``to_representation``, so the output is identical.
+    
+    Fields read a column, or a column across foreign keys for dotted sources.
+    Fields computed from several columns are listed in the serializer's
+    ``Meta.value_sources`` as ``name: (columns, function(row))``.
+    """
+    
+    def __init__(self, serializer):
+        value_sources = getattr(serializer.Meta, 'value_sources', {})
+        self.columns = {'id'}
+        self.readers = []
+        for name, field in serializer.fields.items():
+            if field.write_only:
+                continue
+            if name in value_sources:
+                columns, read = value_sources[name]
+                self.columns.update(columns)
+            else:
+                column = '__'.join(field.source_attrs)
+                self.columns.add(column)
+                read = operator.itemgetter(column)
+            if isinstance(field, serializers.RelatedField):
+                # The foreign key column already is the primary key
+                represent = None
+            else:
+                represent = field.to_representation
+            self.readers.append((name, read, represent))
+    
+    def queryset(self, queryset):
+        # Keyset pagination reads the ordering columns off the last row.
+        # Columns added with extra(select=...), like search_rank, can't be
+        # keyset-paginated and would be read as the COUNT(*) of a count().
+        ordering = {name.lstrip('-') for name in queryset.query.order_by if isinstance(name, str) and '__' not in name}
+        ordering.discard('pk')
+        ordering.difference_update(queryset.query.extra)
+        return queryset.values(*self.columns | ordering)
+    
+    def represent(self, rows):
+        data = []
+        with serialization():
+            for row in rows:
+                item = {}
+                for name, read, represent in self.readers:
+                    value = read(row)
+                    item[name] = value if value is None or represent is None else represent(value)
+                data.append(item)
+        return data
+
 class UserSerializer(serializers.ModelSerializer):
     password = serializers.CharField(write_only=True)
+    profile_image_renditions = RenditionUrlsField(source='profile_image_rendition_urls', read_only=True)
     
     class Meta:
         model = User
-        fields = ['id', 'username', 'email', 'first_name', 'last_name', 'password', 'user_type', 'phone', 'address', 'profile_image']
+        fields = ['id', 'username', 'email', 'first_name', 'last_name', 'password', 'user_type', 'phone', 'address', 'profile_image', 'profile_image_renditions']
         extra_kwargs = {
             'password': {'write_only': True}
         }
@@ -44,25 +130,62 @@ class RetailerSerializer(serializers.ModelSerializer):
         model = Retailer
         fields = ['id', 'user', 'company_name', 'company_address', 'business_license', 'approved']
 
-class ProductSerializer(serializers.ModelSerializer):
+def _product_image(row, field=Product._meta.get_field('image')):
+    return FieldFile(None, field, row['image'])
+
+def _product_image_renditions(row):
+    return rendition_urls(row['image'], row['image_renditions'])
+
+def _product_rating_histogram(row):
+    return {stars: row[field] for stars, field in enumerate(RATING_COUNT_FIELDS, start=1)}
+
+class ProductSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     discount_percentage = serializers.IntegerField(read_only=True)
     category_name = serializers.CharField(source='category.name', read_only=True)
     retailer_name = serializers.CharField(source='retailer.company_name', read_only=True)
+    rating_avg = serializers.DecimalField(max_digits=3, decimal_places=2, read_only=True)
+    rating_count = serializers.IntegerField(read_only=True)
+    rating_histogram = serializers.DictField(child=serializers.IntegerField(), read_only=True)
+    image_renditions = RenditionUrlsField(source='image_rendition_urls', read_only=True)
     
     class Meta:
         model = Product
         fields = [
             'id', 'name', 'slug', 'description', 'price', 'original_price', 
             'expiry_date', 'category', 'category_name', 'retailer', 'retailer_name',
-            'stock', 'image', 'discount_percentage', 'is_featured', 'is_active',
-            'created_at', 'updated_at'
+            'stock', 'image', 'image_renditions', 'discount_percentage', 'expiry_bucket', 'is_featured', 'is_active',
+            'rating_avg', 'rating_count', 'rating_histogram', 'created_at', 'updated_at'
+        ]
+        value_sources = {
+            'image': (['image'], _product_image),
+            'image_renditions': (['image', 'image_renditions'], _product_image_renditions),
+            'rating_histogram': (RATING_COUNT_FIELDS, _product_rating_histogram),
+        }
+    
+    def update(self, instance, validated_data):
+        if 'price' in validated_data:
+            # A manual price replaces the automatic markdown; the expiry
+            # engine marks the new price down on its next run.
+            instance.markdown_base_price = None
+            instance.expiry_bucket = None
+        return super().update(instance, validated_data)
+
+class ProductCardSerializer(ProductSerializer):
+    """Compact product for listings; retrieve returns the full ProductSerializer."""
+    
+    class Meta(ProductSerializer.Meta):
+        fields = [
+            'id', 'name', 'slug', 'price', 'original_price', 'discount_percentage',
+            'expiry_date', 'expiry_bucket', 'category', 'category_name', 'retailer', 'retailer_name',
+            'stock', 'image', 'image_renditions', 'is_featured', 'rating_avg', 'rating_count'
         ]
 
 class CartItemSerializer(serializers.ModelSerializer):
     product = ProductSerializer(read_only=True)
     product_detail = serializers.SerializerMethodField()
     product_id = serializers.PrimaryKeyRelatedField(
-        queryset=Product.objects.all(),
+        # The response nests the product with its category and retailer names
+        queryset=Product.objects.select_related('category', 'retailer'),
         source='product',
         write_only=True
     )
@@ -73,7 +196,24 @@ class CartItemSerializer(serializers.ModelSerializer):
         model = CartItem
         fields = ['id', 'product', 'product_id', 'product_detail', 'quantity', 'user', 'added_at', 'total_price']
     
+    def validate(self, attrs):
+        # Adding a product already in the cart merges into its row (see
+        # api/cart.py), but moving an item onto one would break the
+        # unique (user, product) constraint.
+        product = attrs.get('product')
+        if self.instance is not None and product is not None and product.pk != self.instance.product_id:
+            if CartItem.objects.filter(user_id=self.instance.user_id, product=product).exists():
+                raise serializers.ValidationError({'product_id': ['This product is already in the cart.']})
+        return attrs
+    
+    def create(self, validated_data):
+        return add_to_cart(validated_data['user'], validated_data['product'], validated_data.get('quantity', 1))
+    
     def get_product_detail(self, obj):
+        request = self.context.get('request')
+        image = obj.product.image.url if obj.product.image else None
+        if image and request is not None:
+            image = request.build_absolute_uri(image)
         return {
             'id': obj.product.id,
             'name': obj.product.name,
@@ -81,11 +221,26 @@ class CartItemSerializer(serializers.ModelSerializer):
             'price': float(obj.product.price),
             'original_price': float(obj.product.original_price),
             'expiry_date': obj.product.expiry_date,
-            'image': obj.product.image.url if obj.product.image else None,
+            'image': image,
+            'image_renditions': absolute_urls(obj.product.image_rendition_urls, request),
             'stock': obj.product.stock,
-            'discount_percentage': int(((obj.product.original_price - obj.product.price) / obj.product.original_price) * 100)
+            'discount_percentage': obj.product.discount_percentage
         }
 
+class CartOperationSerializer(serializers.Serializer):
+    op = serializers.ChoiceField(choices=['add', 'update', 'remove'])
+    product_id = serializers.IntegerField(min_value=1)
+    quantity = serializers.IntegerField(min_value=1, required=False)
+    
+    def validate(self, attrs):
+        if attrs['op'] == 'update' and 'quantity' not in attrs:
+            raise serializers.ValidationError({'quantity': ['This field is required.']})
+        attrs.setdefault('quantity', 1)
+        return attrs
+
+class CartBatchSerializer(serializers.Serializer):
+    operations = CartOperationSerializer(many=True, allow_empty=False, max_length=MAX_CART_OPERATIONS)
+
 class WishlistSerializer(serializers.ModelSerializer):
     product = ProductSerializer(read_only=True)
     product_id = serializers.PrimaryKeyRelatedField(
@@ -138,7 +293,47 @@ class ReviewSerializer(serializers.ModelSerializer):
         return super().create(validated_data)
 
 class BinaryFileSerializer(serializers.ModelSerializer):
+    # Uploads stream into the blob store; responses only carry metadata
+    file = serializers.FileField(write_only=True)
+    filename = serializers.CharField(write_only=True, required=False)
+    
     class Meta:
         model = BinaryFile
-        fields = ['id', 'name', 'content', 'file_type', 'size', 'uploaded_at', 'description']
-        read_only_fields = ['uploaded_at'] 
\ No newline at end of file
+        fields = ['id', 'name', 'file', 'filename', 'file_type', 'size', 'sha256', 'uploaded_at', 'description']
+        read_only_fields = ['size', 'sha256', 'uploaded_at']
+        extra_kwargs = {
+            'name': {'required': False},
+            'file_type': {'required': False},
+        }
+    
+    def create(self, validated_data):
+        upload = validated_data.pop('file')
+        filename = validated_data.pop('filename', None)
+        store = get_blob_store()
+        sha256, size = store.save(upload.chunks())
+        validated_data.setdefault('name', filename or upload.name)
+        validated_data.setdefault('file_type', upload.content_type or 'application/octet-stream')
+        binary_file = BinaryFile.objects.create(sha256=sha256, size=size, **validated_data)
+        self.ensure_blob(store, binary_file, upload)
+        return binary_file
+    
+    def update(self, instance, validated_data):
+        # signals.py releases the replaced blob once this commits
+        upload = validated_data.pop('file', None)
+        filename = validated_data.pop('filename', None)
+        if upload is None:
+            return super().update(instance, validated_data)
+        store = get_blob_store()
+        instance.sha256, instance.size = store.save(upload.chunks())
+        if filename:
+            validated_data.setdefault('name', filename)
+        validated_data.setdefault('file_type', upload.content_type or 'application/octet-stream')
+        binary_file = super().update(instance, validated_data)
+        self.ensure_blob(store, binary_file, upload)
+        return binary_file
+    
+    def ensure_blob(self, store, binary_file, upload):
+        if not store.exists(binary_file.sha256):
+            # A concurrent delete of the last file with this content removed the blob
+            upload.seek(0)
+            store.save(upload.chunks()) 
\ No newline at end of file
@@ -0,0 +1,141 @@
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models import F
+from django.db.models.signals import post_delete, post_migrate, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .authentication import revoke_token, revoke_user_tokens
+from .blobs import get_blob_store
+from .cart import invalidate_cart_summaries_for_products, invalidate_cart_summary
+from .catalog_cache import invalidate_all_products, invalidate_categories, invalidate_products
+from .db import configure_sqlite
+from .discounts import invalidate_promo_cache
+from .images import needs_renditions, schedule_renditions
+from .models import BinaryFile, CartItem, Category, ExpiringToken, Product, PromoCode, Retailer, Review
+from .search import ensure_sqlite_triggers
+
+
+@receiver(connection_created)
+def tune_connection(sender, connection, **kwargs):
+    if connection.vendor == 'sqlite':
+        configure_sqlite(connection)
+
+
+@receiver(post_migrate)
+def restore_search_triggers(sender, using, **kwargs):
+    if sender.name == 'api':
+        ensure_sqlite_triggers(using)
+
+
+@receiver([post_save, post_delete], sender=CartItem)
+def cart_item_changed(sender, instance, **kwargs):
+    invalidate_cart_summary(instance.user_id)
+
+
+@receiver(post_save, sender=Product)
+def product_saved(sender, instance, created, update_fields=None, **kwargs):
+    # Cached cart summaries embed product prices
+    if not created and (update_fields is None or {'price', 'original_price'} & set(update_fields)):
+        invalidate_cart_summaries_for_products([instance.pk])
+
+
+@receiver([post_save, post_delete], sender=Product)
+def product_changed(sender, instance, **kwargs):
+    invalidate_products([instance.pk])
+
+
+@receiver(post_save, sender=Product)
+def product_image_saved(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and 'image' not in update_fields:
+        return
+    if needs_renditions(instance.image, instance.image_renditions):
+        schedule_renditions(instance, 'image', on_ready=lambda: invalidate_products([instance.pk]))
+
+
+@receiver(post_save, sender=get_user_model())
+def profile_image_saved(sender, instance, update_fields=None, **kwargs):
+    # A full save can write back renditions loaded before the job finished;
+    # the source check below then schedules them again.
+    if update_fields is not None and 'profile_image' not in update_fields:
+        return
+    if needs_renditions(instance.profile_image, instance.profile_image_renditions):
+        schedule_renditions(instance, 'profile_image')
+
+
+def _count_rating(product_id, rating, delta):
+    field = f'rating_{rating}_count'
+    products = Product.objects.filter(pk=product_id)
+    if delta < 0:
+        products = products.filter(**{f'{field}__gt': 0})
+    if products.update(**{field: F(field) + delta}, updated_at=timezone.now()):
+        invalidate_products([product_id])
+
+
+@receiver(post_save, sender=Review)
+def review_saved(sender, instance, created, **kwargs):
+    current = (instance.product_id, instance.rating)
+    previous = None if created else getattr(instance, '_loaded_rating', None)
+    if current != previous:
+        if previous is not None:
+            _count_rating(*previous, -1)
+        _count_rating(*current, 1)
+    instance._loaded_rating = current
+
+
+@receiver(post_delete, sender=Review)
+def review_deleted(sender, instance, **kwargs):
+    loaded = getattr(instance, '_loaded_rating', None)
+    _count_rating(*(loaded or (instance.product_id, instance.rating)), -1)
+
+
+@receiver([post_save, post_delete], sender=Category)
+def category_changed(sender, instance, **kwargs):
+    # Also moves the products' ETags on (see conditional.py)
+    invalidate_categories([instance.pk])
+
+
+@receiver([post_save, post_delete], sender=Retailer)
+def retailer_changed(sender, instance, **kwargs):
+    # Product rows embed their retailer's company name
+    invalidate_all_products()
+
+
+def _release_blob(digest):
+    def delete_unreferenced_blob():
+        if not BinaryFile.objects.filter(sha256=digest).exists():
+            get_blob_store().delete(digest)
+    transaction.on_commit(delete_unreferenced_blob)
+
+
+@receiver(post_save, sender=BinaryFile)
+def binary_file_saved(sender, instance, created, **kwargs):
+    previous = None if created else getattr(instance, '_loaded_sha256', None)
+    if previous and previous != instance.sha256:
+        _release_blob(previous)
+    instance._loaded_sha256 = instance.sha256
+
+
+@receiver(post_delete, sender=BinaryFile)
+def binary_file_deleted(sender, instance, **kwargs):
+    _release_blob(instance.sha256)
+
+
+@receiver([post_save, post_delete], sender=ExpiringToken)
+def token_changed(sender, instance, **kwargs):
+    revoke_token(instance.key)
+
+
+@receiver(post_save, sender=get_user_model())
+def user_saved(sender, instance, created, update_fields=None, **kwargs):
+    # Cached token lookups hold a snapshot of the user; login only touches last_login
+    if not created and update_fields != frozenset({'last_login'}):
+        revoke_user_tokens(instance.pk)
+
+
+@receiver([post_save, post_delete], sender=PromoCode)
+def promo_code_changed(sender, instance, **kwargs):
+    # Reload after commit too, in case another request reloaded in between
+    invalidate_promo_cache()
+    transaction.on_commit(invalidate_promo_cache)
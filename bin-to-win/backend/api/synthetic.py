@@ -0,0 +1,358 @@
+"""
+Synthetic marketplace data at production-like scale.
+
+``generate_dataset`` tops the database up with users, retailers, categories,
+products, carts, wishlists, orders, reviews and promo codes, written with
+bulk inserts in batches so memory stays flat however many rows are asked
+for. A seeded ``random.Random`` drives every choice, so the same arguments
+on an empty database always produce the same data.
+
+The shape follows what a surplus-food marketplace sees rather than uniform
+noise: a few large retailers and popular categories hold most of the
+catalog (Zipf weights), most stock is days from its expiry date with deeper
+discounts the closer it gets, a minority of customers place most orders and
+write most reviews, and ratings are skewed towards five stars.
+
+Bulk inserts skip model signals, so afterwards the rating histograms of the
+reviewed products are rebuilt (api/ratings.py), the expiry
+engine runs once over the generated products to deactivate expired stock
+and apply markdowns, and the catalog cache is invalidated. Rows that were
+already there are left alone.
+
+Every generated user logs in with the published PASSWORD, so never run this
+against a production database; ``manage.py generate_data`` refuses to with
+DEBUG off unless given ``--allow-production``.
+"""
+import datetime
+import itertools
+import math
+import random
+import time
+from array import array
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from .catalog_cache import invalidate_categories
+from .expiry import STEPS as EXPIRY_STEPS
+from .models import (
+    CartItem, Category, Order, OrderItem, Product, PromoCode, Retailer,
+    RetailerOrder, Review, User, Wishlist
+)
+from .ratings import recompute_ratings
+
+# Every generated user can log in with this password
+PASSWORD = 'synthetic-password'
+
+SCALES = {
+    'small': {
+        'users': 500, 'retailers': 20, 'categories': 12, 'products': 5000,
+        'carts': 200, 'wishlists': 200, 'orders': 1000, 'reviews': 5000, 'promo_codes': 50,
+    },
+    'medium': {
+        'users': 10000, 'retailers': 200, 'categories': 30, 'products': 100000,
+        'carts': 3000, 'wishlists': 3000, 'orders': 20000, 'reviews': 100000, 'promo_codes': 500,
+    },
+    'large': {
+        'users': 200000, 'retailers': 2000, 'categories': 60, 'products': 1000000,
+        'carts': 30000, 'wishlists': 30000, 'orders': 300000, 'reviews': 1000000, 'promo_codes': 2000,
+    },
+}
+
+CATEGORY_NAMES = [
+    'Bakery', 'Dairy', 'Fruit', 'Vegetables', 'Meat', 'Fish', 'Ready Meals',
+    'Deli', 'Frozen', 'Pantry', 'Drinks', 'Snacks', 'Desserts', 'Plant Based',
+    'Baby Food', 'Breakfast', 'Sandwiches', 'Salads', 'Cheese', 'Flowers',
+]
+PRODUCT_WORDS = [
+    'sourdough loaf', 'croissants', 'greek yogurt', 'cheddar', 'baby spinach',
+    'gala apples', 'bananas', 'salmon fillets', 'chicken thighs', 'hummus',
+    'oat milk', 'strawberries', 'blueberries', 'lasagne', 'sushi box',
+    'orange juice', 'tofu', 'mushrooms', 'avocados', 'bagels', 'brownies',
+    'caesar salad', 'falafel wrap', 'tomatoes', 'mozzarella', 'granola',
+]
+ADJECTIVES = [
+    'organic', 'fresh', 'ripe', 'wholegrain', 'free range', 'seasonal', 'local',
+    'smoked', 'artisan', 'vegan', 'family size', 'reduced fat', 'hand made',
+]
+ORDER_STATUSES = ['delivered'] * 60 + ['shipped'] * 15 + ['processing'] * 10 + ['pending'] * 10 + ['cancelled'] * 5
+# J-shaped, as review ratings usually are
+RATING_WEIGHTS = [13, 6, 9, 24, 48]
+REVIEW_COMMENTS = [
+    'Great value, still perfectly fresh.', 'Good but close to the date.',
+    'Exactly as described.', 'Would buy again.', 'Packaging was damaged.',
+    'Not as fresh as I hoped.', 'Fantastic discount!', 'Okay for the price.',
+]
+
+
+def zipf_weights(count, exponent=1.1):
+    """Cumulative weights for ``random.choices`` where rank r has weight 1/r**exponent."""
+    return list(itertools.accumulate(1 / rank ** exponent for rank in range(1, count + 1)))
+
+
+def expiry_offset(rng):
+    """Days until expiry for a surplus product; mostly within the week, some already expired."""
+    roll = rng.random()
+    if roll < 0.08:
+        return -rng.randint(1, 10)
+    if roll < 0.30:
+        return rng.randint(0, 3)
+    if roll < 0.60:
+        return rng.randint(4, 7)
+    return 8 + min(int(rng.expovariate(1 / 20)), 180)
+
+
+def prices(rng, days_left):
+    """``(price, original_price)``; the closer to expiry, the deeper the discount."""
+    original = min(max(math.exp(rng.gauss(math.log(6), 0.8)), 0.5), 500)
+    discount = rng.uniform(0.4, 0.8) if days_left <= 3 else rng.uniform(0.15, 0.5) if days_left <= 7 else rng.uniform(0, 0.3)
+    original_price = Decimal(f'{original:.2f}')
+    return Decimal(f'{original * (1 - discount):.2f}'), original_price
+
+
+def _new_ids(model, after, fields=('id',)):
+    """Compact arrays of ``fields`` for the rows of ``model`` inserted after id ``after``."""
+    columns = [array('q') for _ in fields]
+    for row in model.objects.filter(id__gt=after).order_by('id').values_list(*fields).iterator(chunk_size=10000):
+        for column, value in zip(columns, row):
+            column.append(value)
+    return columns
+
+
+def _catalog():
+    """Id, price in cents and retailer of every product, as compact arrays."""
+    ids, cents, retailers = array('q'), array('q'), array('q')
+    for pk, price, retailer_id in Product.objects.order_by('id').values_list('id', 'price', 'retailer_id').iterator(chunk_size=10000):
+        ids.append(pk)
+        cents.append(int(price * 100))
+        retailers.append(retailer_id)
+    return ids, cents, retailers
+
+
+def _last_id(model):
+    return model.objects.aggregate(last=Max('id'))['last'] or 0
+
+
+def _insert(model, objects, batch_size):
+    """Bulk insert an iterable of unsaved instances ``batch_size`` at a time; returns the row count."""
+    total = 0
+    while batch := list(itertools.islice(objects, batch_size)):
+        with transaction.atomic():
+            model.objects.bulk_create(batch)
+        total += len(batch)
+    return total
+
+
+def generate_dataset(users=0, retailers=0, categories=0, products=0, carts=0, wishlists=0,
+                     orders=0, reviews=0, promo_codes=0, seed=0, batch_size=5000, log=None):
+    """
+    Add the given number of each kind of row and return ``{kind: (rows, seconds)}``.
+
+    ``carts`` and ``wishlists`` count users given a cart or wishlist of a few
+    products; the other arguments count rows. Carts, wishlists, orders and
+    reviews belong to the users generated in this call and may reference any
+    product. Rows are added to whatever is already there, so it can be
+    called again to grow a dataset.
+    """
+    rng = random.Random(seed)
+    today = timezone.localdate()
+    now = timezone.now()
+    timings = {}
+
+    def step(kind, func):
+        started = time.perf_counter()
+        rows = func()
+        timings[kind] = (rows, time.perf_counter() - started)
+        if log:
+            seconds = timings[kind][1]
+            log(f'{kind:<14} {rows:>9} rows in {seconds:7.2f}s ({rows / seconds if seconds else 0:,.0f} rows/s)')
+
+    # Hashing once keeps this fast; retailers are users too
+    password = make_password(PASSWORD)
+
+    def make_users(start, count, user_type):
+        for i in range(start, start + count):
+            yield User(
+                username=f'{user_type}-{i}', email=f'{user_type}-{i}@example.com',
+                first_name=rng.choice(['Alex', 'Sam', 'Jo', 'Priya', 'Chen', 'Maria', 'Tom', 'Aisha']),
+                password=password, user_type=user_type,
+            )
+
+    last_user = _last_id(User)
+    step('users', lambda: _insert(User, make_users(User.objects.count(), users, 'consumer'), batch_size))
+    (user_ids,) = _new_ids(User, last_user)
+
+    def add_retailers():
+        last_user = _last_id(User)
+        _insert(User, make_users(User.objects.count(), retailers, 'retailer'), batch_size)
+        return _insert(Retailer, (
+            Retailer(
+                user_id=user_id, company_name=f'Surplus Shop {user_id}', company_address=f'{user_id} Market Street',
+                business_license=f'LIC-{user_id}', approved=True,
+            )
+            for user_id in _new_ids(User, last_user)[0]
+        ), batch_size)
+
+    step('retailers', add_retailers)
+    retailer_ids = list(Retailer.objects.order_by('id').values_list('id', flat=True))
+
+    first_category = Category.objects.count()
+
+    def make_categories():
+        for i in range(first_category, first_category + categories):
+            name = CATEGORY_NAMES[i % len(CATEGORY_NAMES)]
+            if i >= len(CATEGORY_NAMES):
+                name = f'{name} {i // len(CATEGORY_NAMES) + 1}'
+            yield Category(name=name, slug=f'synthetic-{i}', description=f'{name} close to its date')
+
+    step('categories', lambda: _insert(Category, make_categories(), batch_size))
+    category_ids = list(Category.objects.order_by('id').values_list('id', flat=True))
+
+    first_product = _last_id(Product)
+
+    def make_products():
+        if not (retailer_ids and category_ids):
+            return
+        retailer_weights = zipf_weights(len(retailer_ids))
+        category_weights = zipf_weights(len(category_ids), exponent=0.8)
+        for i in range(products):
+            days_left = expiry_offset(rng)
+            price, original_price = prices(rng, days_left)
+            word = rng.choice(PRODUCT_WORDS)
+            adjective = rng.choice(ADJECTIVES)
+            stock = 0 if rng.random() < 0.1 else 1 + int(rng.expovariate(1 / 25))
+            yield Product(
+                name=f'{adjective.title()} {word}',
+                slug=f'synthetic-{first_product + i}',
+                description=f'Surplus {adjective} {word}, best before {today + datetime.timedelta(days=days_left)}.',
+                price=price,
+                original_price=original_price,
+                expiry_date=today + datetime.timedelta(days=days_left),
+                category_id=rng.choices(category_ids, cum_weights=category_weights)[0],
+                retailer_id=rng.choices(retailer_ids, cum_weights=retailer_weights)[0],
+                stock=stock,
+                is_featured=rng.random() < 0.03,
+            )
+
+    step('products', lambda: _insert(Product, make_products(), batch_size))
+
+    product_ids, product_cents, product_retailers = _catalog()
+    # Popularity ranks in random order, so best sellers aren't just the oldest rows
+    popularity = array('q', range(len(product_ids)))
+    rng.shuffle(popularity)
+    product_weights = zipf_weights(len(product_ids), exponent=0.9)
+    user_weights = zipf_weights(len(user_ids), exponent=0.9)
+
+    def pick_product():
+        return rng.choices(popularity, cum_weights=product_weights)[0]
+
+    def pick_products(count):
+        """Indexes of up to ``count`` distinct products, popular ones more often."""
+        return sorted({pick_product() for _ in range(count)})
+
+    def make_cart_items():
+        for user_id in rng.sample(list(user_ids), min(carts, len(user_ids))) if product_ids else ():
+            for index in pick_products(rng.randint(1, 8)):
+                yield CartItem(user_id=user_id, product_id=product_ids[index], quantity=rng.randint(1, 3))
+
+    step('cart_items', lambda: _insert(CartItem, make_cart_items(), batch_size))
+
+    def make_wishlists():
+        for user_id in rng.sample(list(user_ids), min(wishlists, len(user_ids))) if product_ids else ():
+            for index in pick_products(rng.randint(1, 10)):
+                yield Wishlist(user_id=user_id, product_id=product_ids[index])
+
+    step('wishlists', lambda: _insert(Wishlist, make_wishlists(), batch_size))
+
+    def add_orders():
+        if not (product_ids and user_ids):
+            return 0
+        first_order = Order.objects.count()
+        total = 0
+        while total < orders:
+            count = min(batch_size, orders - total)
+            batch, lines = [], []
+            for i in range(first_order + total, first_order + total + count):
+                items = [(index, rng.randint(1, 3)) for index in pick_products(rng.randint(1, 6))]
+                subtotal = Decimal(sum(product_cents[index] * quantity for index, quantity in items)) / 100
+                shipping_cost = Decimal('0.00') if subtotal >= 30 else Decimal('4.99')
+                batch.append(Order(
+                    user_id=rng.choices(user_ids, cum_weights=user_weights)[0],
+                    order_number=f'ORD-S{i:010d}',
+                    status=rng.choice(ORDER_STATUSES),
+                    shipping_address=f'{rng.randint(1, 999)} High Street',
+                    shipping_cost=shipping_cost,
+                    subtotal=subtotal,
+                    total=subtotal + shipping_cost,
+                ))
+                lines.append(items)
+            last_order = _last_id(Order)
+            with transaction.atomic():
+                Order.objects.bulk_create(batch)
+                (order_ids,) = _new_ids(Order, last_order)
+                OrderItem.objects.bulk_create(
+                    OrderItem(
+                        order_id=order_id, product_id=product_ids[index],
+                        price=Decimal(product_cents[index]) / 100, quantity=quantity,
+                    )
+                    for order_id, items in zip(order_ids, lines) for index, quantity in items
+                )
+                RetailerOrder.objects.bulk_create(
+                    RetailerOrder(retailer_id=retailer_id, order_id=order_id, created_at=order.created_at)
+                    for order_id, order, items in zip(order_ids, batch, lines)
+                    for retailer_id in {product_retailers[index] for index, _ in items}
+                )
+            total += count
+        return total
+
+    step('orders', add_orders)
+
+    def make_reviews():
+        if not (product_ids and user_ids):
+            return
+        for _ in range(reviews):
+            yield Review(
+                product_id=product_ids[pick_product()],
+                user_id=rng.choices(user_ids, cum_weights=user_weights)[0],
+                rating=rng.choices(range(1, 6), weights=RATING_WEIGHTS)[0],
+                comment=rng.choice(REVIEW_COMMENTS),
+            )
+
+    last_review = _last_id(Review)
+    step('reviews', lambda: _insert(Review, make_reviews(), batch_size))
+
+    first_code = PromoCode.objects.count()
+
+    def make_promo_codes():
+        for i in range(first_code, first_code + promo_codes):
+            percentage = rng.random() < 0.7
+            starts = now - datetime.timedelta(days=rng.randint(0, 60))
+            # One in five has already ended
+            ends = now - datetime.timedelta(days=rng.randint(1, 30)) if rng.random() < 0.2 else now + datetime.timedelta(days=rng.randint(1, 90))
+            yield PromoCode(
+                code=f'SAVE{i:06d}',
+                discount_percentage=rng.choice([5, 10, 15, 20, 25, 30]) if percentage else 0,
+                discount_amount=Decimal(rng.choice([1, 2, 5, 10, 20])) if not percentage else Decimal('0'),
+                minimum_order_value=Decimal(rng.choice([0, 0, 10, 20, 50])),
+                valid_from=starts,
+                valid_to=ends,
+                is_active=rng.random() < 0.9,
+            )
+
+    step('promo_codes', lambda: _insert(PromoCode, make_promo_codes(), batch_size))
+
+    started = time.perf_counter()
+    reviewed = Review.objects.filter(id__gt=last_review).values('product_id')
+    derived = recompute_ratings(Product.objects.filter(id__in=reviewed), batch_size)
+    new_products = Product.objects.filter(id__gt=first_product)
+    for _, expiry_step in EXPIRY_STEPS:
+        expiry_step(today, batch_size, products=new_products)
+    # recompute_ratings() and the expiry engine have invalidated the products
+    invalidate_categories()
+    timings['derived'] = (derived + new_products.count(), time.perf_counter() - started)
+    if log:
+        log(f"{'derived':<14} ratings, expiry markdowns and caches in {timings['derived'][1]:.2f}s")
+    return timings
@@ -1,3 +1,1662 @@
-from django.test import TestCase
+import base64
+import datetime
+import gzip
+import io
+import json
+import os
+import runpy
+import tempfile
+import time
+import warnings
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.core.paginator import UnorderedObjectListWarning
+from django.db import DatabaseError, connection
+from django.db.migrations.executor import MigrationExecutor
+from django.db.models import F
+from django.http import HttpResponse, StreamingHttpResponse
+from django.test import AsyncRequestFactory, RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework import serializers
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+
+from . import async_views, product_io
+from .authentication import token_cache_key
+from .benchmarks import seed_catalog
+from .blobs import get_blob_store
+from .cart import get_cart_summary
+from .catalog_cache import get_stats, reset_stats
+from .compression import CompressionMiddleware, choose_encoding
+from .db import PrimaryReplicaRouter, replica_reads
+from .discounts import PROMO_CACHE_MAX_AGE, active_promos, calculate_discount, get_active_promo, invalidate_promo_cache
+from .expiry import STEPS, apply_markdowns, deactivate_expired, restore_prices
+from .images import RENDITIONS
+from .management.commands import check_query_counts, check_query_plans
+from .metrics import get_metrics, reset_metrics
+from .models import BinaryFile, CartItem, Category, ExpiringToken, ExpiryBucket, Order, OrderItem, Product, PromoCode, Retailer, Review, User
+from .renderers import FastJSONRenderer
+from .synthetic import generate_dataset
+
+
+def clear_caches():
+    for cache in caches.all():
+        cache.clear()
+
+
+class QueryPlanTests(TestCase):
+    """Every filter/sort combination of the product listing uses an index."""
+
+    @classmethod
+    def setUpTestData(cls):
+        seed_catalog(3000)
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def test_product_listing_uses_indexes(self):
+        if connection.vendor not in check_query_plans.FULL_SCAN_MARKERS:
+            self.skipTest(f'No plan checks defined for the {connection.vendor} backend')
+        plans = [(params, check_query_plans.explain(params)) for params in check_query_plans.query_params()]
+        failures = check_query_plans.full_scans(plans)
+        self.assertEqual([params for params, plan in failures], [])
+
+
+@override_settings(CATALOG_CACHE_ENABLED=False)
+class QueryCountTests(TestCase):
+    """The budgets pinned in check_query_counts, with one row and with a full page."""
+
+    def setUp(self):
+        clear_caches()
+        self.enterContext(warnings.catch_warnings())
+        warnings.simplefilter('ignore', UnorderedObjectListWarning)
+
+    def assert_budgets(self, rows):
+        fixtures = check_query_counts.seed(rows)
+        for name, who, url, budget in check_query_counts.ENDPOINTS:
+            with self.subTest(endpoint=name):
+                response, queries = check_query_counts.request_endpoint(fixtures, who, url)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(queries, budget)
+
+    def test_one_row(self):
+        self.assert_budgets(1)
+
+    def test_full_page(self):
+        self.assert_budgets(12)
+
+
+class ConditionalGetTests(TestCase):
+    """Lists validate with their ETag only; details also carry Last-Modified."""
+
+    @classmethod
+    def setUpTestData(cls):
+        seed_catalog(3, categories=1, retailers=1)
+        cls.product = Product.objects.order_by('id').first()
+
+    def setUp(self):
+        clear_caches()
+        self.client = APIClient()
+
+    def test_list_has_no_last_modified(self):
+        response = self.client.get('/api/products/')
+        self.assertTrue(response.has_header('ETag'))
+        self.assertFalse(response.has_header('Last-Modified'))
+
+    def test_detail_has_last_modified(self):
+        response = self.client.get(f'/api/products/{self.product.pk}/')
+        self.assertTrue(response.has_header('Last-Modified'))
+        response = self.client.get(
+            f'/api/products/{self.product.pk}/', HTTP_IF_MODIFIED_SINCE=response['Last-Modified'],
+        )
+        self.assertEqual(response.status_code, 304)
+
+    def test_list_changes_when_a_row_leaves_it(self):
+        etag = self.client.get('/api/products/')['ETag']
+        self.assertEqual(self.client.get('/api/products/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        # Deactivating the newest product leaves the latest updated_at unchanged
+        newest = Product.objects.order_by('-updated_at').values_list('updated_at', flat=True).first()
+        Product.objects.filter(pk=self.product.pk).update(is_active=False, updated_at=newest)
+        clear_caches()
+        response = self.client.get('/api/products/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['results']), 2)
+
+
+@override_settings(CATALOG_CACHE_ENABLED=False)
+class DiscountPercentageTests(TestCase):
+    """The stored discount_percentage matches what the model used to compute in Python."""
+
+    # (price, original_price)
+    PRICES = [
+        ('5.00', '10.00'), ('6.67', '10.00'), ('3.33', '9.99'), ('10.00', '10.00'), ('12.00', '10.00'),
+        ('10.01', '10.00'), ('0.00', '10.00'), ('5.00', '0.00'), ('0.01', '0.03'),
+    ]
+
+    @classmethod
+    def setUpTestData(cls):
+        seed_catalog(len(cls.PRICES), categories=1, retailers=1)
+        for product, (price, original_price) in zip(Product.objects.order_by('id'), cls.PRICES):
+            Product.objects.filter(pk=product.pk).update(price=Decimal(price), original_price=Decimal(original_price))
+
+    @staticmethod
+    def python_discount(price, original_price):
+        if original_price == 0:
+            return 0
+        return int(((original_price - price) / original_price) * 100)
+
+    def test_matches_python(self):
+        for product in Product.objects.order_by('id'):
+            with self.subTest(price=product.price, original_price=product.original_price):
+                self.assertEqual(product.discount_percentage, self.python_discount(product.price, product.original_price))
+
+    def test_sort_by_discount(self):
+        products = Product.objects.all()
+        expected = [
+            product.pk for product in sorted(
+                products, key=lambda product: (-self.python_discount(product.price, product.original_price), -product.pk),
+            )
+        ]
+        response = APIClient().get('/api/products/', {'sort_by': 'discount'})
+        self.assertEqual([product['id'] for product in response.json()['results']], expected)
+
+
+@override_settings(CATALOG_CACHE_ENABLED=False)
+class SearchTests(TestCase):
+    """Product search matches word prefixes, ranks by relevance and stays in sync with writes."""
+
+    @classmethod
+    def setUpTestData(cls):
+        seed_catalog(4, categories=2, retailers=1)
+        cls.ripe, cls.soup, cls.loaf, cls.bananas = Product.objects.order_by('id')
+        for product, name, description, price in (
+            (cls.ripe, 'Ripe tomatoes', 'Tomatoes on the vine, tomatoes for salads, tomatoes for sauce', '2.00'),
+            (cls.soup, 'Tomato soup', 'A carton of soup', '3.00'),
+            (cls.loaf, 'Sourdough loaf', 'Baked this morning, goes well with tomatoes and cheese and butter', '4.00'),
+            (cls.bananas, 'Bananas', 'A bunch of yellow bananas', '1.00'),
+        ):
+            Product.objects.filter(pk=product.pk).update(name=name, description=description, price=Decimal(price))
+
+    def setUp(self):
+        if connection.vendor not in ('sqlite', 'postgresql'):
+            self.skipTest('No full-text index on this backend')
+
+    def search(self, **params):
+        response = APIClient().get('/api/products/', params)
+        self.assertEqual(response.status_code, 200)
+        return [product['id'] for product in response.json()['results']]
+
+    def test_prefix_matching(self):
+        self.assertCountEqual(self.search(search='tom'), [self.ripe.pk, self.soup.pk, self.loaf.pk])
+        self.assertEqual(self.search(search='toma CART'), [self.soup.pk])
+        self.assertEqual(self.search(search='tomatoesque'), [])
+
+    def test_ranked_by_relevance(self):
+        self.assertEqual(self.search(search='tomatoes'), [self.ripe.pk, self.loaf.pk])
+
+    def test_explicit_sort_overrides_rank(self):
+        self.assertEqual(self.search(search='tomatoes', sort_by='price_desc'), [self.loaf.pk, self.ripe.pk])
+
+    def test_with_category_and_price_filters(self):
+        # The tomatoes and the loaf share a category
+        category = Product.objects.get(pk=self.loaf.pk).category
+        self.assertEqual(Product.objects.get(pk=self.ripe.pk).category, category)
+        self.assertEqual(self.search(search='tom', category=category.slug, min_price='3.00'), [self.loaf.pk])
+        self.assertEqual(self.search(search='tom', category=category.slug, max_price='0.50'), [])
+
+    def test_cursor_pagination(self):
+        # search_rank comes from extra(select=...); it must stay out of the
+        # values() rows, where count() read it as the COUNT(*)
+        client = APIClient()
+        for text, expected in (('tom', 3), ('tomatoes', 2), ('zzz', 0)):
+            with self.subTest(search=text):
+                pages = client.get('/api/products/', {'search': text}).json()
+                response = client.get('/api/products/', {'search': text, 'pagination': 'cursor'})
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.json()['count'], expected)
+                self.assertEqual(response.json()['results'], pages['results'])
+
+    def test_index_follows_save_update_and_delete(self):
+        bananas = Product.objects.get(pk=self.bananas.pk)
+        bananas.name = 'Plantains'
+        bananas.description = 'Green plantains for frying'
+        bananas.save()
+        self.assertEqual(self.search(search='plantain'), [bananas.pk])
+        self.assertEqual(self.search(search='bananas'), [])
+
+        Product.objects.filter(pk=bananas.pk).update(description='Green plantains, or cooking bananas')
+        self.assertEqual(self.search(search='cooking'), [bananas.pk])
+
+        Product.objects.filter(pk=self.soup.pk).delete()
+        self.assertCountEqual(self.search(search='tom'), [self.ripe.pk, self.loaf.pk])
+
+        bananas.pk = None
+        bananas.slug = 'more-plantains'
+        bananas.save()
+        self.assertCountEqual(self.search(search='plantains'), [self.bananas.pk, bananas.pk])
+
+
+@override_settings(CATALOG_CACHE_ENABLED=False)
+class CatalogPaginationTests(TestCase):
+    """Cursor pages and count-free pages list the same rows as page numbers."""
+
+    SORTS = ['', 'newest', 'price_asc', 'price_desc', 'discount', 'rating']
+
+    @classmethod
+    def setUpTestData(cls):
+        seed_catalog(35, categories=3, retailers=2)
+        # Ties on every sort key, so the id tie-break is exercised
+        Product.objects.filter(id__in=Product.objects.order_by('id').values('id')[:10]).update(
+            price=Decimal('5.00'), original_price=Decimal('10.00'), rating_5_count=1,
+        )
+
+    def setUp(self):
+        self.client = APIClient()
+        self.enterContext(warnings.catch_warnings())
+        warnings.simplefilter('ignore', UnorderedObjectListWarning)
+
+    def walk(self, url, params):
+        ids, pages = [], 0
+        response = self.client.get(url, params)
+        while True:
+            self.assertEqual(response.status_code, 200)
+            data = response.json()
+            ids += [product['id'] for product in data['results']]
+            pages += 1
+            if not data['next']:
+                return ids, pages
+            response = self.client.get(data['next'])
+
+    def test_cursor_walk_matches_page_numbers(self):
+        for sort_by in self.SORTS:
+            for category in ('', 'category-1'):
+                params = {'sort_by': sort_by, 'category': category}
+                with self.subTest(**params):
+                    expected, _ = self.walk('/api/products/', params)
+                    ids, pages = self.walk('/api/products/', {**params, 'pagination': 'cursor'})
+                    self.assertEqual(ids, expected)
+                    self.assertGreater(pages, 1)
+
+    def test_cursor_page_has_count_and_no_previous(self):
+        data = self.client.get('/api/products/', {'pagination': 'cursor'}).json()
+        self.assertEqual(data['count'], 35)
+        self.assertIsNone(data['previous'])
+        self.assertIn('cursor=', data['next'])
+        data = self.client.get('/api/products/', {'pagination': 'cursor', 'count': 'false'}).json()
+        self.assertNotIn('count', data)
+
+    def test_count_false(self):
+        for sort_by in self.SORTS:
+            with self.subTest(sort_by=sort_by):
+                expected, _ = self.walk('/api/products/', {'sort_by': sort_by})
+                ids, pages = self.walk('/api/products/', {'sort_by': sort_by, 'count': 'false'})
+                self.assertEqual(ids, expected)
+                self.assertEqual(pages, 4)
+        data = self.client.get('/api/products/', {'count': 'false', 'page': 2}).json()
+        self.assertNotIn('count', data)
+        self.assertEqual(data['previous'], 'http://testserver/api/products/?count=false')
+        self.assertEqual(self.client.get('/api/products/', {'count': 'false', 'page': 0}).status_code, 404)
+
+    def test_invalid_cursors(self):
+        def encode(payload):
+            return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+        cursors = {
+            'not base64': '!!!',
+            'not json': encode('{nope'),
+            'not a list': encode('{"price": 1}'),
+            'wrong length': encode('[1]'),
+            'wrong types': encode('["cheap", "first"]'),
+        }
+        for name, cursor in cursors.items():
+            with self.subTest(name):
+                response = self.client.get('/api/products/', {'sort_by': 'price_asc', 'cursor': cursor})
+                self.assertEqual(response.status_code, 404)
+                self.assertEqual(response.json(), {'detail': 'Invalid cursor.'})
+
+    def test_tampered_cursor_only_moves_the_position(self):
+        # A cursor is a position, not a capability: editing it seeks elsewhere
+        cursor = base64.urlsafe_b64encode(b'["0.00",0]').decode().rstrip('=')
+        response = self.client.get('/api/products/', {'sort_by': 'price_asc', 'cursor': cursor})
+        first = self.client.get('/api/products/', {'sort_by': 'price_asc'}).json()['results']
+        self.assertEqual(response.json()['results'], first)
+
+    def test_unkeyed_ordering_falls_back_to_page_numbers(self):
+        # A ranked search orders by an extra() column, which can't be a key
+        if connection.vendor not in ('sqlite', 'postgresql'):
+            self.skipTest('No full-text index on this backend')
+        Product.objects.filter(id__in=Product.objects.order_by('id').values('id')[:15]).update(name='Quince')
+        data = self.client.get('/api/products/', {'search': 'quince', 'pagination': 'cursor'}).json()
+        self.assertEqual(data['count'], 15)
+        self.assertIn('page=2', data['next'])
+        self.assertNotIn('cursor=', data['next'])
+        ids, _ = self.walk('/api/products/', {'search': 'quince', 'pagination': 'cursor'})
+        self.assertEqual(sorted(ids), sorted(Product.objects.filter(name='Quince').values_list('id', flat=True)))
+
+
+class CatalogCacheTests(TestCase):
+    """Cached catalog pages are served until a product, category or retailer write replaces them."""
+
+    @classmethod
+    def setUpTestData(cls):
+        seed_catalog(3, categories=1, retailers=1)
+        cls.product = Product.objects.order_by('id').first()
+        cls.admin = User.objects.create_user(username='admin', is_staff=True)
+
+    def setUp(self):
+        clear_caches()
+        reset_stats()
+        self.client = APIClient()
+        self.detail_url = f'/api/products/{self.product.pk}/'
+
+    def test_pages_are_served_from_the_cache(self):
+        self.client.get('/api/products/')
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get('/api/products/').status_code, 200)
+
+    def test_product_write_replaces_cached_pages(self):
+        self.client.get('/api/products/')
+        self.client.get(self.detail_url)
+        Product.objects.filter(pk=self.product.pk).update(name='Renamed')
+        # update() sends no signal, so the cached pages stay
+        self.assertNotEqual(self.client.get(self.detail_url).json()['name'], 'Renamed')
+        self.product.refresh_from_db()
+        self.product.save()
+        self.assertEqual(self.client.get(self.detail_url).json()['name'], 'Renamed')
+        names = [row['name'] for row in self.client.get('/api/products/').json()['results']]
+        self.assertIn('Renamed', names)
+
+    def test_category_write_replaces_cached_pages(self):
+        self.client.get('/api/products/')
+        self.client.get(self.detail_url)
+        self.client.get(f'/api/categories/{self.product.category_id}/')
+        category = self.product.category
+        category.name = 'Greens'
+        category.save()
+        self.assertEqual(self.client.get(self.detail_url).json()['category_name'], 'Greens')
+        self.assertEqual({row['category_name'] for row in self.client.get('/api/products/').json()['results']}, {'Greens'})
+        self.assertEqual(self.client.get(f'/api/categories/{self.product.category_id}/').json()['name'], 'Greens')
+
+    def test_retailer_write_replaces_cached_pages(self):
+        self.client.get(self.detail_url)
+        retailer = self.product.retailer
+        retailer.company_name = 'Greengrocer'
+        retailer.save()
+        self.assertEqual(self.client.get(self.detail_url).json()['retailer_name'], 'Greengrocer')
+
+    def test_category_write_moves_product_validators_without_touching_products(self):
+        response = self.client.get(self.detail_url)
+        etag, last_modified = response['ETag'], response['Last-Modified']
+        list_etag = self.client.get('/api/products/')['ETag']
+        updated_at = list(Product.objects.values_list('updated_at', flat=True))
+        category = self.product.category
+        category.name = 'Greens'
+        # Category.updated_at has second precision in Last-Modified
+        with mock.patch('django.utils.timezone.now', return_value=timezone.now() + datetime.timedelta(seconds=2)):
+            category.save()
+        self.assertEqual(list(Product.objects.values_list('updated_at', flat=True)), updated_at)
+        self.assertEqual(self.client.get(self.detail_url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+        self.assertEqual(self.client.get(self.detail_url, HTTP_IF_MODIFIED_SINCE=last_modified).status_code, 200)
+        self.assertEqual(self.client.get('/api/products/', HTTP_IF_NONE_MATCH=list_etag).status_code, 200)
+
+    def test_stats_count_hits_and_misses(self):
+        self.client.get('/api/products/')
+        self.client.get('/api/products/')
+        self.client.get('/api/products/')
+        self.client.get(self.detail_url)
+        self.client.force_authenticate(self.admin)
+        stats = self.client.get('/api/catalog-cache/stats/').json()
+        self.assertEqual(stats['product-list'], {'hits': 2, 'misses': 1, 'hit_ratio': 2 / 3})
+        self.assertEqual(stats['product-retrieve'], {'hits': 0, 'misses': 1, 'hit_ratio': 0.0})
+
+    @override_settings(CATALOG_CACHE_ENABLED=False)
+    def test_disabled_cache_records_nothing(self):
+        self.client.get('/api/products/')
+        self.assertEqual(get_stats(), {})
+
+
+class ExpiryEngineTests(TestCase):
+    """The expiry engine deactivates, marks down and restores products, and running it twice changes nothing."""
+
+    @classmethod
+    def setUpTestData(cls):
+        seed_catalog(0, categories=1, retailers=1)
+        cls.today = timezone.localdate()
+
+    def setUp(self):
+        clear_caches()
+
+    def make(self, days_left, price='10.00'):
+        return Product.objects.create(
+            name=f'Expires in {days_left}', slug=f'expires-in-{days_left}', description='Surplus',
+            price=Decimal(price), original_price=Decimal('20.00'),
+            expiry_date=self.today + datetime.timedelta(days=days_left),
+            category=Category.objects.get(), retailer=Retailer.objects.get(),
+        )
+
+    def run_engine(self, today=None):
+        today = today or self.today
+        return {label: step(today, 1) for label, step in STEPS}
+
+    def assertProduct(self, product, price, bucket):
+        product.refresh_from_db()
+        self.assertEqual((product.price, product.expiry_bucket), (Decimal(price), bucket))
+
+    def test_deactivates_expired_products(self):
+        expired, last_day = self.make(-1), self.make(0)
+        self.assertEqual(deactivate_expired(self.today, 1), 1)
+        expired.refresh_from_db()
+        last_day.refresh_from_db()
+        self.assertFalse(expired.is_active)
+        self.assertTrue(last_day.is_active)
+        self.assertEqual(deactivate_expired(self.today, 1), 0)
+
+    def test_marks_down_by_bucket(self):
+        products = {days: self.make(days) for days in [0, 2, 3, 6, 7, 10]}
+        self.assertEqual(apply_markdowns(self.today, 1), 5)
+        self.assertProduct(products[0], '5.00', ExpiryBucket.TODAY)
+        self.assertProduct(products[2], '7.00', ExpiryBucket.THREE_DAYS)
+        self.assertProduct(products[3], '7.00', ExpiryBucket.THREE_DAYS)
+        self.assertProduct(products[6], '8.50', ExpiryBucket.SEVEN_DAYS)
+        self.assertProduct(products[7], '8.50', ExpiryBucket.SEVEN_DAYS)
+        self.assertProduct(products[10], '10.00', None)
+
+    def test_second_run_changes_nothing(self):
+        for days in [-1, 0, 2, 6, 10]:
+            self.make(days, price='9.99')
+        self.assertEqual(self.run_engine(), {'deactivated': 1, 'marked down': 3, 'restored': 0})
+        prices = list(Product.objects.order_by('id').values_list('price', 'expiry_bucket', 'updated_at'))
+        self.assertEqual(self.run_engine(), {'deactivated': 0, 'marked down': 0, 'restored': 0})
+        self.assertEqual(list(Product.objects.order_by('id').values_list('price', 'expiry_bucket', 'updated_at')), prices)
+
+    def test_moving_bucket_marks_down_from_the_original_price(self):
+        product = self.make(6)
+        self.run_engine()
+        self.assertProduct(product, '8.50', ExpiryBucket.SEVEN_DAYS)
+        self.run_engine(self.today + datetime.timedelta(days=4))
+        self.assertProduct(product, '7.00', ExpiryBucket.THREE_DAYS)
+        self.run_engine(self.today + datetime.timedelta(days=6))
+        self.assertProduct(product, '5.00', ExpiryBucket.TODAY)
+        self.assertEqual(product.markdown_base_price, Decimal('10.00'))
+
+    def test_restores_prices_when_expiry_is_pushed_back(self):
+        marked_down, kept = self.make(2), self.make(5)
+        self.run_engine()
+        Product.objects.filter(pk=marked_down.pk).update(expiry_date=self.today + datetime.timedelta(days=30))
+        self.assertEqual(restore_prices(self.today, 1), 1)
+        self.assertProduct(marked_down, '10.00', None)
+        self.assertIsNone(marked_down.markdown_base_price)
+        self.assertProduct(kept, '8.50', ExpiryBucket.SEVEN_DAYS)
+        self.assertEqual(restore_prices(self.today, 1), 0)
+
+    def test_markdowns_replace_cached_pages(self):
+        product = self.make(0)
+        client = APIClient()
+        self.assertEqual(client.get(f'/api/products/{product.pk}/').json()['price'], '10.00')
+        self.run_engine()
+        self.assertEqual(client.get(f'/api/products/{product.pk}/').json()['price'], '5.00')
+
+    def test_expiring_soon_lists_buckets(self):
+        for days in [0, 2, 6, 10]:
+            self.make(days)
+        self.run_engine()
+        client = APIClient()
+        for value, expected in [('today', [0]), ('3', [0, 2]), ('7', [0, 2, 6]), ('true', [0, 2, 6])]:
+            with self.subTest(expiring_soon=value):
+                results = client.get('/api/products/', {'expiring_soon': value, 'sort_by': 'price_asc'}).json()['results']
+                self.assertEqual(sorted(row['slug'] for row in results), [f'expires-in-{days}' for days in expected])
+
+    def test_command_reports_each_step(self):
+        self.make(-1)
+        self.make(1)
+        out = io.StringIO()
+        call_command('run_expiry_engine', '--date', self.today.isoformat(), stdout=out)
+        self.assertIn('2 products updated', out.getvalue())
+        with self.assertRaises(CommandError):
+            call_command('run_expiry_engine', '--date', 'tomorrow')
+
+
+class DatabaseProfileTests(TestCase):
+    """DB_* variables pick the database profile, and catalog reads go to replicas unless this process just wrote."""
+
+    @classmethod
+    def setUpTestData(cls):
+        seed_catalog(1, categories=1, retailers=1)
+
+    def setUp(self):
+        clear_caches()
+        self.enterContext(mock.patch('api.db._last_write', float('-inf')))
+
+    def load_settings(self, **environ):
+        with mock.patch.dict(os.environ, environ):
+            return runpy.run_path(str(settings.BASE_DIR / 'backend' / 'settings.py'))
+
+    def test_sqlite_profile(self):
+        profile = self.load_settings(DB_ENGINE='sqlite', DB_REPLICA_HOSTS='replica')
+        self.assertEqual(list(profile['DATABASES']), ['default'])
+        self.assertEqual(profile['DATABASES']['default']['ENGINE'], 'django.db.backends.sqlite3')
+        self.assertEqual(profile['DATABASE_REPLICAS'], [])
+
+    def test_postgresql_profile_with_replicas(self):
+        profile = self.load_settings(
+            DB_ENGINE='postgresql', DB_HOST='primary', DB_REPLICA_HOSTS='replica-a, replica-b,', DB_POOLER='1',
+        )
+        databases = profile['DATABASES']
+        self.assertEqual(profile['DATABASE_REPLICAS'], ['replica_1', 'replica_2'])
+        self.assertEqual(databases['default']['HOST'], 'primary')
+        self.assertTrue(databases['default']['DISABLE_SERVER_SIDE_CURSORS'])
+        self.assertEqual(databases['replica_2']['HOST'], 'replica-b')
+        self.assertEqual(databases['replica_2']['TEST'], {'MIRROR': 'default'})
+        self.assertEqual(databases['replica_2']['NAME'], databases['default']['NAME'])
+
+    def test_sqlite_pragmas(self):
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA busy_timeout')
+            self.assertEqual(cursor.fetchone()[0], 5000)
+            cursor.execute('PRAGMA synchronous')
+            self.assertEqual(cursor.fetchone()[0], 1)
+
+    @override_settings(DATABASE_REPLICAS=['replica_1', 'replica_2'], DATABASE_REPLICA_LAG=2)
+    def test_router(self):
+        router = PrimaryReplicaRouter()
+        self.assertIsNone(router.db_for_read(Product))
+        with replica_reads():
+            self.assertIn(router.db_for_read(Product), ['replica_1', 'replica_2'])
+            self.assertIsNone(router.db_for_write(Product))
+            # Reads stay on the primary while replicas may lag behind the write
+            self.assertIsNone(router.db_for_read(Product))
+            with mock.patch('time.monotonic', return_value=time.monotonic() + 3):
+                self.assertIn(router.db_for_read(Product), ['replica_1', 'replica_2'])
+        self.assertIs(router.allow_migrate('replica_1', 'api'), False)
+        self.assertIsNone(router.allow_migrate('default', 'api'))
+
+    @override_settings(DATABASE_REPLICAS=['replica_1'], DATABASE_REPLICA_LAG=0)
+    def test_catalog_reads_use_a_replica(self):
+        client = APIClient()
+        client.force_authenticate(User.objects.create_user(username='shopper'))
+        product = Product.objects.get()
+        # The test database has no replica alias; record the choice instead
+        with mock.patch('api.db.random.choice', return_value='default') as choice:
+            self.assertEqual(client.get('/api/products/').status_code, 200)
+            self.assertTrue(choice.called)
+            choice.reset_mock()
+            client.get(f'/api/products/{product.pk}/')
+            self.assertTrue(choice.called)
+            choice.reset_mock()
+            client.get('/api/users/me/')
+            client.post('/api/cart-items/', {'product': product.pk, 'quantity': 1}, format='json')
+            self.assertFalse(choice.called)
+
+
+@override_settings(CATALOG_CACHE_ENABLED=False)
+class AsyncCatalogViewTests(TestCase):
+    """The async catalog views answer GET exactly like the viewsets and hand other methods to them."""
+
+    @classmethod
+    def setUpTestData(cls):
+        seed_catalog(12, categories=2, retailers=1)
+        cls.product = Product.objects.order_by('id').first()
+        cls.user = User.objects.create_user(username='shopper')
+        cls.token = ExpiringToken.objects.create(user=cls.user)
+        CartItem.objects.create(user=cls.user, product=cls.product, quantity=2)
+
+    def setUp(self):
+        clear_caches()
+        self.factory = AsyncRequestFactory()
+        self.enterContext(warnings.catch_warnings())
+        warnings.simplefilter('ignore', UnorderedObjectListWarning)
+
+    async def sync_get(self, path, headers=None):
+        client = APIClient()
+        return await sync_to_async(client.get)(path, headers=headers)
+
+    async def assertSameResponse(self, view, path, *args, headers=None):
+        expected = await self.sync_get(path, headers)
+        response = await view(self.factory.get(path, headers=headers), *args)
+        self.assertEqual(response.status_code, expected.status_code)
+        self.assertEqual(response.content, expected.content)
+        self.assertEqual(response.get('ETag'), expected.get('ETag'))
+        return response
+
+    async def test_responses_match_the_viewsets(self):
+        category = await Category.objects.afirst()
+        cases = [
+            (async_views.product_list, '/api/products/?sort_by=price_asc&page=2'),
+            (async_views.product_list, f'/api/products/?category={category.slug}&pagination=cursor'),
+            (async_views.category_list, '/api/categories/'),
+        ]
+        for view, path in cases:
+            with self.subTest(path=path):
+                await self.assertSameResponse(view, path)
+        with self.subTest(path='detail'):
+            await self.assertSameResponse(async_views.product_detail, f'/api/products/{self.product.pk}/', self.product.pk)
+        with self.subTest(path='missing'):
+            await self.assertSameResponse(async_views.product_detail, '/api/products/999999/', 999999)
+
+    async def test_cart_total(self):
+        auth = {'Authorization': f'Token {self.token.key}'}
+        response = await self.assertSameResponse(async_views.cart_total, '/api/cart-items/cart_total/', headers=auth)
+        self.assertEqual(response.status_code, 200)
+        response = await self.assertSameResponse(async_views.cart_total, '/api/cart-items/cart_total/')
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response['WWW-Authenticate'], 'Token')
+
+    async def test_invalid_token(self):
+        response = await self.assertSameResponse(
+            async_views.product_list, '/api/products/', headers={'Authorization': 'Token not-a-token'},
+        )
+        self.assertEqual(response.status_code, 401)
+
+    async def test_conditional_requests(self):
+        path = f'/api/products/{self.product.pk}/'
+        etag = (await self.sync_get(path))['ETag']
+        response = await async_views.product_detail(self.factory.get(path, headers={'If-None-Match': etag}), self.product.pk)
+        self.assertEqual(response.status_code, 304)
+
+    async def test_shares_the_viewsets_cache_entries(self):
+        reset_stats()
+        with self.settings(CATALOG_CACHE_ENABLED=True):
+            expected = await self.sync_get('/api/products/')
+            response = await async_views.product_list(self.factory.get('/api/products/'))
+        self.assertEqual(response.content, expected.content)
+        self.assertEqual(get_stats()['product-list'], {'hits': 1, 'misses': 1, 'hit_ratio': 0.5})
+
+    async def test_writes_go_to_the_viewset(self):
+        request = self.factory.post('/api/products/', {}, content_type='application/json')
+        response = await async_views.product_list(request)
+        self.assertEqual(response.status_code, 401)
+
+
+class FastJSONRendererTests(TestCase):
+    """FastJSONRenderer writes the same bytes as DRF's JSONRenderer, and refuses what it refuses."""
+
+    @classmethod
+    def setUpTestData(cls):
+        seed_catalog(12, categories=2, retailers=2)
+        cls.user = User.objects.create_user(username='shopper')
+        products = list(Product.objects.order_by('id')[:3])
+        for i in range(2):
+            order = Order.objects.create(
+                user=cls.user, order_number=f'ORD-{i}', shipping_address='1 Main St Flat 2',
+                shipping_cost=Decimal('5.00'), subtotal=Decimal('10.50'), total=Decimal('15.50'),
+            )
+            for product in products:
+                OrderItem.objects.create(order=order, product=product, price=product.price, quantity=i + 1)
+
+    def setUp(self):
+        clear_caches()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def assertSameJSON(self, data):
+        self.assertEqual(FastJSONRenderer().render(data), JSONRenderer().render(data))
+
+    def test_pages_render_like_json_renderer(self):
+        product = Product.objects.first()
+        order = Order.objects.first()
+        paths = [
+            '/api/products/', '/api/products/?sort_by=rating&pagination=cursor', '/api/products/?fields=id,name,price',
+            f'/api/products/{product.pk}/', '/api/orders/', f'/api/orders/{order.pk}/',
+        ]
+        for path in paths:
+            with self.subTest(path=path):
+                response = self.client.get(path)
+                self.assertEqual(response.status_code, 200)
+                self.assertSameJSON(response.data)
+
+    def test_values(self):
+        self.assertSameJSON({
+            'text': 'caf\u00e9 \u2028 \u2029 "quoted"', 'decimal': Decimal('1.10'), 'float': 0.1,
+            'date': datetime.date(2030, 1, 2), 'time': timezone.now(), 'none': None, 'nested': [{'a': (1, 2)}],
+            'big': 2 ** 70,
+        })
+
+    def test_non_finite_numbers_raise(self):
+        for value in [float('nan'), float('inf'), [None, -float('inf')], Decimal('NaN')]:
+            with self.subTest(value=value), self.assertRaises(ValueError):
+                FastJSONRenderer().render({'value': value, 'other': None})
+
+
+class CompressionTests(TestCase):
+    """Responses are compressed when the client accepts it and they are large enough to gain from it."""
+
+    def setUp(self):
+        self.enterContext(mock.patch('api.compression.brotli', None))
+        self.factory = RequestFactory()
+        self.body = b'{"results":[' + b','.join(b'{"id":%d,"name":"Tomato soup"}' % i for i in range(100)) + b']}'
+
+    def process(self, response, accept_encoding='gzip'):
+        request = self.factory.get('/api/products/', HTTP_ACCEPT_ENCODING=accept_encoding)
+        return CompressionMiddleware(lambda request: response).process_response(request, response)
+
+    def json_response(self, body=None, **headers):
+        return HttpResponse(self.body if body is None else body, content_type='application/json', headers=headers)
+
+    def test_compresses_large_json(self):
+        response = self.process(self.json_response())
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response['Vary'], 'Accept-Encoding')
+        self.assertEqual(gzip.decompress(response.content), self.body)
+        self.assertEqual(response['Content-Length'], str(len(response.content)))
+
+    def test_size_threshold(self):
+        with self.settings(COMPRESSION_MIN_SIZE=len(self.body) + 1):
+            response = self.process(self.json_response())
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEqual(response.content, self.body)
+        with self.settings(COMPRESSION_MIN_SIZE=len(self.body)):
+            self.assertEqual(self.process(self.json_response())['Content-Encoding'], 'gzip')
+
+    def test_q_values(self):
+        cases = {
+            'gzip': 'gzip',
+            'gzip;q=0': None,
+            'GZIP;q=0.5, identity': 'gzip',
+            '*': 'gzip',
+            '*;q=0': None,
+            '*, gzip;q=0': None,
+            'br, deflate': None,
+            'gzip;q=bad': None,
+            '': None,
+        }
+        for header, expected in cases.items():
+            with self.subTest(accept_encoding=header):
+                self.assertEqual(choose_encoding(header), expected)
+                response = self.process(self.json_response(), header)
+                self.assertEqual(response.get('Content-Encoding'), expected)
+                self.assertEqual(response['Vary'], 'Accept-Encoding')
+
+    def test_prefers_brotli_when_installed(self):
+        with mock.patch('api.compression.brotli', object()):
+            self.assertEqual(choose_encoding('gzip, br'), 'br')
+            self.assertEqual(choose_encoding('gzip, br;q=0.5'), 'gzip')
+
+    def test_leaves_other_responses_alone(self):
+        responses = {
+            'html': HttpResponse(self.body, content_type='text/html'),
+            'encoded': self.json_response(**{'Content-Encoding': 'br'}),
+            'ranged': self.json_response(**{'Content-Range': 'bytes 0-9/100'}),
+        }
+        for name, response in responses.items():
+            with self.subTest(name):
+                self.assertEqual(self.process(response).content, self.body)
+
+    def test_incompressible_body_is_sent_as_is(self):
+        body = os.urandom(4096)
+        response = self.process(HttpResponse(body, content_type='text/plain'))
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEqual(response.content, body)
+
+    def test_streaming_bodies(self):
+        chunks = [self.body[i:i + 100] for i in range(0, len(self.body), 100)]
+        response = StreamingHttpResponse(iter(chunks), content_type='text/csv', headers={'Content-Length': '9'})
+        response = self.process(response)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertFalse(response.has_header('Content-Length'))
+        self.assertEqual(gzip.decompress(b''.join(response.streaming_content)), self.body)
+
+    async def test_async_streaming_bodies(self):
+        async def chunks():
+            yield self.body[:500]
+            yield self.body[500:]
+
+        response = self.process(StreamingHttpResponse(chunks(), content_type='application/x-ndjson'))
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(b''.join([chunk async for chunk in response.streaming_content])), self.body)
+
+    def test_strong_etags_become_weak(self):
+        for etag, expected in [('"abc"', 'W/"abc"'), ('W/"abc"', 'W/"abc"')]:
+            with self.subTest(etag=etag):
+                self.assertEqual(self.process(self.json_response(ETag=etag))['ETag'], expected)
+        self.assertEqual(self.process(self.json_response(ETag='"abc"'), 'identity')['ETag'], '"abc"')
+
+    def test_api_responses(self):
+        seed_catalog(20, categories=1, retailers=1)
+        response = APIClient().get('/api/products/', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(json.loads(gzip.decompress(response.content))['count'], 20)
+
+
+class CheckoutTests(TestCase):
+    """POST /api/orders/ turns the cart into an order, all or nothing."""
+
+    @classmethod
+    def setUpTestData(cls):
+        seed_catalog(2, categories=1, retailers=1)
+        cls.apple, cls.pear = Product.objects.order_by('id')
+        Product.objects.update(stock=5)
+        cls.user = User.objects.create(username='shopper')
+
+    def setUp(self):
+        clear_caches()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        CartItem.objects.create(user=self.user, product=self.apple, quantity=2)
+        CartItem.objects.create(user=self.user, product=self.pear, quantity=3)
+
+    def checkout(self, **data):
+        return self.client.post('/api/orders/', {'shipping_address': '1 Test St', **data}, format='json')
+
+    def assert_nothing_changed(self):
+        self.assertEqual(dict(Product.objects.values_list('id', 'stock')), {self.apple.id: 5, self.pear.id: 5})
+        self.assertEqual(CartItem.objects.filter(user=self.user).count(), 2)
+        self.assertFalse(Order.objects.exists())
+        self.assertFalse(OrderItem.objects.exists())
+
+    def test_checkout_reserves_stock_and_clears_the_cart(self):
+        response = self.checkout(shipping_cost='4.50')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(dict(Product.objects.values_list('id', 'stock')), {self.apple.id: 3, self.pear.id: 2})
+        self.assertFalse(CartItem.objects.filter(user=self.user).exists())
+        order = Order.objects.get()
+        self.assertEqual(order.items.count(), 2)
+        self.assertEqual(order.total, order.subtotal + Decimal('4.50'))
+
+    def test_oversell_is_rejected(self):
+        Product.objects.filter(pk=self.pear.pk).update(stock=2)
+        response = self.checkout()
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {'detail': 'Insufficient stock', 'products': [self.pear.id]})
+        # The apple reservation succeeded and was rolled back
+        self.assertEqual(Product.objects.get(pk=self.apple.pk).stock, 5)
+        self.assertEqual(Product.objects.get(pk=self.pear.pk).stock, 2)
+        self.assertEqual(CartItem.objects.filter(user=self.user).count(), 2)
+        self.assertFalse(Order.objects.exists())
+
+    def test_inactive_product_is_rejected(self):
+        Product.objects.filter(pk=self.apple.pk).update(is_active=False)
+        response = self.checkout()
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['products'], [self.apple.id])
+        self.assertEqual(Product.objects.get(pk=self.pear.pk).stock, 5)
+
+    def test_failure_after_reserving_rolls_everything_back(self):
+        # The promo code is checked after stock has been reserved
+        response = self.checkout(promo_code='NO-SUCH-CODE')
+        self.assertEqual(response.status_code, 400)
+        self.assert_nothing_changed()
+
+    def test_invalid_shipping_cost_is_rejected(self):
+        for shipping_cost in ('NaN', 'inf', '-Infinity', 'abc'):
+            with self.subTest(shipping_cost=shipping_cost):
+                response = self.checkout(shipping_cost=shipping_cost)
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('shipping_cost', response.json())
+                self.assert_nothing_changed()
+
+
+class PromoCodeTests(TestCase):
+    """Discounts round half up and never exceed the subtotal; the promo cache reloads on writes and expiry."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='shopper')
+        cls.admin = User.objects.create_user(username='admin', is_staff=True)
+
+    def setUp(self):
+        invalidate_promo_cache()
+        self.addCleanup(invalidate_promo_cache)
+        self.now = timezone.now()
+
+    def promo(self, code, valid_for=datetime.timedelta(days=1), **kwargs):
+        return PromoCode.objects.create(
+            code=code, valid_from=self.now - datetime.timedelta(days=1), valid_to=self.now + valid_for, **kwargs
+        )
+
+    def validate(self, code, cart_total):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        return client.post('/api/promo-codes/validate/', {'code': code, 'cart_total': cart_total}, format='json').json()
+
+    def test_discount_rounds_half_up_and_is_capped(self):
+        cases = [
+            (PromoCode(discount_percentage=10), '33.35', '3.34'),
+            (PromoCode(discount_percentage=15), '0.10', '0.02'),
+            (PromoCode(discount_percentage=50), '0.05', '0.03'),
+            (PromoCode(discount_percentage=10), '33.34', '3.33'),
+            (PromoCode(discount_amount=Decimal('20.00')), '12.50', '12.50'),
+            (PromoCode(discount_amount=Decimal('5.00'), minimum_order_value=Decimal('30.00')), '29.99', '0.00'),
+        ]
+        for promo, subtotal, expected in cases:
+            with self.subTest(promo=promo.discount_percentage or promo.discount_amount, subtotal=subtotal):
+                self.assertEqual(calculate_discount(promo, Decimal(subtotal)), Decimal(expected))
+
+    def test_validate_quotes_the_discount_as_a_number(self):
+        self.promo('TEN', discount_percentage=10)
+        self.assertEqual(
+            self.validate('TEN', '33.35'),
+            {'valid': True, 'discount': 3.34, 'discount_type': 'percentage', 'discount_value': 10},
+        )
+
+    def test_cache_reloads_when_the_earliest_code_expires(self):
+        self.promo('SOON', valid_for=datetime.timedelta(seconds=10))
+        self.promo('LATER')
+        with self.assertNumQueries(1):
+            self.assertEqual(set(active_promos(self.now)), {'SOON', 'LATER'})
+        with self.assertNumQueries(0):
+            self.assertIsNotNone(get_active_promo('SOON', self.now + datetime.timedelta(seconds=10)))
+        with self.assertNumQueries(1):
+            self.assertIsNone(get_active_promo('SOON', self.now + datetime.timedelta(seconds=11)))
+        self.assertEqual(set(active_promos(self.now + datetime.timedelta(seconds=11))), {'LATER'})
+
+    def test_cache_reloads_after_max_age(self):
+        active_promos(self.now)
+        # bulk_create sends no signal, like a write made by another process
+        PromoCode.objects.bulk_create([PromoCode(
+            code='ELSEWHERE', valid_from=self.now, valid_to=self.now + datetime.timedelta(days=1),
+        )])
+        self.assertIsNone(get_active_promo('ELSEWHERE', self.now))
+        later = self.now + datetime.timedelta(seconds=PROMO_CACHE_MAX_AGE + 1)
+        self.assertIsNotNone(get_active_promo('ELSEWHERE', later))
+
+    def test_writes_reload_the_cache(self):
+        promo = self.promo('TEN', discount_percentage=10)
+        self.assertTrue(self.validate('TEN', '20')['valid'])
+        client = APIClient()
+        client.force_authenticate(self.admin)
+        self.assertEqual(client.patch(f'/api/promo-codes/{promo.pk}/', {'is_active': False}, format='json').status_code, 200)
+        self.assertFalse(self.validate('TEN', '20')['valid'])
+        self.promo('TWENTY', discount_percentage=20)
+        self.assertEqual(self.validate('TWENTY', '20')['discount'], 4.0)
+
+
+class CartSummaryTests(TestCase):
+    """The cached cart summary is dropped whenever the cart or a price in it changes."""
+
+    @classmethod
+    def setUpTestData(cls):
+        seed_catalog(2, categories=1, retailers=1)
+        cls.apple, cls.pear = Product.objects.order_by('id')
+        Product.objects.filter(pk=cls.apple.pk).update(
+            price=Decimal('2.00'), original_price=Decimal('4.00'), stock=10,
+            expiry_date=timezone.localdate() + datetime.timedelta(days=30),
+        )
+        Product.objects.filter(pk=cls.pear.pk).update(price=Decimal('1.50'), original_price=Decimal('1.50'), stock=10)
+        cls.user = User.objects.create(username='shopper')
+
+    def setUp(self):
+        clear_caches()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.item = CartItem.objects.create(user=self.user, product=self.apple, quantity=3)
+
+    def summary(self):
+        return get_cart_summary(self.user.pk)
+
+    def test_summary_is_cached(self):
+        self.assertEqual(self.summary(), {'item_count': 3, 'subtotal': Decimal('6.00'), 'savings': Decimal('6.00')})
+        with self.assertNumQueries(0):
+            self.summary()
+        response = self.client.get('/api/cart-items/cart_total/')
+        self.assertEqual(response.json()['total'], 6.0)
+
+    def test_price_change(self):
+        self.summary()
+        apple = Product.objects.get(pk=self.apple.pk)
+        apple.price = Decimal('1.00')
+        apple.save()
+        self.assertEqual(self.summary()['subtotal'], Decimal('3.00'))
+
+    def test_cart_edits(self):
+        self.summary()
+        self.client.post('/api/cart-items/', {'product_id': self.pear.pk, 'quantity': 2}, format='json')
+        self.assertEqual(self.summary()['subtotal'], Decimal('9.00'))
+        self.client.patch(f'/api/cart-items/{self.item.pk}/', {'quantity': 1}, format='json')
+        self.assertEqual(self.summary()['item_count'], 3)
+        self.client.delete(f'/api/cart-items/{self.item.pk}/')
+        self.assertEqual(self.summary(), {'item_count': 2, 'subtotal': Decimal('3.00'), 'savings': Decimal('0.00')})
+        self.client.post('/api/cart-items/batch/', {'operations': [{'op': 'add', 'product_id': self.pear.pk}]}, format='json')
+        self.assertEqual(self.summary()['item_count'], 3)
+
+    def test_expiry_engine_markdown(self):
+        self.summary()
+        Product.objects.filter(pk=self.apple.pk).update(expiry_date=timezone.localdate())
+        call_command('run_expiry_engine', stdout=io.StringIO())
+        price = Product.objects.get(pk=self.apple.pk).price
+        self.assertLess(price, Decimal('2.00'))
+        self.assertEqual(self.summary()['subtotal'], price * 3)
+
+
+class CartBatchTests(TestCase):
+    """POST /api/cart-items/batch/ applies every operation or none."""
+
+    @classmethod
+    def setUpTestData(cls):
+        seed_catalog(3, categories=1, retailers=1)
+        cls.apple, cls.pear, cls.plum = Product.objects.order_by('id')
+        Product.objects.update(stock=5)
+        cls.user = User.objects.create(username='shopper')
+
+    def setUp(self):
+        clear_caches()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        CartItem.objects.create(user=self.user, product=self.apple, quantity=1)
+        CartItem.objects.create(user=self.user, product=self.pear, quantity=2)
+
+    def batch(self, *operations):
+        return self.client.post('/api/cart-items/batch/', {'operations': list(operations)}, format='json')
+
+    def cart(self):
+        return dict(CartItem.objects.filter(user=self.user).values_list('product_id', 'quantity'))
+
+    def test_add_update_remove(self):
+        response = self.batch(
+            {'op': 'add', 'product_id': self.apple.pk, 'quantity': 2},
+            {'op': 'update', 'product_id': self.pear.pk, 'quantity': 4},
+            {'op': 'add', 'product_id': self.plum.pk},
+            {'op': 'add', 'product_id': self.plum.pk, 'quantity': 2},
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.cart(), {self.apple.pk: 3, self.pear.pk: 4, self.plum.pk: 3})
+        self.assertEqual({item['product']['id']: item['quantity'] for item in response.json()}, self.cart())
+
+    def test_remove(self):
+        response = self.batch(
+            {'op': 'remove', 'product_id': self.pear.pk},
+            {'op': 'add', 'product_id': self.plum.pk},
+            {'op': 'remove', 'product_id': self.plum.pk},
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.cart(), {self.apple.pk: 1})
+
+    def test_update_after_remove_puts_the_product_back(self):
+        self.batch(
+            {'op': 'remove', 'product_id': self.apple.pk},
+            {'op': 'update', 'product_id': self.apple.pk, 'quantity': 2},
+        )
+        self.assertEqual(self.cart(), {self.apple.pk: 2, self.pear.pk: 2})
+
+    def test_errors_apply_nothing(self):
+        Product.objects.filter(pk=self.plum.pk).update(is_active=False)
+        response = self.batch(
+            {'op': 'update', 'product_id': self.apple.pk, 'quantity': 3},
+            {'op': 'add', 'product_id': self.pear.pk, 'quantity': 4},
+            {'op': 'add', 'product_id': self.plum.pk},
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {'operations': {
+            '1': [f'Only 5 of product {self.pear.pk} left in stock.'],
+            '2': [f'Product {self.plum.pk} is not available.'],
+        }})
+        self.assertEqual(self.cart(), {self.apple.pk: 1, self.pear.pk: 2})
+
+    def test_error_is_reported_on_the_last_operation_for_a_product(self):
+        response = self.batch(
+            {'op': 'add', 'product_id': self.apple.pk, 'quantity': 2},
+            {'op': 'remove', 'product_id': self.pear.pk},
+            {'op': 'add', 'product_id': self.apple.pk, 'quantity': 3},
+        )
+        self.assertEqual(response.json(), {'operations': {'2': [f'Only 5 of product {self.apple.pk} left in stock.']}})
+
+    def test_update_requires_a_quantity(self):
+        response = self.batch({'op': 'update', 'product_id': self.apple.pk})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.cart(), {self.apple.pk: 1, self.pear.pk: 2})
+
+
+class CartItemMigrationTests(TransactionTestCase):
+    """Migration 0012 merges duplicate cart rows before adding the unique constraint."""
+
+    before = [('api', '0011_image_renditions')]
+    after = [('api', '0012_cart_item_unique_product')]
+
+    def migrate(self, targets):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate(targets)
+        return executor.loader.project_state(targets).apps
+
+    def tearDown(self):
+        self.migrate(MigrationExecutor(connection).loader.graph.leaf_nodes())
+
+    def test_duplicates_are_merged(self):
+        apps = self.migrate(self.before)
+        user = apps.get_model('api', 'User').objects.create(username='shopper')
+        category = apps.get_model('api', 'Category').objects.create(name='Bakery', slug='bakery')
+        retailer = apps.get_model('api', 'Retailer').objects.create(
+            user=apps.get_model('api', 'User').objects.create(username='baker'),
+            company_name='Baker', company_address='1 Bake St', business_license='LIC-1',
+        )
+        Product = apps.get_model('api', 'Product')
+        apple, pear = (
+            Product.objects.create(
+                name=name, slug=name, description='', price=1, original_price=2,
+                expiry_date=datetime.date(2030, 1, 1), category=category, retailer=retailer, stock=5,
+            )
+            for name in ('apple', 'pear')
+        )
+        CartItem = apps.get_model('api', 'CartItem')
+        first = CartItem.objects.create(user=user, product=apple, quantity=1)
+        CartItem.objects.create(user=user, product=apple, quantity=2)
+        CartItem.objects.create(user=user, product=apple, quantity=4)
+        other = CartItem.objects.create(user=user, product=pear, quantity=3)
+
+        apps = self.migrate(self.after)
+        rows = apps.get_model('api', 'CartItem').objects.order_by('id').values_list('id', 'product_id', 'quantity')
+        self.assertEqual(list(rows), [(first.pk, apple.pk, 7), (other.pk, pear.pk, 3)])
+
+
+class ProductSaveTests(TestCase):
+    """A plain save() leaves the rating counts alone but otherwise behaves like an update_fields save."""
+
+    @classmethod
+    def setUpTestData(cls):
+        seed_catalog(1, categories=1, retailers=1)
+
+    def setUp(self):
+        self.product = Product.objects.get()
+
+    def test_save_keeps_concurrent_ratings(self):
+        Product.objects.filter(pk=self.product.pk).update(rating_5_count=F('rating_5_count') + 1)
+        self.product.stock = 3
+        self.product.save()
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.stock, self.product.rating_5_count), (3, 1))
+
+    def test_update_fields_writes_ratings(self):
+        self.product.rating_4_count = 2
+        self.product.save(update_fields=['rating_4_count'])
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.rating_count, 2)
+
+    def test_save_of_a_deleted_row_raises(self):
+        Product.objects.filter(pk=self.product.pk).delete()
+        with self.assertRaises(DatabaseError):
+            self.product.save()
+
+    def test_stale_instance_keeps_reviews_made_since_it_was_loaded(self):
+        stale = Product.objects.get(pk=self.product.pk)
+        user = User.objects.create_user(username='reviewer')
+        Review.objects.create(product=self.product, user=user, rating=4, comment='Fine')
+        stale.name = 'Renamed'
+        stale.save()
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.name, self.product.rating_4_count, self.product.rating_count), ('Renamed', 1, 1))
+
+    def test_deferred_fields_are_left_alone(self):
+        product = Product.objects.only('stock').get(pk=self.product.pk)
+        Product.objects.filter(pk=self.product.pk).update(name='Renamed')
+        product.stock = 3
+        product.save()
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.name, self.product.stock), ('Renamed', 3))
+
+    def test_force_insert(self):
+        Product.objects.filter(pk=self.product.pk).delete()
+        self.product.save(force_insert=True)
+        self.assertTrue(Product.objects.filter(pk=self.product.pk).exists())
+
+
+class ProductRatingTests(TestCase):
+    """Review writes keep the rating histogram in step, and sort_by=rating ranks by it."""
+
+    @classmethod
+    def setUpTestData(cls):
+        seed_catalog(3, categories=1, retailers=1)
+        cls.products = list(Product.objects.order_by('id'))
+        cls.users = [User.objects.create_user(username=f'reviewer-{i}') for i in range(3)]
+
+    def setUp(self):
+        clear_caches()
+        self.client = APIClient()
+        self.client.force_authenticate(self.users[0])
+
+    def histogram(self, product):
+        product.refresh_from_db()
+        return product.rating_histogram, product.rating_count, product.rating_avg
+
+    def test_review_writes_move_the_counts(self):
+        product = self.products[0]
+        response = self.client.post('/api/reviews/', {'product': product.pk, 'rating': 5, 'comment': 'Great'}, format='json')
+        self.assertEqual(response.status_code, 201)
+        review = response.json()['id']
+        self.assertEqual(self.histogram(product), ({1: 0, 2: 0, 3: 0, 4: 0, 5: 1}, 1, Decimal('5.00')))
+
+        self.client.patch(f'/api/reviews/{review}/', {'rating': 2}, format='json')
+        self.assertEqual(self.histogram(product), ({1: 0, 2: 1, 3: 0, 4: 0, 5: 0}, 1, Decimal('2.00')))
+
+        self.client.patch(f'/api/reviews/{review}/', {'comment': 'Fine'}, format='json')
+        self.assertEqual(self.histogram(product), ({1: 0, 2: 1, 3: 0, 4: 0, 5: 0}, 1, Decimal('2.00')))
+
+        self.client.patch(f'/api/reviews/{review}/', {'product': self.products[1].pk}, format='json')
+        self.assertEqual(self.histogram(product)[1], 0)
+        self.assertEqual(self.histogram(self.products[1])[0][2], 1)
+
+        self.client.delete(f'/api/reviews/{review}/')
+        self.assertEqual(self.histogram(self.products[1])[1], 0)
+
+    def test_review_writes_replace_cached_product_pages(self):
+        product = self.products[0]
+        self.assertEqual(self.client.get(f'/api/products/{product.pk}/').json()['rating_count'], 0)
+        Review.objects.create(product=product, user=self.users[1], rating=3, comment='Fine')
+        self.assertEqual(self.client.get(f'/api/products/{product.pk}/').json()['rating_count'], 1)
+
+    def test_recompute_ratings_rebuilds_the_histograms(self):
+        first, second, _ = self.products
+        # bulk_create sends no signal, so the counts stay at zero
+        Review.objects.bulk_create([
+            Review(product=first, user=self.users[0], rating=5, comment=''),
+            Review(product=first, user=self.users[1], rating=3, comment=''),
+            Review(product=second, user=self.users[0], rating=1, comment=''),
+        ])
+        Product.objects.filter(pk=second.pk).update(rating_4_count=7)
+        call_command('recompute_ratings', '--batch-size', '1', stdout=io.StringIO())
+        self.assertEqual(self.histogram(first), ({1: 0, 2: 0, 3: 1, 4: 0, 5: 1}, 2, Decimal('4.00')))
+        self.assertEqual(self.histogram(second), ({1: 1, 2: 0, 3: 0, 4: 0, 5: 0}, 1, Decimal('1.00')))
+
+    def test_sort_by_rating(self):
+        first, second, third = self.products
+        ratings = [(second, 5), (second, 5), (third, 5), (first, 4), (first, 4), (first, 4)]
+        for i, (product, rating) in enumerate(ratings):
+            Review.objects.create(product=product, user=self.users[i % 3], rating=rating, comment='')
+        results = self.client.get('/api/products/', {'sort_by': 'rating'}).json()['results']
+        # Equal averages: more reviews first
+        self.assertEqual([row['id'] for row in results], [second.pk, third.pk, first.pk])
+
+
+class ProductImportTests(TestCase):
+    """Imports upsert the retailer's own products by slug and never another retailer's."""
+
+    @classmethod
+    def setUpTestData(cls):
+        seed_catalog(2, categories=1, retailers=2)
+        cls.retailer, cls.other = Retailer.objects.order_by('id')
+        cls.theirs = Product.objects.get(retailer=cls.other)
+
+    def import_file(self, *slugs):
+        category = Category.objects.get().slug
+        lines = ['slug,name,price,original_price,expiry_date,stock,category']
+        lines += [f'{slug},Imported {slug},1.00,2.00,2030-01-01,7,{category}' for slug in slugs]
+        return io.BytesIO('\n'.join(lines).encode())
+
+    def test_another_retailers_slug_is_rejected(self):
+        report = product_io.import_products(self.import_file('fresh', self.theirs.slug), 'csv', self.retailer)
+        self.assertEqual((report.created, report.updated, report.error_count), (1, 0, 1))
+        self.assertEqual(report.errors[0]['line'], 3)
+        self.assertEqual(Product.objects.get(pk=self.theirs.pk).name, self.theirs.name)
+
+    def test_slug_taken_while_writing_is_rejected(self):
+        plan_batch = product_io._plan_batch
+        plans = []
+
+        def stale_plan(rows, retailer):
+            # The first plan misses the other retailer's product, as if it
+            # had been inserted right after the ownership read
+            plans.append(rows)
+            if len(plans) > 1:
+                return plan_batch(rows, retailer)
+            products, updated_ids, errors = plan_batch(
+                {slug: row for slug, row in rows.items() if slug != self.theirs.slug}, retailer,
+            )
+            line, values = rows[self.theirs.slug]
+            products.append(Product(retailer=retailer, markdown_base_price=None, expiry_bucket=None, **values))
+            return products, updated_ids, errors
+
+        with mock.patch.object(product_io, '_plan_batch', stale_plan):
+            report = product_io.import_products(self.import_file('fresh', self.theirs.slug), 'csv', self.retailer)
+        self.assertEqual(len(plans), 2)
+        self.assertEqual((report.created, report.error_count), (1, 1))
+        self.assertEqual(Product.objects.get(pk=self.theirs.pk).name, self.theirs.name)
+
+
+class SyntheticDataTests(TestCase):
+    """Generated data only derives ratings and markdowns for its own rows."""
+
+    @classmethod
+    def setUpTestData(cls):
+        seed_catalog(1, categories=1, retailers=1)
+        cls.existing = Product.objects.get()
+        Product.objects.update(expiry_date=timezone.localdate() - datetime.timedelta(days=1))
+
+    def test_existing_products_are_left_alone(self):
+        generate_dataset(users=5, retailers=1, categories=1, products=20, reviews=0)
+        self.existing.refresh_from_db()
+        self.assertTrue(self.existing.is_active)
+        self.assertFalse(Product.objects.filter(expiry_date__lt=timezone.localdate(), is_active=True)
+                         .exclude(pk=self.existing.pk).exists())
+
+    def test_command_refuses_without_debug(self):
+        with self.assertRaisesMessage(CommandError, '--allow-production'):
+            call_command('generate_data', users=1, stdout=io.StringIO())
+        self.assertFalse(User.objects.filter(user_type='consumer').exists())
+
+
+@override_settings(CATALOG_CACHE_ENABLED=False)
+class RenditionUrlTests(TestCase):
+    """Rendition URLs are absolute, like the image URL, for the frontend on another origin."""
+
+    @classmethod
+    def setUpTestData(cls):
+        seed_catalog(1, categories=1, retailers=1)
+        cls.product = Product.objects.get()
+        cls.rendition = RENDITIONS[0]
+        Product.objects.update(
+            image='products/apple.jpg',
+            image_renditions={'source': 'products/apple.jpg', cls.rendition: f'renditions/apple-{cls.rendition}'},
+        )
+
+    def assert_absolute(self, data):
+        self.assertEqual(data['image'], 'http://testserver/media/products/apple.jpg')
+        self.assertEqual(
+            data['image_renditions'], {self.rendition: f'http://testserver/media/renditions/apple-{self.rendition}'},
+        )
+
+    def test_list(self):
+        # Served from values() rows
+        self.assert_absolute(APIClient().get('/api/products/').json()['results'][0])
+
+    def test_retrieve(self):
+        self.assert_absolute(APIClient().get(f'/api/products/{self.product.pk}/').json())
+
+
+class BinaryFileTests(TestCase):
+    """Uploads stream into the blob store, and replaced content is released."""
+
+    def setUp(self):
+        self.enterContext(override_settings(BINARY_FILE_ROOT=self.enterContext(tempfile.TemporaryDirectory())))
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create(username='uploader'))
+
+    def upload(self, content, name='notes.txt'):
+        return SimpleUploadedFile(name, content, content_type='text/plain')
+
+    def create(self, content):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/binary-files/', {'file': self.upload(content)}, format='multipart')
+        self.assertEqual(response.status_code, 201)
+        return BinaryFile.objects.get(pk=response.json()['id'])
+
+    def download(self, binary_file):
+        response = self.client.get(f'/api/binary-files/{binary_file.pk}/download/')
+        return b''.join(response.streaming_content)
+
+    def test_put_replaces_the_content(self):
+        binary_file = self.create(b'old content')
+        old_sha256 = binary_file.sha256
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.put(
+                f'/api/binary-files/{binary_file.pk}/',
+                {'file': self.upload(b'new content, longer'), 'name': 'notes.txt'},
+                format='multipart',
+            )
+        self.assertEqual(response.status_code, 200)
+        binary_file.refresh_from_db()
+        self.assertEqual(binary_file.size, len(b'new content, longer'))
+        self.assertNotEqual(binary_file.sha256, old_sha256)
+        self.assertEqual(self.download(binary_file), b'new content, longer')
+        self.assertFalse(get_blob_store().exists(old_sha256))
+
+    def test_shared_blob_is_kept(self):
+        binary_file = self.create(b'shared')
+        other = self.create(b'shared')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(f'/api/binary-files/{binary_file.pk}/', {'file': self.upload(b'mine')}, format='multipart')
+        self.assertEqual(self.download(other), b'shared')
+
+    def test_patch_without_a_file_keeps_the_content(self):
+        binary_file = self.create(b'content')
+        response = self.client.patch(f'/api/binary-files/{binary_file.pk}/', {'description': 'Notes'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.download(binary_file), b'content')
+
+
+class RetailerPermissionTests(TestCase):
+    """Only approved retailers write products, and only their own; categories and promo codes are staff-only."""
+
+    @classmethod
+    def setUpTestData(cls):
+        seed_catalog(2, categories=1, retailers=2)
+        cls.category = Category.objects.get()
+        cls.retailer, cls.other = Retailer.objects.order_by('id')
+        cls.product = Product.objects.get(retailer=cls.retailer)
+        cls.other_product = Product.objects.get(retailer=cls.other)
+        user = User.objects.create(username='pending-retailer', user_type='retailer')
+        cls.pending = Retailer.objects.create(
+            user=user, company_name='Pending', company_address='1 Pending St', business_license='LIC-P',
+        )
+        now = timezone.now()
+        cls.promo_code = PromoCode.objects.create(
+            code='SAVE5', discount_amount=Decimal('5.00'), valid_from=now, valid_to=now + datetime.timedelta(days=1),
+        )
+
+    def setUp(self):
+        clear_caches()
+
+    def client_for(self, retailer):
+        client = APIClient()
+        client.force_authenticate(retailer.user)
+        return client
+
+    def product_data(self, retailer):
+        return {
+            'name': 'Day-old bread', 'slug': 'day-old-bread', 'description': 'Still good',
+            'price': '1.00', 'original_price': '3.00', 'expiry_date': str(timezone.now().date()),
+            'category': self.category.pk, 'retailer': retailer.pk, 'stock': 4,
+        }
+
+    def test_unapproved_retailer_cannot_write(self):
+        client = self.client_for(self.pending)
+        responses = {
+            'product create': client.post('/api/products/', self.product_data(self.pending), format='json'),
+            'category delete': client.delete(f'/api/categories/{self.category.pk}/'),
+            'promo code read': client.get(f'/api/promo-codes/{self.promo_code.pk}/'),
+            'promo code update': client.patch(f'/api/promo-codes/{self.promo_code.pk}/', {'code': 'X'}, format='json'),
+        }
+        for name, response in responses.items():
+            with self.subTest(name):
+                self.assertEqual(response.status_code, 403)
+        self.assertTrue(Category.objects.filter(pk=self.category.pk).exists())
+
+    def test_approved_retailer_cannot_touch_categories_or_promo_codes(self):
+        client = self.client_for(self.retailer)
+        self.assertEqual(client.delete(f'/api/categories/{self.category.pk}/').status_code, 403)
+        self.assertEqual(client.patch(f'/api/promo-codes/{self.promo_code.pk}/', {'code': 'X'}, format='json').status_code, 403)
+
+    def test_create_is_owned_by_the_requesting_retailer(self):
+        response = self.client_for(self.retailer).post('/api/products/', self.product_data(self.other), format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Product.objects.get(pk=response.json()['id']).retailer, self.retailer)
+
+    def test_update_of_another_retailers_product_is_denied(self):
+        client = self.client_for(self.retailer)
+        response = client.patch(f'/api/products/{self.other_product.pk}/', {'price': '0.01'}, format='json')
+        self.assertIn(response.status_code, (403, 404))
+        response = client.patch(f'/api/products/{self.product.pk}/', {'retailer': self.other.pk}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.retailer, self.retailer)
+
+
+class TokenAuthTests(TestCase):
+    """Logging out revokes the token and reports how long other workers may still accept it."""
+
+    def setUp(self):
+        clear_caches()
+        User.objects.create_user(username='shopper', password='correct horse')
+        self.client = APIClient()
+
+    def log_in(self):
+        response = self.client.post('/api/token-auth/', {'username': 'shopper', 'password': 'correct horse'})
+        self.assertEqual(response.status_code, 200)
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {response.json()['token']}")
+
+    def test_log_out_revokes_the_token(self):
+        self.log_in()
+        self.assertEqual(self.client.get('/api/users/me/').status_code, 200)
+        response = self.client.delete('/api/token-auth/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['revocation_window_seconds'], caches['tokens'].default_timeout)
+        self.assertFalse(ExpiringToken.objects.exists())
+        self.assertEqual(self.client.get('/api/users/me/').status_code, 401)
+
+    def test_shared_cache_revokes_at_once(self):
+        location = self.enterContext(tempfile.TemporaryDirectory())
+        self.enterContext(override_settings(CACHES={
+            **settings.CACHES,
+            'tokens': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': location},
+        }))
+        self.log_in()
+        self.assertEqual(self.client.delete('/api/token-auth/').json()['revocation_window_seconds'], 0)
+
+    def token(self):
+        return ExpiringToken.objects.get(user__username='shopper')
+
+    def later(self, delta):
+        return mock.patch('django.utils.timezone.now', return_value=timezone.now() + delta)
+
+    def token_updates(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get('/api/users/me/').status_code, 200)
+        return sum(query['sql'].startswith('UPDATE "api_expiringtoken"') for query in queries)
+
+    def test_expired_token_is_rejected(self):
+        self.log_in()
+        # Once from the database and once from the cache
+        for _ in range(2):
+            with self.later(settings.AUTH_TOKEN_LIFETIME + datetime.timedelta(seconds=1)):
+                response = self.client.get('/api/users/me/')
+            self.assertEqual(response.status_code, 401)
+            self.assertEqual(response.json()['detail'], 'Token has expired.')
+        self.assertEqual(self.client.get('/api/users/me/').status_code, 200)
+
+    def test_use_extends_the_token_once_per_interval(self):
+        self.log_in()
+        self.client.get('/api/users/me/')
+        expires_at = self.token().expires_at
+        with self.later(settings.AUTH_TOKEN_REFRESH_INTERVAL / 2):
+            self.assertEqual(self.token_updates(), 0)
+        self.assertEqual(self.token().expires_at, expires_at)
+        with self.later(settings.AUTH_TOKEN_REFRESH_INTERVAL + datetime.timedelta(minutes=1)) as now:
+            self.assertEqual(self.token_updates(), 1)
+            self.assertEqual(self.token_updates(), 0)
+        self.assertEqual(self.token().expires_at, now.return_value + settings.AUTH_TOKEN_LIFETIME)
+
+    def test_password_change_revokes_cached_tokens(self):
+        self.log_in()
+        self.client.get('/api/users/me/')
+        cache_key = token_cache_key(self.token().key)
+        self.assertIsNotNone(caches['tokens'].get(cache_key))
+        user = User.objects.get(username='shopper')
+        user.set_password('battery staple')
+        user.save()
+        self.assertIsNone(caches['tokens'].get(cache_key))
+
+    def test_login_leaves_cached_tokens(self):
+        self.log_in()
+        self.client.get('/api/users/me/')
+        cache_key = token_cache_key(self.token().key)
+        self.client.post('/api/token-auth/', {'username': 'shopper', 'password': 'correct horse'})
+        self.assertIsNotNone(caches['tokens'].get(cache_key))
+
+    def test_purge_expired_tokens(self):
+        user = User.objects.get(username='shopper')
+        now = timezone.now()
+        for hours in [-2, -1, 1]:
+            ExpiringToken.objects.create(user=user, expires_at=now + datetime.timedelta(hours=hours))
+        out = io.StringIO()
+        call_command('purge_expired_tokens', '--batch-size', '1', stdout=out)
+        self.assertIn('Deleted 2 expired tokens', out.getvalue())
+        self.assertEqual(list(ExpiringToken.objects.values_list('expires_at', flat=True)), [now + datetime.timedelta(hours=1)])
+
+
+class TokenMigrationTests(TransactionTestCase):
+    """Migration 0009 copies every DRF token into an expiring token with a full lifetime."""
+
+    def migrate(self, targets):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate(targets)
+        return executor.loader.project_state(targets).apps
+
+    def tearDown(self):
+        self.migrate(MigrationExecutor(connection).loader.graph.leaf_nodes())
+
+    def test_tokens_are_copied(self):
+        apps = self.migrate([('api', '0008_retailer_order'), ('authtoken', '0003_tokenproxy')])
+        User = apps.get_model('api', 'User')
+        Token = apps.get_model('authtoken', 'Token')
+        tokens = [Token.objects.create(key=f'{i:040d}', user=User.objects.create(username=f'user-{i}')) for i in range(3)]
+
+        started = timezone.now()
+        apps = self.migrate([('api', '0009_expiring_token')])
+        rows = apps.get_model('api', 'ExpiringToken').objects.order_by('key')
+        self.assertEqual(
+            [(row.key, row.user_id, row.created) for row in rows],
+            [(token.key, token.user_id, token.created) for token in tokens],
+        )
+        for row in rows:
+            self.assertGreaterEqual(row.expires_at, started + settings.AUTH_TOKEN_LIFETIME)
+
+
+class MetricsTests(TestCase):
+    """Per-view metrics time serialization explicitly, and only staff or configured scrapers may read them."""
+
+    @classmethod
+    def setUpTestData(cls):
+        seed_catalog(3, categories=1, retailers=1)
+        cls.admin = User.objects.create_user(username='admin', is_staff=True)
+
+    def setUp(self):
+        clear_caches()
+        reset_metrics()
+        self.addCleanup(reset_metrics)
+
+    def test_list_and_retrieve_record_serializer_time(self):
+        client = APIClient()
+        product = Product.objects.first()
+        client.get(f'/api/products/{product.pk}/')
+        client.get(f'/api/products/{product.pk}/')
+        client.get(f'/api/categories/{product.category_id}/')
+        metrics = get_metrics()
+        self.assertEqual(metrics['product-retrieve']['requests'], {'200': 2})
+        self.assertEqual(metrics['product-retrieve']['serializer_seconds']['count'], 2)
+        self.assertGreater(metrics['product-retrieve']['serializer_seconds']['sum'], 0)
+        self.assertGreater(metrics['category-retrieve']['serializer_seconds']['sum'], 0)
+
+    def test_drf_serializers_are_left_alone(self):
+        self.assertEqual(serializers.Serializer.data.fget.__module__, 'rest_framework.serializers')
+        self.assertEqual(serializers.ListSerializer.data.fget.__module__, 'rest_framework.serializers')
+
+    def test_access(self):
+        client = APIClient()
+        self.assertEqual(client.get('/api/metrics/').status_code, 401)
+        with self.settings(METRICS_ALLOWED_IPS=['127.0.0.1']):
+            self.assertEqual(client.get('/api/metrics/').status_code, 200)
+        with self.settings(METRICS_TOKEN='s3cret'):
+            self.assertEqual(client.get('/api/metrics/', HTTP_AUTHORIZATION='Bearer s3cret').status_code, 200)
+            self.assertEqual(client.get('/api/metrics/', HTTP_AUTHORIZATION='Bearer guess').status_code, 401)
+        client.force_authenticate(self.admin)
+        response = client.get('/api/metrics/')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('# TYPE api_request_seconds summary', response.content.decode())
+
+
+@override_settings(SLOW_REQUEST_SECONDS=0)
+class SlowRequestLogTests(TestCase):
+    """The slow request log leaves out query parameters unless asked for them."""
+
+    def setUp(self):
+        User.objects.create_user(username='shopper', password='correct horse')
+
+    def log_in(self):
+        with self.assertLogs('api.metrics', 'WARNING') as logs:
+            response = APIClient().post('/api/token-auth/', {'username': 'shopper', 'password': 'correct horse'})
+        return response.json()['token'], '\n'.join(logs.output)
+
+    def test_parameters_are_left_out(self):
+        token, output = self.log_in()
+        self.assertIn('INSERT INTO', output)
+        self.assertNotIn(token, output)
+        self.assertNotIn('pbkdf2', output)
+
+    @override_settings(SLOW_REQUEST_LOG_PARAMS=True)
+    def test_parameters_on_request(self):
+        token, output = self.log_in()
+        self.assertIn(token, output)
@@ -1,43 +1,125 @@
 from django.shortcuts import render
 from rest_framework import viewsets, status, generics, permissions
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework.authtoken.views import ObtainAuthToken
-from rest_framework.authtoken.models import Token
 from rest_framework.permissions import IsAuthenticated, IsAdminUser, AllowAny
+from django.conf import settings
 from django.contrib.auth import get_user_model, authenticate
-from django.db.models import Q
+from django.http import StreamingHttpResponse
+from django.db import transaction
+from django.db.models import Count, F, Max, OuterRef, Prefetch, Q, Subquery, Sum
 from django.utils import timezone
-from django.utils.crypto import get_random_string
+from django.utils.crypto import constant_time_compare, get_random_string
 import uuid
-import datetime
+from decimal import Decimal, InvalidOperation
 
 from .models import (
-    Category, Retailer, Product, CartItem, Wishlist, 
-    Order, OrderItem, PromoCode, Review, BinaryFile
+    Category, Retailer, Product, CartItem, Wishlist, ExpiringToken,
+    Order, OrderItem, RetailerOrder, PromoCode, Review, BinaryFile, ExpiryBucket
 )
 from .serializers import (
     UserSerializer, CategorySerializer, RetailerSerializer, 
-    ProductSerializer, CartItemSerializer, WishlistSerializer, 
+    ProductSerializer, CartItemSerializer, CartBatchSerializer, WishlistSerializer, 
     OrderSerializer, OrderItemSerializer, PromoCodeSerializer, 
-    ReviewSerializer, BinaryFileSerializer
+    ReviewSerializer, BinaryFileSerializer, ProductCardSerializer, ValuesSerializer
 )
+from .authentication import revocation_window
+from .blobs import blob_response, get_blob_store
+from .cart import apply_cart_operations, get_cart_summary
+from .catalog_cache import CatalogCacheMixin, get_stats, invalidate_products
+from .conditional import ConditionalGetMixin
+from .db import ReplicaReadMixin
+from .discounts import calculate_discount, get_active_promo
+from .metrics import PrometheusRenderer, SerializerTimingMixin, get_metrics
+from .pagination import CatalogPagination
+from .product_io import FORMATS, ImportFormatError, detect_format, export_rows, import_products
+from .renderers import FastJSONRenderer
+from .search import search_products
 
 User = get_user_model()
 
+EXPIRING_SOON_DAYS = {
+    'true': ExpiryBucket.SEVEN_DAYS,
+    'today': ExpiryBucket.TODAY,
+    '3': ExpiryBucket.THREE_DAYS,
+    '7': ExpiryBucket.SEVEN_DAYS,
+}
+
+class InsufficientStock(Exception):
+    """Raised inside the checkout transaction to roll back a stock reservation."""
+    def __init__(self, product_ids):
+        super().__init__(product_ids)
+        self.product_ids = product_ids
+
 class IsRetailerOrAdmin(permissions.BasePermission):
+    """Staff, or a retailer whose profile has been approved."""
     def has_permission(self, request, view):
-        return request.user.is_authenticated and (
-            hasattr(request.user, 'retailer') or 
-            request.user.is_staff
-        )
+        if not request.user.is_authenticated:
+            return False
+        if request.user.is_staff:
+            return True
+        retailer = getattr(request.user, 'retailer_profile', None)
+        return retailer is not None and retailer.approved
+    
+    def has_object_permission(self, request, view, obj):
+        # Retailers may only change their own products
+        if request.user.is_staff:
+            return True
+        return getattr(obj, 'retailer_id', None) == request.user.retailer_profile.pk
 
 class IsOwnerOrAdmin(permissions.BasePermission):
     def has_object_permission(self, request, view, obj):
         # Check if user is owner or admin
         return (obj.user == request.user) or request.user.is_staff
 
+class ValuesListMixin:
+    """
+    Serialize ``list`` responses from ``values()`` rows (see ValuesSerializer).
+    
+    ``?fields=a,b`` on a safe request returns only those fields of
+    ``serializer_class``; without it listings use ``list_serializer_class``.
+    """
+    list_serializer_class = None
+    fields_query_param = 'fields'
+    
+    def sparse_fields(self):
+        if self.request is None or self.request.method not in permissions.SAFE_METHODS:
+            return None
+        param = self.request.query_params.get(self.fields_query_param)
+        if not param:
+            return None
+        fields = [name.strip() for name in param.split(',') if name.strip()]
+        unknown = set(fields) - set(self.serializer_class.Meta.fields)
+        if unknown:
+            raise ValidationError({self.fields_query_param: [f"Unknown field(s): {', '.join(sorted(unknown))}."]})
+        return fields
+    
+    def get_serializer_class(self):
+        if self.action == 'list' and self.list_serializer_class and self.sparse_fields() is None:
+            return self.list_serializer_class
+        return super().get_serializer_class()
+    
+    def get_serializer(self, *args, **kwargs):
+        fields = self.sparse_fields()
+        if fields is not None:
+            kwargs['fields'] = fields
+        return super().get_serializer(*args, **kwargs)
+    
+    def list_values(self):
+        """The filtered queryset as ``values()`` rows and the serializer for them."""
+        serializer = ValuesSerializer(self.get_serializer())
+        return serializer.queryset(self.filter_queryset(self.get_queryset())), serializer
+    
+    def list(self, request, *args, **kwargs):
+        queryset, serializer = self.list_values()
+        page = self.paginate_queryset(queryset)
+        if page is None:
+            return Response(serializer.represent(queryset))
+        return self.get_paginated_response(serializer.represent(page))
+
 class CustomAuthToken(APIView):
     permission_classes = [AllowAny]
     
@@ -55,20 +137,34 @@ class CustomAuthToken(APIView):
             return Response({'error': 'Invalid credentials'}, 
                            status=status.HTTP_401_UNAUTHORIZED)
             
-        token, created = Token.objects.get_or_create(user=user)
+        # One token per login, so devices expire and log out independently
+        token = ExpiringToken.objects.create(user=user)
         
         return Response({
             'token': token.key,
+            'expires_at': token.expires_at,
             'user_id': user.pk,
             'username': user.username,
             'email': user.email,
             'is_staff': user.is_staff,
-            'is_retailer': hasattr(user, 'retailer'),
+            'is_retailer': user.user_type == 'retailer',
             'first_name': user.first_name,
             'last_name': user.last_name,
         })
+    
+    def delete(self, request, *args, **kwargs):
+        # Log out: delete this token, which also revokes its cached lookup
+        if not isinstance(request.auth, ExpiringToken):
+            return Response({'error': 'Token authentication required.'},
+                            status=status.HTTP_401_UNAUTHORIZED)
+        ExpiringToken.objects.filter(pk=request.auth.pk).delete()
+        # Workers with their own token cache may accept the token a little longer
+        return Response({
+            'detail': 'Logged out.',
+            'revocation_window_seconds': revocation_window(),
+        })
 
-class UserViewSet(viewsets.ModelViewSet):
+class UserViewSet(SerializerTimingMixin, viewsets.ModelViewSet):
     queryset = User.objects.all()
     serializer_class = UserSerializer
     permission_classes = [IsAdminUser]
@@ -93,20 +189,22 @@ class UserViewSet(viewsets.ModelViewSet):
             return User.objects.all()
         return User.objects.filter(pk=self.request.user.pk)
 
-class CategoryViewSet(viewsets.ModelViewSet):
+class CategoryViewSet(ReplicaReadMixin, ConditionalGetMixin, CatalogCacheMixin, SerializerTimingMixin, viewsets.ModelViewSet):
     queryset = Category.objects.all()
     serializer_class = CategorySerializer
+    cache_resource = 'category'
     permission_classes = [IsAuthenticated]
     
     def get_permissions(self):
+        # Categories are shared by every retailer's products
         if self.action in ['list', 'retrieve']:
             permission_classes = [AllowAny]
         else:
-            permission_classes = [IsRetailerOrAdmin]
+            permission_classes = [IsAdminUser]
         return [permission() for permission in permission_classes]
 
-class RetailerViewSet(viewsets.ModelViewSet):
-    queryset = Retailer.objects.all()
+class RetailerViewSet(SerializerTimingMixin, viewsets.ModelViewSet):
+    queryset = Retailer.objects.select_related('user')
     serializer_class = RetailerSerializer
     
     def get_permissions(self):
@@ -121,7 +219,7 @@ class RetailerViewSet(viewsets.ModelViewSet):
     @action(detail=False, methods=['get'])
     def my_profile(self, request):
         try:
-            retailer = Retailer.objects.get(user=request.user)
+            retailer = Retailer.objects.select_related('user').get(user=request.user)
             serializer = RetailerSerializer(retailer)
             return Response(serializer.data)
         except Retailer.DoesNotExist:
@@ -130,19 +228,32 @@ class RetailerViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_404_NOT_FOUND
             )
 
-class ProductViewSet(viewsets.ModelViewSet):
+class ProductViewSet(ReplicaReadMixin, ConditionalGetMixin, CatalogCacheMixin, ValuesListMixin, SerializerTimingMixin, viewsets.ModelViewSet):
     queryset = Product.objects.all()
     serializer_class = ProductSerializer
+    list_serializer_class = ProductCardSerializer
+    pagination_class = CatalogPagination
+    cache_resource = 'product'
+    
+    def validator_aggregates(self):
+        aggregates = super().validator_aggregates()
+        if self.action == 'retrieve':
+            # Product rows embed their category's name; listings have no Last-Modified
+            aggregates['category_updated_at'] = Max('category__updated_at')
+        return aggregates
     
     def get_permissions(self):
         if self.action in ['list', 'retrieve']:
             permission_classes = [AllowAny]
+        elif self.action == 'retailer_products':
+            # Checks the user type itself; unapproved retailers may see their products
+            permission_classes = [IsAuthenticated]
         else:
             permission_classes = [IsRetailerOrAdmin]
         return [permission() for permission in permission_classes]
     
     def get_queryset(self):
-        queryset = Product.objects.filter(is_active=True)
+        queryset = Product.objects.filter(is_active=True).select_related('category', 'retailer')
         
         # Filtering by category
         category = self.request.query_params.get('category', None)
@@ -154,24 +265,29 @@ class ProductViewSet(viewsets.ModelViewSet):
         if retailer:
             queryset = queryset.filter(retailer__id=retailer)
         
-        # Search by name or description
+        # Full-text search by name or description, ranked by relevance
+        # unless an explicit sort order was requested
         search = self.request.query_params.get('search', None)
+        sort_by = self.request.query_params.get('sort_by', None)
         if search:
-            queryset = queryset.filter(
-                Q(name__icontains=search) | Q(description__icontains=search)
-            )
+            ranked = sort_by not in ('price_asc', 'price_desc', 'newest', 'discount', 'rating')
+            queryset = search_products(queryset, search, ranked=ranked)
         
         # Filter by featured products
         featured = self.request.query_params.get('featured', None)
         if featured and featured.lower() == 'true':
             queryset = queryset.filter(is_featured=True)
         
-        # Filter by expiry date (products expiring soon)
+        # Filter by expiry bucket: expiring_soon=true (within a week), today,
+        # 3 or 7 days. Buckets are as of the last expiry engine run
+        # (api/expiry.py); the bucket filter walks product_active_bucket_idx.
         expiring_soon = self.request.query_params.get('expiring_soon', None)
-        if expiring_soon and expiring_soon.lower() == 'true':
-            today = timezone.now().date()
-            one_week_later = today + datetime.timedelta(days=7)
-            queryset = queryset.filter(expiry_date__range=[today, one_week_later])
+        if expiring_soon:
+            bucket = EXPIRING_SOON_DAYS.get(expiring_soon.lower())
+            if bucket is not None:
+                queryset = queryset.filter(
+                    expiry_bucket__isnull=False, expiry_bucket__lte=bucket, expiry_date__gte=timezone.localdate()
+                )
         
         # Filter by price range
         min_price = self.request.query_params.get('min_price', None)
@@ -181,25 +297,40 @@ class ProductViewSet(viewsets.ModelViewSet):
         if max_price:
             queryset = queryset.filter(price__lte=max_price)
             
-        # Sort by price
-        sort_by = self.request.query_params.get('sort_by', None)
-        if sort_by:
-            if sort_by == 'price_asc':
-                queryset = queryset.order_by('price')
-            elif sort_by == 'price_desc':
-                queryset = queryset.order_by('-price')
-            elif sort_by == 'newest':
-                queryset = queryset.order_by('-created_at')
-            elif sort_by == 'discount':
-                # Sort by the calculated discount percentage
-                queryset = sorted(
-                    queryset, 
-                    key=lambda x: ((x.original_price - x.price) / x.original_price) if x.original_price > 0 else 0, 
-                    reverse=True
-                )
+        # Sort by price, age, discount or rating. Unsorted listings default to newest
+        # first so pagination is stable and can walk an index.
+        if sort_by == 'price_asc':
+            queryset = queryset.order_by('price', 'id')
+        elif sort_by == 'price_desc':
+            queryset = queryset.order_by('-price', '-id')
+        elif sort_by == 'newest':
+            queryset = queryset.order_by('-created_at', '-id')
+        elif sort_by == 'discount':
+            # discount_percentage is a stored column, so this is an indexed ORDER BY
+            queryset = queryset.order_by('-discount_percentage', '-id')
+        elif sort_by == 'rating':
+            # Best average first; more reviews break ties
+            queryset = queryset.order_by('-rating_avg', '-rating_count', '-id')
+        elif search:
+            queryset = queryset.order_by('-search_rank', '-created_at', '-id')
+        else:
+            queryset = queryset.order_by('-created_at', '-id')
         
         return queryset
     
+    def perform_create(self, serializer):
+        # Retailers can only list products as themselves
+        if self.request.user.is_staff:
+            serializer.save()
+        else:
+            serializer.save(retailer=self.request.user.retailer_profile)
+    
+    def perform_update(self, serializer):
+        if self.request.user.is_staff:
+            serializer.save()
+        else:
+            serializer.save(retailer=self.request.user.retailer_profile)
+    
     @action(detail=False, methods=['get'])
     def retailer_products(self, request):
         """Get all products for the logged in retailer"""
@@ -211,7 +342,7 @@ class ProductViewSet(viewsets.ModelViewSet):
         
         try:
             retailer = Retailer.objects.get(user=request.user)
-            products = Product.objects.filter(retailer=retailer)
+            products = Product.objects.filter(retailer=retailer).select_related('category', 'retailer')
             serializer = ProductSerializer(products, many=True)
             return Response(serializer.data)
         except Retailer.DoesNotExist:
@@ -219,110 +350,208 @@ class ProductViewSet(viewsets.ModelViewSet):
                 {"detail": "Retailer profile not found."},
                 status=status.HTTP_404_NOT_FOUND
             )
+    
+    def import_retailer(self, request, retailer_id):
+        """The retailer a bulk import or export acts for: the user's own, or any for staff."""
+        if not request.user.is_staff:
+            return request.user.retailer_profile
+        if not retailer_id:
+            raise ValidationError({'retailer': ['This field is required for staff.']})
+        try:
+            return Retailer.objects.get(pk=retailer_id)
+        except (Retailer.DoesNotExist, ValueError):
+            raise ValidationError({'retailer': [f'Unknown retailer {retailer_id!r}.']})
+    
+    @action(detail=False, methods=['post'], url_path='import')
+    def import_file(self, request):
+        """Create or update products from an uploaded CSV or JSON Lines ``file``, by slug"""
+        upload = request.FILES.get('file')
+        if upload is None:
+            raise ValidationError({'file': ['No file was submitted.']})
+        file_format = request.data.get('file_format') or detect_format(upload.name)
+        if file_format is None:
+            raise ValidationError({'file_format': ['Give the format (csv or jsonl) or a .csv/.jsonl file name.']})
+        retailer = self.import_retailer(request, request.data.get('retailer'))
+        dry_run = str(request.data.get('dry_run', '')).lower() in ('1', 'true')
+        try:
+            report = import_products(upload, file_format, retailer, dry_run=dry_run)
+        except ImportFormatError as exc:
+            raise ValidationError({'file': [str(exc)]})
+        return Response(report.as_dict())
+    
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        """Stream the retailer's products, active or not, as CSV or JSON Lines"""
+        file_format = request.query_params.get('file_format', 'csv')
+        if file_format not in FORMATS:
+            raise ValidationError({'file_format': [f"Expected one of {', '.join(FORMATS)}."]})
+        products = Product.objects.all()
+        retailer_id = request.query_params.get('retailer')
+        if not request.user.is_staff or retailer_id:
+            products = products.filter(retailer=self.import_retailer(request, retailer_id))
+        content_type = 'text/csv' if file_format == 'csv' else 'application/x-ndjson'
+        response = StreamingHttpResponse(export_rows(products, file_format), content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="products.{file_format}"'
+        return response
+
+class CatalogCacheStatsView(APIView):
+    permission_classes = [IsAdminUser]
+    
+    def get(self, request):
+        return Response(get_stats())
+
+class IsMetricsScraper(permissions.BasePermission):
+    """Sends METRICS_TOKEN as a bearer token, or connects from METRICS_ALLOWED_IPS."""
+    def has_permission(self, request, view):
+        token = settings.METRICS_TOKEN
+        if token and constant_time_compare(request.META.get('HTTP_AUTHORIZATION', ''), f'Bearer {token}'):
+            return True
+        return request.META.get('REMOTE_ADDR') in settings.METRICS_ALLOWED_IPS
+
+class MetricsView(APIView):
+    """Per-view request metrics of this process in the Prometheus text format, or ``?format=json``."""
+    permission_classes = [IsMetricsScraper | IsAdminUser]
+    renderer_classes = [PrometheusRenderer, FastJSONRenderer]
+    
+    def get(self, request):
+        return Response(get_metrics())
 
-class CartItemViewSet(viewsets.ModelViewSet):
+class CartItemViewSet(SerializerTimingMixin, viewsets.ModelViewSet):
     serializer_class = CartItemSerializer
     permission_classes = [IsAuthenticated]
     
     def get_queryset(self):
-        return CartItem.objects.filter(user=self.request.user)
+        return CartItem.objects.filter(user=self.request.user).select_related(
+            'product__category', 'product__retailer'
+        )
     
-    def create(self, request, *args, **kwargs):
-        # Explicitly add the user to the request data
-        data = request.data.copy()
-        
-        # Validate that product exists
-        product_id = data.get('product_id')
-        if product_id:
-            try:
-                Product.objects.get(pk=product_id)
-            except Product.DoesNotExist:
-                return Response(
-                    {"product_id": [f"Invalid pk \"{product_id}\" - object does not exist."]}, 
-                    status=status.HTTP_400_BAD_REQUEST
-                )
-        
-        # Create serializer with modified data
-        serializer = self.get_serializer(data=data)
+    @action(detail=False, methods=['post'])
+    def batch(self, request):
+        """
+        Apply ``{"operations": [{"op": "add" | "update" | "remove",
+        "product_id": ..., "quantity": ...}, ...]}`` in one transaction and
+        return the whole cart, so an offline cart syncs in one round trip.
+        """
+        serializer = CartBatchSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
-        
-        # Save with user
-        serializer.save(user=request.user)
-        
-        headers = self.get_success_headers(serializer.data)
-        return Response(
-            serializer.data, 
-            status=status.HTTP_201_CREATED, 
-            headers=headers
-        )
+        errors = apply_cart_operations(request.user.pk, serializer.validated_data['operations'])
+        if errors:
+            return Response({"operations": errors}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(self.get_serializer(self.get_queryset(), many=True).data)
     
     @action(detail=False, methods=['get'])
     def cart_total(self, request):
-        cart_items = CartItem.objects.filter(user=request.user)
-        total = sum(item.total_price for item in cart_items)
-        return Response({"total": total})
+        summary = get_cart_summary(request.user.pk)
+        return Response({"total": summary['subtotal'], **summary})
 
-class WishlistViewSet(viewsets.ModelViewSet):
+class WishlistViewSet(SerializerTimingMixin, viewsets.ModelViewSet):
     serializer_class = WishlistSerializer
     permission_classes = [IsAuthenticated]
     
     def get_queryset(self):
-        return Wishlist.objects.filter(user=self.request.user)
+        return Wishlist.objects.filter(user=self.request.user).select_related(
+            'product__category', 'product__retailer'
+        )
     
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
 
-class OrderViewSet(viewsets.ModelViewSet):
+class OrderViewSet(ConditionalGetMixin, SerializerTimingMixin, viewsets.ModelViewSet):
     serializer_class = OrderSerializer
+    pagination_class = CatalogPagination
     permission_classes = [IsAuthenticated]
+    conditional_per_user = True
+    
+    def validator_aggregates(self):
+        # Orders nest their items' products; a retailer's orders join one
+        # row per link, hence the distinct count
+        return {
+            'updated_at': Max('updated_at'),
+            'product_updated_at': Max('items__product__updated_at'),
+            'count': Count('pk', distinct=True),
+        }
     
     def get_queryset(self):
         if self.request.user.is_staff:
-            return Order.objects.all()
-        elif hasattr(self.request.user, 'retailer'):
-            # Retailers can see orders containing their products
-            try:
-                retailer = Retailer.objects.get(user=self.request.user)
-                retailer_product_ids = Product.objects.filter(retailer=retailer).values_list('id', flat=True)
-                return Order.objects.filter(items__product__id__in=retailer_product_ids).distinct()
-            except Retailer.DoesNotExist:
-                return Order.objects.none()
+            queryset = Order.objects.all()
+        elif self.request.user.user_type == 'retailer' and hasattr(self.request.user, 'retailer_profile'):
+            # Retailers can see orders containing their products. Ordering by
+            # the link's columns walks retailer_order_inbox_idx.
+            queryset = Order.objects.filter(
+                retailer_links__retailer=self.request.user.retailer_profile
+            ).order_by('-retailer_links__created_at', '-retailer_links__order_id')
+            return self.prefetch_items(queryset)
         else:
-            return Order.objects.filter(user=self.request.user)
+            queryset = Order.objects.filter(user=self.request.user)
+        return self.prefetch_items(queryset.order_by('-created_at', '-id'))
+    
+    def prefetch_items(self, queryset):
+        # OrderSerializer nests items -> product -> category/retailer
+        return queryset.prefetch_related(Prefetch(
+            'items',
+            queryset=OrderItem.objects.select_related('product__category', 'product__retailer')
+        ))
     
     def create(self, request, *args, **kwargs):
-        # Get cart items
-        cart_items = CartItem.objects.filter(user=request.user)
+        data = request.data.copy()
+        try:
+            shipping_cost = Decimal(str(data.get('shipping_cost', 0)))
+            if not shipping_cost.is_finite():
+                raise InvalidOperation
+        except InvalidOperation:
+            return Response({"shipping_cost": ["A valid number is required."]}, status=status.HTTP_400_BAD_REQUEST)
+        
+        cart_quantity = CartItem.objects.filter(
+            user=request.user, product=OuterRef('pk')
+        ).values('product').annotate(total=Sum('quantity')).values('total')
+        
+        try:
+            with transaction.atomic():
+                order = self.place_order(request, data, shipping_cost, cart_quantity)
+        except InsufficientStock as exc:
+            # The reservation has been rolled back, so current stock is accurate
+            short = Product.objects.filter(pk__in=exc.product_ids).filter(
+                Q(is_active=False) | Q(stock__lt=Subquery(cart_quantity))
+            ).values_list('id', flat=True)
+            return Response(
+                {"detail": "Insufficient stock", "products": list(short)},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        order = self.prefetch_items(Order.objects.filter(pk=order.pk)).get()
+        serializer = OrderSerializer(order)
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+    
+    def place_order(self, request, data, shipping_cost, cart_quantity):
+        # Any exception raised here rolls back the whole checkout
+        # Reserve stock first: a single conditional UPDATE takes the write
+        # lock up front and only touches products with enough stock left.
+        reserved = Product.objects.filter(
+            id__in=CartItem.objects.filter(user=request.user).values('product'),
+            is_active=True,
+            stock__gte=Subquery(cart_quantity)
+        ).update(stock=F('stock') - Subquery(cart_quantity), updated_at=timezone.now())
         
+        cart_items = list(CartItem.objects.filter(user=request.user).select_related('product'))
         if not cart_items:
-            return Response({"detail": "Cart is empty"}, status=status.HTTP_400_BAD_REQUEST)
+            raise ValidationError({"detail": "Cart is empty"})
         
-        # Create order
-        data = request.data.copy()
+        product_ids = {item.product_id for item in cart_items}
+        if reserved != len(product_ids):
+            raise InsufficientStock(product_ids)
+        # The stock UPDATE bypasses model signals
+        transaction.on_commit(lambda: invalidate_products(product_ids))
         
         # Calculate order totals
         subtotal = sum(item.product.price * item.quantity for item in cart_items)
-        shipping_cost = data.get('shipping_cost', 0)
         
-        # Apply promo code if provided
-        promo_discount = 0
+        # Apply promo code if provided; below its minimum order value it's worth nothing
+        promo_discount = Decimal('0.00')
         promo_code = data.get('promo_code')
         if promo_code:
-            try:
-                promo = PromoCode.objects.get(
-                    code=promo_code,
-                    is_active=True,
-                    valid_from__lte=timezone.now(),
-                    valid_to__gte=timezone.now()
-                )
-                
-                if subtotal >= promo.minimum_order_value:
-                    if promo.discount_percentage:
-                        promo_discount = (subtotal * promo.discount_percentage) / 100
-                    else:
-                        promo_discount = promo.discount_amount
-            except PromoCode.DoesNotExist:
-                return Response({"detail": "Invalid promo code"}, status=status.HTTP_400_BAD_REQUEST)
+            promo = get_active_promo(promo_code)
+            if promo is None:
+                raise ValidationError({"detail": "Invalid promo code"})
+            promo_discount = calculate_discount(promo, subtotal)
         
         # Calculate total
         total = subtotal + shipping_cost - promo_discount
@@ -330,7 +559,6 @@ class OrderViewSet(viewsets.ModelViewSet):
         # Generate unique order number
         order_number = f"ORD-{get_random_string(8).upper()}"
         
-        # Create order
         order = Order.objects.create(
             user=request.user,
             order_number=order_number,
@@ -341,23 +569,26 @@ class OrderViewSet(viewsets.ModelViewSet):
             promo_code=promo_code,
             promo_discount=promo_discount
         )
-        
-        # Create order items
-        for cart_item in cart_items:
-            OrderItem.objects.create(
+        OrderItem.objects.bulk_create([
+            OrderItem(
                 order=order,
                 product=cart_item.product,
                 price=cart_item.product.price,
                 quantity=cart_item.quantity
             )
+            for cart_item in cart_items
+        ])
+        RetailerOrder.objects.bulk_create([
+            RetailerOrder(retailer_id=retailer_id, order=order, created_at=order.created_at)
+            for retailer_id in {item.product.retailer_id for item in cart_items}
+        ])
         
         # Clear the cart
-        cart_items.delete()
+        CartItem.objects.filter(pk__in=[item.pk for item in cart_items]).delete()
         
-        serializer = OrderSerializer(order)
-        return Response(serializer.data, status=status.HTTP_201_CREATED)
+        return order
 
-class PromoCodeViewSet(viewsets.ModelViewSet):
+class PromoCodeViewSet(SerializerTimingMixin, viewsets.ModelViewSet):
     queryset = PromoCode.objects.all()
     serializer_class = PromoCodeSerializer
     
@@ -365,60 +596,56 @@ class PromoCodeViewSet(viewsets.ModelViewSet):
         if self.action == 'validate':
             permission_classes = [IsAuthenticated]
         else:
-            permission_classes = [IsRetailerOrAdmin]
+            permission_classes = [IsAdminUser]
         return [permission() for permission in permission_classes]
     
     @action(detail=False, methods=['post'])
     def validate(self, request):
         code = request.data.get('code')
-        cart_total = request.data.get('cart_total', 0)
         
         if not code:
             return Response({"detail": "Promo code is required"}, status=status.HTTP_400_BAD_REQUEST)
-        
         try:
-            promo = PromoCode.objects.get(
-                code=code,
-                is_active=True,
-                valid_from__lte=timezone.now(),
-                valid_to__gte=timezone.now()
-            )
-            
-            if cart_total < promo.minimum_order_value:
-                return Response({
-                    "valid": False,
-                    "detail": f"Minimum order value of ${promo.minimum_order_value} required"
-                })
-            
-            # Calculate discount
-            if promo.discount_percentage:
-                discount = (float(cart_total) * promo.discount_percentage) / 100
-            else:
-                discount = float(promo.discount_amount)
-            
+            cart_total = Decimal(str(request.data.get('cart_total', 0)))
+            if not cart_total.is_finite():
+                raise InvalidOperation
+        except InvalidOperation:
+            return Response({"cart_total": ["A valid number is required."]}, status=status.HTTP_400_BAD_REQUEST)
+        
+        promo = get_active_promo(code)
+        if promo is None:
+            return Response({"valid": False, "detail": "Invalid or expired promo code"})
+        
+        if cart_total < promo.minimum_order_value:
             return Response({
-                "valid": True,
-                "discount": discount,
-                "discount_type": "percentage" if promo.discount_percentage else "amount",
-                "discount_value": promo.discount_percentage or promo.discount_amount
+                "valid": False,
+                "detail": f"Minimum order value of ${promo.minimum_order_value} required"
             })
-            
-        except PromoCode.DoesNotExist:
-            return Response({"valid": False, "detail": "Invalid or expired promo code"})
+        
+        return Response({
+            "valid": True,
+            # Clients read the discount as a float
+            "discount": float(calculate_discount(promo, cart_total)),
+            "discount_type": "percentage" if promo.discount_percentage else "amount",
+            "discount_value": promo.discount_percentage or promo.discount_amount
+        })
 
-class ReviewViewSet(viewsets.ModelViewSet):
+class ReviewViewSet(SerializerTimingMixin, viewsets.ModelViewSet):
     serializer_class = ReviewSerializer
+    pagination_class = CatalogPagination
     permission_classes = [IsAuthenticated]
     
     def get_queryset(self):
         if self.request.query_params.get('product'):
-            return Review.objects.filter(product_id=self.request.query_params.get('product'))
-        return Review.objects.filter(user=self.request.user)
+            queryset = Review.objects.filter(product_id=self.request.query_params.get('product'))
+        else:
+            queryset = Review.objects.filter(user=self.request.user)
+        return queryset.select_related('user').order_by('-created_at', '-id')
     
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
 
-class BinaryFileViewSet(viewsets.ModelViewSet):
+class BinaryFileViewSet(SerializerTimingMixin, viewsets.ModelViewSet):
     queryset = BinaryFile.objects.all()
     serializer_class = BinaryFileSerializer
     
@@ -432,8 +659,11 @@ class BinaryFileViewSet(viewsets.ModelViewSet):
     @action(detail=True, methods=['get'])
     def download(self, request, pk=None):
         binary_file = self.get_object()
-        return Response({
-            'name': binary_file.name,
-            'content': binary_file.content,
-            'file_type': binary_file.file_type
-        })
+        return blob_response(
+            request,
+            get_blob_store(),
+            binary_file.sha256,
+            binary_file.size,
+            binary_file.file_type,
+            binary_file.name
+        )
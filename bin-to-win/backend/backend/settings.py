@@ -10,6 +10,8 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 
+import os
+from datetime import timedelta
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -44,6 +46,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # First, so its wall time covers every other middleware (api/metrics.py)
+    'api.metrics.PerformanceMiddleware',
+    'api.compression.CompressionMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -78,13 +83,60 @@ WSGI_APPLICATION = 'backend.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+#
+# Chosen by DB_ENGINE: 'sqlite' (default) or 'postgresql'. The other DB_*
+# variables fill in the connection details.
+
+DB_ENGINE = os.environ.get('DB_ENGINE', 'sqlite')
+
+if DB_ENGINE == 'postgresql':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('DB_NAME', 'bin_to_win'),
+            'USER': os.environ.get('DB_USER', 'bin_to_win'),
+            'PASSWORD': os.environ.get('DB_PASSWORD', ''),
+            'HOST': os.environ.get('DB_HOST', 'localhost'),
+            'PORT': os.environ.get('DB_PORT', '5432'),
+            # Reuse each worker's connection across requests instead of
+            # reconnecting for every one; check it is alive before reuse.
+            'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', 600)),
+            'CONN_HEALTH_CHECKS': True,
+            # Set DB_POOLER=1 behind PgBouncer in transaction mode, where a
+            # server-side cursor can't outlive its transaction.
+            'DISABLE_SERVER_SIDE_CURSORS': os.environ.get('DB_POOLER') == '1',
+        }
+    }
+    # Comma separated read replica hosts, e.g. DB_REPLICA_HOSTS=replica1,replica2
+    for number, host in enumerate(filter(None, os.environ.get('DB_REPLICA_HOSTS', '').split(',')), start=1):
+        DATABASES[f'replica_{number}'] = {
+            **DATABASES['default'],
+            'HOST': host.strip(),
+            'TEST': {'MIRROR': 'default'},
+        }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.environ.get('DB_NAME', BASE_DIR / 'db.sqlite3'),
+            'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', 0)),
+        }
     }
+
+# Run on every new SQLite connection (api/db.py): readers don't block the
+# writer, and a blocked writer waits up to busy_timeout ms for the lock.
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'busy_timeout': 5000,
+    'synchronous': 'NORMAL',
 }
 
+# Reads of the catalog viewsets go to these aliases (api/db.py), except for
+# DATABASE_REPLICA_LAG seconds after a write from the same process.
+DATABASE_REPLICAS = [alias for alias in DATABASES if alias.startswith('replica_')]
+DATABASE_REPLICA_LAG = float(os.environ.get('DB_REPLICA_LAG', 2))
+DATABASE_ROUTERS = ['api.db.PrimaryReplicaRouter']
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -105,6 +157,24 @@ AUTH_PASSWORD_VALIDATORS = [
 ]
 
 
+# Password hashing. api.hashers.PBKDF2PasswordHasher reads its iteration
+# count from PASSWORD_HASH_ITERATIONS, which sets the CPU cost of every login.
+# Stored hashes are re-encoded at the configured cost on the user's next login.
+PASSWORD_HASHERS = [
+    'api.hashers.PBKDF2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.Argon2PasswordHasher',
+    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+    'django.contrib.auth.hashers.ScryptPasswordHasher',
+]
+PASSWORD_HASH_ITERATIONS = 720000
+
+# API tokens (api.models.ExpiringToken) expire AUTH_TOKEN_LIFETIME after
+# their last use; use extends them at most once per AUTH_TOKEN_REFRESH_INTERVAL.
+AUTH_TOKEN_LIFETIME = timedelta(days=7)
+AUTH_TOKEN_REFRESH_INTERVAL = timedelta(hours=1)
+
+
 # Internationalization
 # https://docs.djangoproject.com/en/4.2/topics/i18n/
 
@@ -126,6 +196,94 @@ STATIC_URL = 'static/'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Resized copies of uploaded images (api/images.py), rendered by a thread
+# pool in each worker process. Turn IMAGE_RENDITIONS_ASYNC off to render
+# inside the request that uploaded the image instead.
+IMAGE_RENDITION_WORKERS = int(os.environ.get('IMAGE_RENDITION_WORKERS', 2))
+IMAGE_RENDITIONS_ASYNC = True
+# Rendition file names hash their content, so the web server can let
+# clients cache them forever, e.g. for nginx:
+#     location /media/renditions/ {
+#         alias <MEDIA_ROOT>/renditions/;
+#         add_header Cache-Control "public, max-age=31536000, immutable";
+#     }
+RENDITION_CACHE_CONTROL = {'public': True, 'max_age': 31536000, 'immutable': True}
+
+# Content-addressed storage for BinaryFile uploads. Kept outside MEDIA_ROOT
+# so downloads always go through BinaryFileViewSet's permission checks.
+BINARY_FILE_ROOT = BASE_DIR / 'binary_files'
+# Set to 'x-accel-redirect' (nginx) or 'x-sendfile' (Apache/lighttpd) to let
+# the web server stream downloads. For nginx, BINARY_FILE_ACCEL_PREFIX must be
+# an internal location aliased to BINARY_FILE_ROOT.
+BINARY_FILE_SENDFILE = None
+BINARY_FILE_ACCEL_PREFIX = '/protected/binary-files/'
+
+# Caches. 'catalog' holds public product/category responses (see
+# api/catalog_cache.py). LocMemCache is a per-process LRU; to share entries
+# between workers use a file-based cache:
+#     'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+#     'LOCATION': BASE_DIR / 'cache' / 'catalog',
+# or anything that speaks the Redis protocol (Redis, Valkey, KeyDB):
+#     'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+#     'LOCATION': 'redis://127.0.0.1:6379/1',
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'catalog': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'catalog',
+        # Entries are invalidated on write; the timeout only bounds staleness
+        # from writes that bypass model signals.
+        'TIMEOUT': 300,
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    },
+    # Token -> user snapshots for api.authentication.CachedTokenAuthentication.
+    # Logging out or saving a user only clears the entry in this process, so
+    # with LocMemCache other workers accept a revoked token until their entry
+    # expires: keep TIMEOUT to a few seconds. Behind more than one worker, use
+    # a shared backend (see above), which revokes everywhere at once and can
+    # take a longer TIMEOUT.
+    'tokens': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'tokens',
+        'TIMEOUT': 10,
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    },
+}
+CATALOG_CACHE_ENABLED = os.environ.get('CATALOG_CACHE_ENABLED', '1') == '1'
+
+# Serve the hottest catalog reads from the native async views in
+# api/async_views.py. backend/asgi.py turns this on; under WSGI the DRF
+# viewsets serve them without an event loop per request.
+ASYNC_CATALOG_VIEWS = os.environ.get('ASYNC_CATALOG_VIEWS') == '1'
+
+# Requests slower than this are logged with their SQL (api/metrics.py).
+# /api/metrics/ is open to staff, to scrapers sending METRICS_TOKEN as a
+# bearer token and to scrapers from METRICS_ALLOWED_IPS. Behind a reverse
+# proxy every request comes from the proxy's address, so prefer the token.
+SLOW_REQUEST_SECONDS = float(os.environ.get('SLOW_REQUEST_SECONDS', 0.5))
+# Statements are logged without their parameters, which include tokens,
+# password hashes and personal data; only turn this on while debugging.
+SLOW_REQUEST_LOG_PARAMS = os.environ.get('SLOW_REQUEST_LOG_PARAMS') == '1'
+METRICS_ALLOWED_IPS = [ip for ip in os.environ.get('METRICS_ALLOWED_IPS', '').split(',') if ip]
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'api': {'handlers': ['console'], 'level': 'INFO'},
+    },
+}
+
+# Percent taken off a product's price by the expiry engine
+# (manage.py run_expiry_engine), keyed by days left: 0 = expires today.
+EXPIRY_MARKDOWNS = {7: 15, 3: 30, 0: 50}
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 
@@ -170,13 +328,24 @@ AUTH_USER_MODEL = 'api.User'
 # Django Rest Framework settings
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'api.authentication.CachedTokenAuthentication',
         'rest_framework.authentication.SessionAuthentication',
         'rest_framework.authentication.BasicAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
     ],
+    'DEFAULT_RENDERER_CLASSES': [
+        # orjson-encoded, same output as rest_framework.renderers.JSONRenderer
+        'api.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 10
 }
+
+# Response compression (api/compression.py): bodies smaller than this are
+# sent as they are, since a packet or two costs the same either way.
+COMPRESSION_MIN_SIZE = int(os.environ.get('COMPRESSION_MIN_SIZE', 1024))
+COMPRESSION_GZIP_LEVEL = int(os.environ.get('COMPRESSION_GZIP_LEVEL', 6))
+COMPRESSION_BROTLI_QUALITY = int(os.environ.get('COMPRESSION_BROTLI_QUALITY', 5))
@@ -15,15 +15,18 @@ Including another URLconf
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import path, re_path, include
 from django.conf import settings
 from django.conf.urls.static import static
+from django.views.decorators.cache import cache_control
+from django.views.static import serve
 from rest_framework.routers import DefaultRouter
 from rest_framework.authtoken.views import obtain_auth_token
+from api.images import RENDITION_DIR
 from api.views import (
     UserViewSet, CategoryViewSet, RetailerViewSet, ProductViewSet,
     CartItemViewSet, WishlistViewSet, OrderViewSet, PromoCodeViewSet,
-    ReviewViewSet, BinaryFileViewSet, CustomAuthToken
+    ReviewViewSet, BinaryFileViewSet, CustomAuthToken, CatalogCacheStatsView, MetricsView
 )
 
 router = DefaultRouter()
@@ -42,9 +45,29 @@ urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/', include(router.urls)),
     path('api/token-auth/', CustomAuthToken.as_view(), name='token_auth'),
+    path('api/catalog-cache/stats/', CatalogCacheStatsView.as_view(), name='catalog_cache_stats'),
+    path('api/metrics/', MetricsView.as_view(), name='metrics'),
     path('api-auth/', include('rest_framework.urls')),
 ]
 
-# Serve media files in development
+# Under ASGI the hottest catalog reads bypass DRF; see api/async_views.py
+if settings.ASYNC_CATALOG_VIEWS:
+    from api import async_views
+
+    urlpatterns = [
+        path('api/products/', async_views.product_list),
+        re_path(r'^api/products/(?P<pk>\d+)/$', async_views.product_detail),
+        path('api/categories/', async_views.category_list),
+        path('api/cart-items/cart_total/', async_views.cart_total),
+    ] + urlpatterns
+
+# Serve media files in development; renditions are immutable (api/images.py)
 if settings.DEBUG:
+    urlpatterns += [
+        re_path(
+            rf'^{settings.MEDIA_URL.lstrip("/")}(?P<path>{RENDITION_DIR}/.*)$',
+            cache_control(**settings.RENDITION_CACHE_CONTROL)(serve),
+            {'document_root': settings.MEDIA_ROOT},
+        ),
+    ]
     urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)